@@ -59,16 +59,33 @@ Getting started
 """
 
 import os
+import re
+import copy
 import json
+import hashlib
+import inspect
+import functools
 import urllib
 import httplib
 import warnings
 import ConfigParser
 import logging
 import gzip
+import zlib
+import errno
+import select
 import time
 import socket
+import ssl
+import sys
+import email.utils
+import threading
+import multiprocessing
+import multiprocessing.pool
+import Queue
+import tempfile
 from cStringIO import StringIO
+from collections import OrderedDict
 
 msgpack = None
 try:
@@ -91,6 +108,11 @@ DECOMPOSABLE_RISK_FUNCTIONS = [
     'potential_upside', 'var', 'volatility',
 ]
 
+RISK_DECOMPOSITION_FIELDS = [
+    'contribution_pct', 'contribution_risk',
+    'marginal_pct', 'marginal_risk',
+]
+
 class HTTPError(Exception):
     def __init__(self, code, msg=None):
         if msg is None:
@@ -105,14 +127,376 @@ class RiskapiClientError(Exception):
     pass
 
 
-class HTTPClient(object):
+class ResponseTooLarge(RiskapiClientError):
+    pass
+
+
+class HostUnavailable(RiskapiClientError):
+    """raised by HTTPClient when a request failed on all its tries"""
+
+
+class Overloaded(Exception):
+    """raised by HTTPClient when the server asks to retry after delay seconds"""
+
+    def __init__(self, delay):
+        super(Overloaded, self).__init__("Server asked to retry after %s seconds" % delay)
+        self.delay = delay
+
+
+class SpooledBody(object):
+    """
+    a response body spooled to a temporary file, decoded only on demand.
+    Call close when done to remove the file.
+    """
+
+    # bytes read from the file at a time by the msgpack decoder
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, file, size, format, gzipped=False):
+        self.file = file
+        self.size = size
+        self.format = format
+        self.gzipped = gzipped
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def open(self):
+        """return a file object reading the (uncompressed) body from the start"""
+
+        self.file.seek(0)
+        if self.gzipped:
+            return gzip.GzipFile(fileobj=self.file, mode="rb")
+        return self.file
+
+    def decode(self):
+        """
+        decode the whole body: msgpack bodies are read a chunk at a time,
+        json and undecoded ones are read whole first
+        """
+
+        if self.format == "json":
+            return json.load(self.open())
+        elif self.format == "msgpack":
+            return msgpack.Unpacker(self.open(), read_size=self.READ_SIZE).unpack()
+        return self.open().read()
+
+    def stream(self):
+        """
+        yield the items of the top level array, or the (key, value) pairs of
+        the top level object, one at a time: with msgpack only one item is
+        decoded in memory, json bodies are decoded first
+        """
+
+        if self.format == "msgpack":
+            # the type of the top level object is in its first byte
+            first = self.open().read(1)
+            unpacker = msgpack.Unpacker(self.open(), read_size=self.READ_SIZE)
+            if first and (0x80 <= ord(first) <= 0x8f or first in "\xde\xdf"):
+                for _ in xrange(unpacker.read_map_header()):
+                    yield unpacker.unpack(), unpacker.unpack()
+            elif first and (0x90 <= ord(first) <= 0x9f or first in "\xdc\xdd"):
+                for _ in xrange(unpacker.read_array_header()):
+                    yield unpacker.unpack()
+            else:
+                raise RiskapiClientError("Not a msgpack array or map")
+        else:
+            data = self.decode()
+            if isinstance(data, dict):
+                data = data.iteritems()
+            for item in data:
+                yield item
+
+
+class SingleFlight(object):
+    """
+    collapse concurrent identical calls: while a call with a given key is
+    in flight, the other callers with the same key wait for it and receive
+    a copy of its result (or its exception) instead of performing the call
+    again, so that every caller can modify its own result
+    """
+
+    class Call(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = dict(requests=0, executed=0, coalesced=0)
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            self.stats['requests'] += 1
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = self.Call()
+                leader = True
+                self.stats['executed'] += 1
+            else:
+                leader = False
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func(*args, **kwargs)
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+        # the waiters are copying the result meanwhile, the leader gets a copy too
+        if call.waiters:
+            return copy.deepcopy(call.result)
+        return call.result
+
+
+def decode_body(body, format, gzipped=False, postprocess=None):
+    """
+    decode a response body (a string) of the given format (json, msgpack or
+    None to leave it undecoded) and apply postprocess to the result. This is
+    what the decoding processes of HTTPClient run, so postprocess must be a
+    module level function.
+    """
+
+    if gzipped:
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+    if format == "json":
+        data = json.loads(body)
+    elif format == "msgpack":
+        data = msgpack.unpackb(body)
+    else:
+        data = str(body)
+
+    if postprocess is not None:
+        data = postprocess(data)
+    return data
+
+
+def map_concurrently(func, items, max_workers):
+    """
+    call func on each item using up to max_workers threads and return the
+    results in the same order of items. If any call fails, the remaining
+    items are not processed and the first exception is raised. The spans
+    started by func are children of the active span of the calling thread.
+    """
+
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    queue = Queue.Queue()
+    for pos, item in enumerate(items):
+        queue.put((pos, item))
+
+    results = [None] * len(items)
+    errors = []
+    parent = tracing.current_span()
+
+    def worker():
+        while not errors:
+            try:
+                pos, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                with tracing.activate(parent):
+                    results[pos] = func(item)
+            except:
+                errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for _ in xrange(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+    return results
+
+
+class HTTPConnection(httplib.HTTPConnection):
+    """httplib connection reporting the time spent connecting to on_connect"""
+
+    on_connect = None
+
+    def connect(self):
+        start = time.time()
+        httplib.HTTPConnection.connect(self)
+        if self.on_connect is not None:
+            self.on_connect(time.time() - start, 0.0)
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    """
+    httplib connection reporting the time spent in the tcp connection and
+    in the tls handshake to on_connect
+    """
+
+    on_connect = None
+
+    def connect(self):
+        start = time.time()
+        httplib.HTTPConnection.connect(self)
+        connected = time.time()
+
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname)
+
+        if self.on_connect is not None:
+            self.on_connect(connected - start, time.time() - connected)
+
+
+class PaginatedMixin(object):
+    """fetch_paginated for the http clients, built on their get method"""
+
+    # seconds a page should take to download when the page size is adaptive
+    PAGE_TIME = 2.0
+
+    def fetch_paginated(self, url, page_size, extra_params, headers=None, min_page_size=None,
+                        max_page_size=None):
+        """
+        get all the pages of a paginated resource, starting with page_size
+        items per page. When min_page_size and max_page_size are given the
+        page size adapts within them to the observed throughput, so that a
+        page takes about PAGE_TIME seconds: large pages on fast links,
+        small ones on slow links or when the server is slow to respond.
+        """
+
+        adaptive = min_page_size is not None and max_page_size is not None
+
+        results = []
+        start = 0
+        total_count = None
+        while total_count is None or start < total_count:
+            params = dict(start=start, limit=page_size)
+            if extra_params:
+                params.update(extra_params)
+
+            begin = time.time()
+            data = self.get(url, params, headers)
+            elapsed = time.time() - begin
+
+            total_count = data['count']
+            if not data['data']:
+                break
+
+            # the server may return less items than requested
+            results += data['data']
+            start += len(data['data'])
+
+            if adaptive:
+                page_size = self._next_page_size(page_size, len(data['data']), elapsed,
+                                                 min_page_size, max_page_size)
+        return results
+
+    def _next_page_size(self, page_size, items, elapsed, min_page_size, max_page_size):
+        # items per second, latency included: a slow server shrinks the pages
+        # as much as a slow link. Changes are limited to a factor 2 per page.
+        rate = items / max(elapsed, 1e-3)
+        target = int(rate * self.PAGE_TIME)
+        target = max(page_size // 2, min(page_size * 2, target))
+        target = max(min_page_size, min(max_page_size, target))
+
+        LOG.debug("Page of %s items in %.2fs, next page size %s", items, elapsed, target)
+        return target
+
+
+class HTTPClient(PaginatedMixin):
     """a simple http client depending only on stdlib stuff"""
 
     block_size = 1024*8
 
-    def __init__(self, scheme, host, port=None, auto_decode=True, retry=6):
+    # statuses meaning that the server is overloaded: the request is retried later
+    OVERLOADED_STATUSES = (httplib.SERVICE_UNAVAILABLE, 429)
+
+    # longest Retry-After delay obeyed, in seconds
+    MAX_RETRY_AFTER = 60.0
+
+    # (pattern, template) of the paths with an id: the concurrency limiter
+    # measures the latency of the template, not of every id
+    ENDPOINT_TEMPLATES = [(re.compile(r"/statics/products/.+$"), "/statics/products/{code}")]
+
+    def __init__(self, scheme, host, port=None, auto_decode=True, retry=6, max_connections=1,
+                 rate_limiter=None, concurrency_limiter=None, ssl_context=None, spare_connections=0,
+                 raw_buffers=False, decode_pool=None, decode_threshold=1024 * 1024,
+                 spill_threshold=None, max_response_size=None, lazy_spill=False, tracer=None,
+                 lazy=False, max_idle=None):
         """
         initialize a new http client.
+
+        Up to max_connections requests can be performed concurrently from
+        different threads, each one on its own connection: connections are
+        opened when needed and kept in a pool for reuse. A first connection
+        is opened right away, unless lazy is True.
+
+        rate_limiter (a throttle.TokenBucket) and concurrency_limiter (a
+        throttle.AIMDLimiter) are optional and can be shared between clients.
+
+        All the https connections share ssl_context (by default the stdlib
+        default https context), so certificates are loaded only once.
+        When spare_connections is set, that many idle connections are kept
+        open in background, as long as max_connections is not reached: they
+        are opened again whenever a request takes one, and a connection
+        failing during a request is replaced by a spare one instead of
+        paying a new handshake.
+
+        Before an idle connection is reused it is checked: a connection
+        closed by the server meanwhile reads an end of file, and one
+        idle for more than max_idle seconds is likely to be closed by the
+        server at any time. Such connections are opened again before the
+        request is sent, instead of failing it and retrying after a
+        backoff. Connection timings and the counts of reused, stale and
+        expired connections are available in connect_stats.
+
+        Response bodies with a known length are read straight from the
+        socket into reusable buffers and msgpack and gzip bodies are decoded
+        from there without intermediate copies. When auto_decode is False
+        and raw_buffers is True, bodies are returned as memoryviews instead
+        of strings, e.g. to forward them unchanged.
+
+        decode_pool is an optional multiprocessing.Pool: json and msgpack
+        bodies of at least decode_threshold bytes are decoded there, so the
+        thread waiting for them does not hold the GIL for the whole decoding.
+        The result still has to be unpickled, this pays off most when get()
+        and post() are given a postprocess function which reduces it.
+
+        Response bodies bigger than spill_threshold bytes are written to a
+        temporary file while they are received, then decoded from there:
+        msgpack bodies are read a chunk at a time, so the raw and the
+        decoded body are not held in memory together, but json bodies are
+        read whole by the json module. With lazy_spill they are not decoded
+        at all: a SpooledBody is returned instead, whose stream method
+        decodes msgpack bodies one top level item at a time. A body of more than max_response_size bytes raises
+        ResponseTooLarge (the size is the one sent by the server, before
+        gzip decompression).
+
+        Every request is sent with a new X-Request-ID header. With a tracer
+        (see the tracing module) the requests are traced, otherwise they are
+        only when a span is active in the calling thread.
         """
 
         if scheme not in ('http', 'https'):
@@ -123,27 +507,160 @@ class HTTPClient(object):
         self.port = port
 
         self.auto_decode = auto_decode
+        self.raw_buffers = raw_buffers
+        self.decode_pool = decode_pool
+        self.decode_threshold = decode_threshold
+        self.spill_threshold = spill_threshold
+        self.max_response_size = max_response_size
+        self.lazy_spill = lazy_spill
+        self.tracer = tracer
+        self.max_idle = max_idle
         self.last_request = None
 
         self.retry = retry
 
-        self.conn = self.connect()
+        self.max_connections = max_connections
+        self.pool = Queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+
+        if scheme == 'https' and ssl_context is None:
+            ssl_context = ssl._create_default_https_context()
+        self.ssl_context = ssl_context
+
+        self.stats_lock = threading.Lock()
+        self.connect_stats = dict(connections=0, tcp_time=0.0, tls_time=0.0, last_tcp_time=None,
+                                  last_tls_time=None, max_time=0.0, reused=0, stale=0, expired=0)
+
+        self.buffers = []
+
+        # connections open, idle or in use, and being opened by prewarm
+        self.open_connections = 0
+        self._prewarming = 0
+
+        self.spare_connections = min(spare_connections, max_connections)
+        self._refilling = False
+
+        if not lazy:
+            self._put(self._open())
+        if self.spare_connections:
+            self._refill()
 
     def close(self):
-        self.conn.close()
+        """close all the idle connections"""
+
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except Queue.Empty:
+                break
+            self._discard(conn)
 
     def connect(self):
+        LOG.debug("Connectiong to %s:%s, %s", self.host, self.port, self.scheme)
+
         if self.scheme == 'http':
-            cls = httplib.HTTPConnection
+            conn = HTTPConnection(self.host, self.port)
         else:
-            cls = httplib.HTTPSConnection
+            conn = HTTPSConnection(self.host, self.port, context=self.ssl_context)
 
-        LOG.debug("Connectiong to %s:%s, %s", self.host, self.port, cls.__name__)
-
-        conn = cls(self.host, self.port)
+        # connections are opened again by httplib after a failure
+        conn.on_connect = self._connected
         conn.connect()
         return conn
 
+    def _connected(self, tcp_time, tls_time):
+        LOG.debug("Connected in %.4fs, tls handshake %.4fs", tcp_time, tls_time)
+
+        with self.stats_lock:
+            stats = self.connect_stats
+            stats['connections'] += 1
+            stats['tcp_time'] += tcp_time
+            stats['tls_time'] += tls_time
+            stats['last_tcp_time'] = tcp_time
+            stats['last_tls_time'] = tls_time
+            stats['max_time'] = max(stats['max_time'], tcp_time + tls_time)
+
+    def prewarm(self, count):
+        """
+        open new connections until count of them are idle in the pool,
+        without opening more than max_connections connections in total
+        """
+
+        while True:
+            with self.stats_lock:
+                if (self.pool.qsize() + self._prewarming >= count or
+                        self.open_connections >= self.max_connections):
+                    return
+                self.open_connections += 1
+                self._prewarming += 1
+
+            try:
+                conn = self.connect()
+            except:
+                with self.stats_lock:
+                    self.open_connections -= 1
+                raise
+            finally:
+                with self.stats_lock:
+                    self._prewarming -= 1
+            self._put(conn)
+
+    def _open(self):
+        # open a connection for a request holding a slot
+        with self.stats_lock:
+            self.open_connections += 1
+        try:
+            return self.connect()
+        except:
+            with self.stats_lock:
+                self.open_connections -= 1
+            raise
+
+    def _discard(self, conn):
+        conn.close()
+        with self.stats_lock:
+            self.open_connections -= 1
+
+    def _refill(self):
+        # open the spare connections in background, one refill at a time
+        with self.stats_lock:
+            if self._refilling or self.open_connections >= self.max_connections:
+                return
+            self._refilling = True
+
+        def refill():
+            try:
+                self.prewarm(self.spare_connections)
+            except (socket.error, httplib.HTTPException) as e:
+                LOG.debug("Cannot open spare connections: %s", e)
+            finally:
+                with self.stats_lock:
+                    self._refilling = False
+
+        thread = threading.Thread(target=refill)
+        thread.daemon = True
+        thread.start()
+
+    def _replace(self, conn):
+        # swap a failed connection with an open spare one, if any
+        conn.close()
+
+        if not self.spare_connections:
+            return conn
+
+        try:
+            spare = self.pool.get_nowait()
+        except Queue.Empty:
+            return conn
+
+        self._discard(conn)
+        self._refill()
+        self._check_idle(spare)
+        return spare
+
     def __enter__(self):
         return self
 
@@ -152,20 +669,111 @@ class HTTPClient(object):
 
     def reset(self):
         self.close()
-        self.connect()
+        self._put(self._open())
+
+    def _acquire(self):
+        # wait for a free slot, then reuse an idle connection or open a new one
+        self.slots.acquire()
+        try:
+            conn = self.pool.get_nowait()
+        except Queue.Empty:
+            try:
+                conn = self._open()
+            except:
+                self.slots.release()
+                raise
+        else:
+            self._check_idle(conn)
+
+        if self.spare_connections and self.pool.qsize() < self.spare_connections:
+            self._refill()
+        return conn
+
+    def _release(self, conn):
+        self._put(conn)
+        self.slots.release()
+
+    def _put(self, conn):
+        # a connection opened by a request while prewarm was opening the
+        # last ones is not kept
+        with self.stats_lock:
+            excess = self.open_connections > self.max_connections
+            if excess:
+                self.open_connections -= 1
+        if excess:
+            conn.close()
+            return
+
+        conn.idle_since = time.time()
+        self.pool.put(conn)
+
+    def _check_idle(self, conn):
+        # close an idle connection which can't be reused, httplib opens it
+        # again when the request is sent
+        sock = conn.sock
+        if sock is None:
+            return
+
+        idle = time.time() - conn.idle_since
+        if self.max_idle is not None and idle > self.max_idle:
+            reason = 'expired'
+        else:
+            # nothing is expected from an idle connection but the end of
+            # file sent by the server closing it, or tls records without
+            # data such as the tls 1.3 session tickets
+            try:
+                readable = select.select([sock], [], [], 0)[0]
+            except (select.error, socket.error, ValueError):
+                readable = True
+            if not readable or not self._closed(sock):
+                with self.stats_lock:
+                    self.connect_stats['reused'] += 1
+                return
+            reason = 'stale'
+
+        LOG.debug("Reopening %s connection, idle for %.1fs", reason, idle)
+        conn.close()
+        with self.stats_lock:
+            self.connect_stats[reason] += 1
+
+    @staticmethod
+    def _closed(sock):
+        # whether a readable idle socket reached the end of file: tls
+        # sockets process the records received and read no data unless the
+        # connection was closed, other ones are peeked
+        timeout = sock.gettimeout()
+        sock.settimeout(0.0)
+        try:
+            if isinstance(sock, ssl.SSLSocket):
+                sock.recv(1)
+            else:
+                sock.recv(1, socket.MSG_PEEK)
+        except ssl.SSLWantReadError:
+            return False
+        except socket.error as e:
+            return e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)
+        finally:
+            sock.settimeout(timeout)
+        # end of file, or data nobody asked for
+        return True
+
+    def post(self, path, data, headers=None, postprocess=None):
+        """
+        send a POST request and return the decoded response body, to which
+        the postprocess function is applied, possibly in the decode_pool
+        """
 
-    def post(self, path, data, headers=None):
-        return self._request(path, 'POST', data, headers)
+        return self._request(path, 'POST', data, headers, postprocess)
 
-    def get(self, path, params=None, headers=None):
+    def get(self, path, params=None, headers=None, postprocess=None):
         if params:
             url = "%s?%s" % (path, urllib.urlencode(params))
         else:
             url = path
 
-        return self._request(url, 'GET', None, headers)
+        return self._request(url, 'GET', None, headers, postprocess)
 
-    def _decode(self, response):
+    def _decode(self, response, postprocess=None):
         ct = response.getheader('Content-Type')
         ce = response.getheader('Content-Encoding')
         cl = response.getheader('Content-Length')
@@ -174,78 +782,272 @@ class HTTPClient(object):
             LOG.debug("Empty response body")
             return ""
 
-        if ce and ce == "gzip":
-            # this reads the whole response in memory, but json.load() would do the same anyway...
-            data = response.read()
-            response = gzip.GzipFile(fileobj=StringIO(data))
-
         if ct and 'application/json' in ct:
-            LOG.debug("decoding %s", ct)
-            return json.load(response)
+            format = "json"
         elif ct and 'application/x-msgpack' in ct:
             if msgpack:
-                LOG.debug("decoding %s", ct)
-                return msgpack.unpack(response)
+                format = "msgpack"
             else:
                 LOG.debug("not decoding %s, decoder is unavailable", ct)
-                return response.read()
+                format = None
+        else:
+            format = None
+        gzipped = ce and ce == "gzip"
+
+        length = response.length
+        if self.max_response_size is not None and length is not None and length > self.max_response_size:
+            raise ResponseTooLarge("Response of %s bytes exceeds the limit of %s bytes"
+                                   % (length, self.max_response_size))
+
+        if ((self.spill_threshold is not None and (length is None or length > self.spill_threshold)) or
+                (self.max_response_size is not None and length is None)):
+            with tracing.span("download", spooled=True):
+                body = SpooledBody(self._spool(response), length, format, gzipped)
+            if self.lazy_spill:
+                return body
+
+            LOG.debug("decoding %s from a spooled body", ct)
+            with tracing.span("decode", format=format), body:
+                data = body.decode()
+                return postprocess(data) if postprocess is not None else data
+
+        offload = self.decode_pool is not None and format is not None
+        if offload and response.length is not None and response.length < self.decode_threshold:
+            offload = False
+
+        if format == "json" and not gzipped and not offload:
+            # the json module needs a string anyway
+            with tracing.span("download"):
+                data = response.read()
 
-        return response.read()
+            LOG.debug("decoding %s", ct)
+            with tracing.span("decode", format=format):
+                data = json.loads(data)
+                return postprocess(data) if postprocess is not None else data
+
+        with tracing.span("download"):
+            buf, body = self._read_body(response)
+        try:
+            if offload and len(body) >= self.decode_threshold:
+                LOG.debug("decoding %s in the decode pool", ct)
+                with tracing.span("decode", format=format, offloaded=True):
+                    return self.decode_pool.apply(decode_body, (str(body), format, gzipped, postprocess))
+
+            if format is not None:
+                LOG.debug("decoding %s", ct)
+            with tracing.span("decode", format=format):
+                return decode_body(body, format, gzipped, postprocess)
+        finally:
+            if buf is not None:
+                self._put_buffer(buf)
+
+    SPOOL_CHUNK_SIZE = 64 * 1024
+
+    def _spool(self, response):
+        # copy the body to a temporary file, in memory up to spill_threshold
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spill_threshold or 0)
+        try:
+            size = 0
+            while True:
+                chunk = response.read(self.SPOOL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if self.max_response_size is not None and size > self.max_response_size:
+                    raise ResponseTooLarge("Response exceeds the limit of %s bytes" % self.max_response_size)
+                spool.write(chunk)
+        except:
+            spool.close()
+            raise
+
+        return spool
+
+    def _read_body(self, response, pooled=True):
+        """
+        read the whole body of the response, return a (bytearray, buffer)
+        pair: the body is read in place into the bytearray, taken from the
+        pool when pooled is True. When the body can't be read in place
+        (unknown length, chunked encoding) the body is returned as a string
+        with a None bytearray.
+        """
 
-    def _request(self, url, method, body, headers):
-        headers = headers or {}
+        length = response.length
+        fp = response.fp
+
+        # the response file object is unbuffered in httplib, so once the
+        # headers are parsed the body is still in the socket
+        sock = getattr(fp, '_sock', None)
+        if response.chunked or length is None or sock is None or fp._rbuf.tell():
+            return None, response.read()
+
+        buf = self._get_buffer(length) if pooled else bytearray(length)
+        view = memoryview(buf)
+        pos = 0
+        try:
+            while pos < length:
+                try:
+                    read = sock.recv_into(view[pos:length], length - pos)
+                except socket.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not read:
+                    raise httplib.IncompleteRead(view[:pos].tobytes(), length - pos)
+                pos += read
+        except:
+            if pooled:
+                self._put_buffer(buf)
+            raise
+
+        response.length = 0
+        response.close()
+
+        return buf, buffer(buf, 0, length)
+
+    BUFFER_POOL_MAX_SIZE = 64 * 1024 * 1024
+
+    def _get_buffer(self, size):
+        # reuse a pooled buffer, big buffers are not kept
+        try:
+            buf = self.buffers.pop()
+        except IndexError:
+            buf = None
+
+        if buf is None or len(buf) < size:
+            buf = bytearray(max(size, self.block_size))
+        return buf
+
+    def _put_buffer(self, buf):
+        if len(buf) <= self.BUFFER_POOL_MAX_SIZE and len(self.buffers) < self.max_connections:
+            self.buffers.append(buf)
+
+    def _request(self, url, method, body, headers, postprocess=None):
+        # every request has its own id, to find it in the server logs
+        headers = dict(headers) if headers else {}
+        request_id = headers.setdefault('X-Request-ID', tracing.new_id(128))
+
+        if self.tracer is not None:
+            span = self.tracer.span("request", method=method, url=url, request_id=request_id)
+        else:
+            span = tracing.span("request", method=method, url=url, request_id=request_id)
 
+        with span:
+            # the connection can be replaced during the retries
+            holder = [self._acquire()]
+            try:
+                return self._request_on(holder, url, method, body, headers, postprocess)
+            finally:
+                self._release(holder[0])
+
+    def _request_on(self, holder, url, method, body, headers, postprocess=None):
         LOG.debug("Requesting %s %s, headers %s", method, url, headers)
 
         for retry in xrange(self.retry):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if self.concurrency_limiter is not None:
+                self.concurrency_limiter.acquire()
+
+            conn = holder[0]
+            start = time.time()
+            latency = None
+            overloaded = False
+            attempt = tracing.span("attempt", attempt=retry + 1)
             try:
-                self.conn.request(method, url, body, headers)
-
-                response = self.conn.getresponse()
-
-                LOG.debug("Response status %s, headers %s", response.status, response.getheaders())
-
-                self.last_request = (method, url, response.status, response.getheaders())
-
-                if self.auto_decode:
-                    res_body = self._decode(response)
-                else:
-                    res_body = response.read()
-
-                if response.status != httplib.OK:
-                    raise HTTPError(response.status, res_body or None)
-
-                return res_body
+                with attempt:
+                    with tracing.span("send"):
+                        conn.request(method, url, body, headers)
+
+                    with tracing.span("wait"):
+                        response = conn.getresponse()
+                    latency = time.time() - start
+                    attempt.set(status=response.status)
+
+                    LOG.debug("Response status %s, headers %s", response.status, response.getheaders())
+
+                    self.last_request = (method, url, response.status, response.getheaders())
+
+                    return self._response(response, retry, postprocess)
+            except Overloaded as e:
+                overloaded = True
+                delay = e.delay
+
+                # stop all the threads sharing the rate limiter, not just this one
+                if self.rate_limiter is not None:
+                    self.rate_limiter.pause(delay)
+            except ResponseTooLarge:
+                # the rest of the body is still in the connection
+                conn.close()
+                raise
             except (socket.error, httplib.HTTPException) as e:
+                overloaded = True
+                delay = (2**retry)/10.0
                 LOG.debug("Error %s, retrying %s more times in %s seconds",
-                          e, self.retry-retry, (2**retry)/10.0)
-                time.sleep((2**retry)/10.0)
-                self.reset()
-                continue
+                          e, self.retry-retry, delay)
+                # the connection is opened again by the next request
+                holder[0] = self._replace(conn)
+            finally:
+                if self.concurrency_limiter is not None:
+                    if latency is None:
+                        latency = time.time() - start
+                    self.concurrency_limiter.release(latency, overloaded, self._endpoint(method, url))
+
+            if retry == self.retry - 1:
+                break
+
+            LOG.debug("Retrying %s %s in %s seconds", method, url, delay)
+            with tracing.span("backoff", delay=delay):
+                time.sleep(delay)
+
+        raise HostUnavailable("%s %s failed after %s tries" % (method, url, self.retry))
+
+    def _response(self, response, retry, postprocess):
+        # return the body of the response, raise Overloaded when it must be retried
+        if response.status in self.OVERLOADED_STATUSES and retry < self.retry - 1:
+            with tracing.span("download"):
+                response.read()
+            raise Overloaded(self._retry_after(response, retry))
+
+        if self.auto_decode:
+            # error bodies are not post processed
+            res_body = self._decode(response, postprocess if response.status == httplib.OK else None)
         else:
-            raise RiskapiClientError("%s %s failed after %s tries" % (method, url, self.retry))
+            with tracing.span("download"):
+                if self.raw_buffers:
+                    buf, res_body = self._read_body(response, pooled=False)
+                    if buf is not None:
+                        res_body = memoryview(buf)
+                else:
+                    res_body = response.read()
 
-    def fetch_paginated(self, url, page_size, extra_params, headers=None):
-        # get the first page
-        params = dict(start=0, limit=page_size)
-        if extra_params:
-            params.update(extra_params)
-        data = self.get(url, params, headers)
-        total_count = data['count']
+        if response.status != httplib.OK:
+            raise HTTPError(response.status, res_body or None)
 
-        if total_count < page_size:
-            return data['data']
+        return res_body
 
-        requests = (total_count / page_size) + 1
+    @classmethod
+    def _endpoint(cls, method, url):
+        # the method and the path template of url, without the query
+        path = url.split('?', 1)[0]
+        for pattern, template in cls.ENDPOINT_TEMPLATES:
+            path = pattern.sub(template, path)
+        return method + " " + path
 
-        results = data['data']
-        for i in xrange(1, requests):
-            params = dict(start=i * page_size, limit=page_size)
-            if extra_params:
-                params.update(extra_params)
-            data = self.get(url, params, headers)
-            results += data['data']
-        return results
+    @classmethod
+    def _retry_after(cls, response, retry):
+        # delay requested by the server, either seconds or an http date,
+        # never shorter than the exponential backoff nor longer than
+        # MAX_RETRY_AFTER
+        delay = (2**retry)/10.0
+        value = response.getheader('Retry-After')
+        if value:
+            try:
+                requested = float(value)
+            except ValueError:
+                date = email.utils.parsedate_tz(value)
+                requested = email.utils.mktime_tz(date) - time.time() if date is not None else delay
+            delay = max(delay, min(requested, cls.MAX_RETRY_AFTER))
+        return delay
 
 
 class Holding(object):
@@ -275,13 +1077,24 @@ class Portfolio(object):
 
     Holding = Holding
 
+    # netted quantities smaller than this fraction of the largest netted
+    # quantity are rounding errors (0.1 + 0.2 - 0.3) and count as zero
+    ZERO_QUANTITY = 1e-9
+
+
+    def __init__(self, currency, holdings=None, type_="quantities", outstanding=None, coverage_priority=None,
+                 normalize=False):
+        """
+        if normalize is True the portfolio is always encoded normalized,
+        see normalized()
+        """
 
-    def __init__(self, currency, holdings=None, type_="quantities", outstanding=None, coverage_priority=None):
         self.holdings = holdings or []
         self.currency = currency
         self.type = type_
         self.outstanding = outstanding
         self.coverage_priority = coverage_priority
+        self.normalize = normalize
 
     def add(self, code, price=None, quantity=1, currency_exchange_value=None,
             attributes=None, currency=None, price_factor=None):
@@ -292,8 +1105,57 @@ class Portfolio(object):
         self.holdings.append(holding)
         return holding
 
-    def encode(self):
-        """return the data structure expected by riskapi server, ready to be jsonized"""
+    def normalized(self):
+        """
+        return a (portfolio, rows) pair, where portfolio has the holdings
+        with the same code, price, currency exchange value, attributes,
+        currency and price factor netted into a single holding, and the
+        holdings with zero quantity (also after netting, up to
+        ZERO_QUANTITY) removed. rows[i] is
+        the list of the positions of the original holdings netted into the
+        i-th holding of the normalized portfolio.
+        """
+
+        positions = {}
+        holdings = []
+        rows = []
+        scales = []
+        for pos, holding in enumerate(self.holdings):
+            key = (holding.code, holding.price, holding.currency_exchange_value,
+                   tuple(holding.attributes), holding.currency, holding.price_factor)
+
+            i = positions.get(key)
+            if i is None:
+                positions[key] = len(holdings)
+                holdings.append(self.Holding(holding.code, holding.price, holding.quantity,
+                                             holding.currency_exchange_value, list(holding.attributes),
+                                             holding.currency, holding.price_factor))
+                rows.append([pos])
+                scales.append(abs(holding.quantity))
+            else:
+                holdings[i].quantity += holding.quantity
+                rows[i].append(pos)
+                scales[i] = max(scales[i], abs(holding.quantity))
+
+        kept = [i for i, holding in enumerate(holdings)
+                if abs(holding.quantity) > self.ZERO_QUANTITY * scales[i]]
+
+        portfolio = self.__class__(self.currency, [holdings[i] for i in kept], self.type,
+                                   self.outstanding, self.coverage_priority)
+        return portfolio, [rows[i] for i in kept]
+
+    def encode(self, normalize=None):
+        """
+        return the data structure expected by riskapi server, ready to be jsonized.
+        if normalize is True (by default the portfolio normalize attribute)
+        the normalized portfolio is encoded
+        """
+
+        if normalize is None:
+            normalize = self.normalize
+
+        if normalize:
+            return self.normalized()[0].encode(False)
 
         holdings = [x.encode() for x in self.holdings]
         return [dict(currency=self.currency, type=self.type,
@@ -301,15 +1163,27 @@ class Portfolio(object):
                      coverage_priority=self.coverage_priority),
                 holdings]
 
-    def dump(self, file_name):
-        """dump the portfolio to a json file"""
+    def dump(self, file_name, format="json"):
+        """
+        dump the portfolio to a file, by default in json; see the formats
+        module for the other streaming formats (csv, msgpack, columnar).
+        The holdings are dumped as they are, never normalized, in every format
+        """
 
-        with open(file_name, "wb") as ff:
-            json.dump(self.encode(), ff)
+        data = self.encode(False)
+        if format == "json":
+            with open(file_name, "wb") as ff:
+                json.dump(data, ff)
+        else:
+            write_portfolio(file_name, data[0], self.holdings, format)
 
     @classmethod
-    def load(cls, file_name):
-        """load a portfolio from a previously dumped json file"""
+    def load(cls, file_name, format="json"):
+        """load a portfolio from a previously dumped file"""
+
+        if format != "json":
+            with open_portfolio(file_name, format, cls.Holding) as reader:
+                return reader.portfolio(cls)
 
         with open(file_name, "rb") as ff:
             data = json.load(ff)
@@ -319,6 +1193,61 @@ class Portfolio(object):
                    data[0]['outstanding'], data[0]['coverage_priority'])
 
 
+class PreEncoded(str):
+    """
+    a value serialized in advance to the body of the requests in the given
+    format (json or msgpack). In the request data it stands for the value:
+    RiskapiClient replaces its serialization, a string unique to the value,
+    with body, so that the value is not serialized again.
+    """
+
+    def __new__(cls, data, format):
+        if format == "msgpack":
+            body = msgpack.packb(data)
+        else:
+            body = json.dumps(data)
+
+        self = str.__new__(cls, "riskapi-pre-encoded-%s" % hashlib.sha1(body).hexdigest())
+        self.data = data
+        self.format = format
+        self.body = body
+        return self
+
+
+class EncodedPortfolio(object):
+    """
+    a portfolio encoded once and sent with several requests: encode returns
+    always the same PreEncoded value, serialized once in the request format.
+    The other attributes are the ones of the wrapped portfolio.
+    """
+
+    def __init__(self, portfolio, format="json"):
+        self.portfolio = portfolio
+        self.encoded = PreEncoded(portfolio.encode(), format)
+
+    def encode(self, normalize=None):
+        if normalize is not None and normalize != self.portfolio.normalize:
+            return self.portfolio.encode(normalize)
+        return self.encoded
+
+    def __getattr__(self, name):
+        return getattr(self.portfolio, name)
+
+
+def _traced(func):
+    # trace the calls of a RiskapiClient method issuing requests when the
+    # client has a tracer
+    @functools.wraps(func)
+    def traced(self, *args, **kwargs):
+        if self.tracer is None:
+            return func(self, *args, **kwargs)
+        with self.tracer.span(func.__name__):
+            return func(self, *args, **kwargs)
+
+    traced.__wrapped__ = func
+    return traced
+
+
 class RiskapiClient(object):
     """
     HTTP client for StatPro web RiskAPI
@@ -333,22 +1262,120 @@ class RiskapiClient(object):
     if msgpack is not None:
         FORMATS['msgpack'] = "application/x-msgpack"
 
+    # attributes the request headers and urls depend on
+    CONFIG_ATTRIBUTES = frozenset([
+        'customer', 'username', 'password', 'keep_alive', 'request_format', 'response_format',
+        'request_gzip', 'response_gzip', 'API_BASE', 'API_VERSION'])
+
+    URL_CACHE_SIZE = 10000
+
+    WARMUP_DEFAULTS = dict(connections=4, statics=True, catalog=False)
+
+    # seconds a getter waits for the prefetched data before sending its own request
+    WARMUP_TIMEOUT = 60.0
+
+    # tries of a request on the same host when there are several of them,
+    # before it is retried on another one
+    HOST_RETRY = 2
+
+    # report sections: name -> analysis (by default the name) and its parameters
+    REPORT_SPEC = dict(
+        portfolio_info=dict(),
+        risk=dict(params=dict(percentiles=[0.95, 0.99])),
+        stress_test=dict(),
+        liquidity_risk=dict(),
+        risk_decomposition=dict(params=dict(percentile=0.99)),
+    )
+
+    # sections added to the default report when there is a benchmark
+    RELATIVE_REPORT_SPEC = dict(
+        relative_risk_decomposition=dict(params=dict(percentile=0.99)),
+        relative_stress_test_decomposition=dict(),
+    )
+
     def __init__(self, host, customer=None, username=None, password=None, scheme="https",
                  keep_alive=True, request_format="json", response_format="json",
-                 request_gzip=False, response_gzip=False):
-        self.host = host
+                 request_gzip=False, response_gzip=False, coalesce=False, max_connections=8,
+                 rate_limit=None, adaptive_concurrency=False, ssl_context=None, spare_connections=0,
+                 decode_pool=None, decode_threshold=1024 * 1024, warmup=None,
+                 spill_threshold=None, max_response_size=None, lazy_spill=False, tracer=None, max_idle=None,
+                 decomposition_cache=None):
+        """
+        host is either a host name (with an optional port) or several of
+        them, as a list or separated by commas: the requests are then
+        balanced between the hosts, with a pool of max_connections
+        connections for each one, and the failing hosts are ejected for a
+        while, see balancer.BalancedHTTPClient.
+
+        Up to max_connections requests can be performed concurrently by
+        different threads, see HTTPClient.
+
+        rate_limit caps the requests per second, it is either a number or a
+        throttle.TokenBucket shared with other clients. When
+        adaptive_concurrency is True the number of concurrent requests
+        adapts to the server load between 1 and max_connections, see
+        throttle.AIMDLimiter. Both apply to all the threads using the client.
+
+        ssl_context, spare_connections and max_idle (the age after which
+        an idle connection is opened again) are passed to HTTPClient.
+
+        decode_pool is either a multiprocessing.Pool or a number of decoding
+        processes to start: responses of at least decode_threshold bytes are
+        decoded there, see HTTPClient. The pool is best created before any
+        thread is started, a pool started by the client is terminated by
+        close. The multi-level decompositions take a postprocess function,
+        applied to the response in the pool so that only its result is sent
+        back: it must be a module level function.
+
+        spill_threshold and max_response_size bound the memory used by the
+        responses, see HTTPClient. With lazy_spill the responses bigger than
+        spill_threshold are returned as SpooledBody objects, to be decoded
+        or streamed by the caller: only the methods returning the response
+        as it is can be used then.
+
+        tracer is a tracing.Tracer: every method call is traced as a span
+        with the name of the method, see the tracing module.
+
+        warmup starts a background thread preparing the client for the first
+        calls: it is either True or a dict overriding WARMUP_DEFAULTS with
+        the number of connections to open in advance, whether to prefetch
+        the static data (data_info and the available stress test and
+        liquidity risk scenarios) and the whole product catalog. The first
+        call of data_info, available_stress_test_scenarios,
+        available_liquidity_risk_scenarios and products (without arguments)
+        returns the prefetched data, waiting for it if needed. See
+        wait_warmup.
+
+        When coalesce is True, concurrent identical requests (same endpoint
+        and encoded payload) issued from different threads are collapsed into
+        a single HTTP call and every caller receives its own copy of the
+        result. See coalesce_stats.
+
+        decomposition_cache is either True or a projection.DecompositionCache,
+        which can be shared with other clients: the (multi-level, relative)
+        risk decompositions asking for a subset of the functions and fields
+        of a cached one, with the same portfolio and parameters, are
+        answered from the cache.
+
+        The request headers and the resource urls are computed once and
+        reused by all the requests, changing any of the CONFIG_ATTRIBUTES
+        invalidates them.
+        """
+
+        if isinstance(host, basestring):
+            hosts = [x.strip() for x in host.split(',') if x.strip()]
+        else:
+            hosts = list(host)
+        if not hosts:
+            raise RiskapiClientError("No host given")
+
+        self.host = ",".join(hosts)
         self.customer = customer
         self.username = username
         self.password = password
         self.request_gzip = request_gzip
         self.response_gzip = response_gzip
 
-        if ':' in host:
-            name, port = host.split(':')
-            port = int(port)
-        else:
-            name, port = host, None
-
         self.keep_alive = keep_alive
 
         if not request_format in self.FORMATS:
@@ -360,22 +1387,183 @@ class RiskapiClient(object):
         self.request_format = request_format
         self.response_format = response_format
 
-        self.webclient = HTTPClient(scheme, name, port)
-        self._available_resources = self.webclient.get(self._url("system/resources"), headers=self._headers)
+        self.tracer = tracer
+        self.single_flight = SingleFlight() if coalesce else None
+
+        if decomposition_cache is True:
+            decomposition_cache = DecompositionCache()
+        self.decomposition_cache = decomposition_cache
+        self.sinks = []
+
+        self._products_cache = OrderedDict()
+        self._products_cache_version = None
+        self._products_cache_checked = None
+        self._products_cache_lock = threading.Lock()
+
+        if rate_limit is not None and not isinstance(rate_limit, TokenBucket):
+            rate_limit = TokenBucket(rate_limit)
+
+        # only the pool started here is owned by the client
+        self._decode_pool = None
+        if decode_pool is not None and not isinstance(decode_pool, multiprocessing.pool.Pool):
+            decode_pool = self._decode_pool = multiprocessing.Pool(decode_pool)
+
+        if scheme == 'https' and ssl_context is None:
+            ssl_context = ssl._create_default_https_context()
+
+        clients = []
+        for item in hosts:
+            if ':' in item:
+                name, port = item.split(':')
+                port = int(port)
+            else:
+                name, port = item, None
+
+            # each host has its own load
+            if adaptive_concurrency:
+                concurrency_limiter = AIMDLimiter(initial=min(4, max_connections), maximum=max_connections)
+            else:
+                concurrency_limiter = None
+
+            options = dict(retry=self.HOST_RETRY, lazy=True) if len(hosts) > 1 else {}
+            clients.append(HTTPClient(scheme, name, port, max_connections=max_connections,
+                                      rate_limiter=rate_limit, concurrency_limiter=concurrency_limiter,
+                                      ssl_context=ssl_context, spare_connections=spare_connections,
+                                      decode_pool=decode_pool, decode_threshold=decode_threshold,
+                                      spill_threshold=spill_threshold, max_response_size=max_response_size,
+                                      lazy_spill=lazy_spill,
+                                      tracer=tracer, max_idle=max_idle, **options))
+
+        if len(clients) > 1:
+            self.webclient = BalancedHTTPClient(clients)
+        else:
+            self.webclient = clients[0]
+        self._available_resources = self._get("system/resources")
+
+        self._prefetched = {}
+        self._warmup_thread = None
+        if warmup:
+            self._start_warmup(warmup)
+
+    def close(self):
+        """close the idle connections and terminate the decode pool started by the client"""
+
+        self.webclient.close()
+        if self._decode_pool is not None:
+            self._decode_pool.terminate()
+            self._decode_pool.join()
+            self._decode_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start_warmup(self, warmup):
+        options = dict(self.WARMUP_DEFAULTS)
+        if isinstance(warmup, dict):
+            options.update(warmup)
+
+        prefetch = []
+        if options['statics']:
+            prefetch += [('data_info', lambda: self._get("statics/data-info")),
+                         ('stress_test_scenarios', lambda: self._get("statics/stress-test")),
+                         ('liquidity_risk_scenarios', lambda: self._get("statics/liquidity-risk"))]
+        if options['catalog']:
+            prefetch.append(('products', lambda: self._fetch_products({})))
+
+        # the entries are registered before the thread starts, so that the
+        # getters called meanwhile wait for them instead of sending requests
+        entries = []
+        for name, func in prefetch:
+            self._prefetched[name] = entry = threading.Event(), []
+            entries.append((name, func, entry))
+
+        def fetch(item):
+            name, func, (loaded, holder) = item
+            try:
+                holder.append(func())
+            except Exception as e:
+                LOG.debug("Cannot prefetch %s: %s", name, e)
+            finally:
+                loaded.set()
+
+        def run():
+            try:
+                try:
+                    self.webclient.prewarm(options['connections'])
+                except Exception as e:
+                    # e.g. ssl.CertificateError, the requests will fail with it too
+                    LOG.debug("Cannot open the warmup connections: %s", e)
+
+                map_concurrently(fetch, entries, max(1, options['connections']))
+            finally:
+                # never leave a getter waiting
+                for _, _, (loaded, _) in entries:
+                    loaded.set()
+
+        self._warmup_thread = threading.Thread(target=run)
+        self._warmup_thread.daemon = True
+        self._warmup_thread.start()
+
+    def wait_warmup(self, timeout=None):
+        """wait for the background warmup to complete, if any"""
+
+        if self._warmup_thread is not None:
+            self._warmup_thread.join(timeout)
+
+    def _prefetched_or(self, name, func):
+        # return the prefetched data, only once, or call func: when the
+        # prefetch failed or is too slow, the error is the one of func
+        entry = self._prefetched.pop(name, None)
+        if entry is not None:
+            loaded, holder = entry
+            loaded.wait(self.WARMUP_TIMEOUT)
+            if holder:
+                return holder[0]
+        return func()
+
+    def __setattr__(self, name, value):
+        super(RiskapiClient, self).__setattr__(name, value)
+
+        if name in self.CONFIG_ATTRIBUTES:
+            # drop the precomputed headers and urls
+            self.__dict__['_headers_cache'] = None
+            self.__dict__['_urls'] = {}
 
     def _url(self, resource):
         # generate the complete url for the given resource
 
+        url = self._urls.get(resource)
+        if url is not None:
+            return url
+
         fragments = [self.API_BASE, self.API_VERSION, resource]
         if self.customer:
             fragments.insert(0, self.customer)
 
-        return "/" + "/".join(fragments)
+        url = "/" + "/".join(fragments)
+
+        # urls with a product code are not bounded, keep the table small
+        if len(self._urls) >= self.URL_CACHE_SIZE:
+            self._urls.clear()
+        self._urls[resource] = url
+
+        return url
 
     @property
     def _headers(self):
-        """return the http headers for a request"""
+        """
+        return the http headers for a request, the dict is shared by all the
+        requests and must not be modified
+        """
 
+        if self._headers_cache is None:
+            self._headers_cache = self._build_headers()
+        return self._headers_cache
+
+    def _build_headers(self):
         headers = {}
 
         if self.keep_alive:
@@ -398,11 +1586,83 @@ class RiskapiClient(object):
 
         return headers
 
+    @property
+    def coalesce_stats(self):
+        """
+        return the number of requests issued, of the ones actually sent to
+        the server and of the ones which shared the result of an identical
+        request in flight
+        """
+
+        if self.single_flight is None:
+            return None
+
+        with self.single_flight.lock:
+            return dict(self.single_flight.stats)
+
+    def _get(self, resource, params=None):
+        url = self._url(resource)
+
+        if self.single_flight is None:
+            return self.webclient.get(url, params, self._headers)
+
+        key = ('GET', url, tuple(sorted(params.iteritems())) if params else None)
+        return self.single_flight.do(key, self.webclient.get, url, params, self._headers)
+
+    def _post(self, resource, data, postprocess=None):
+        url = self._url(resource)
+        with tracing.span("encode"):
+            body = self._encode(data)
+
+        if self.single_flight is None:
+            return self._post_body(resource, url, body, postprocess)
+        return self.single_flight.do(('POST', url, body, postprocess), self._post_body,
+                                     resource, url, body, postprocess)
+
+    def _post_body(self, resource, url, body, postprocess):
+        # coalesced calls are written once to the sinks, by the caller doing the request
+        if not self.sinks:
+            return self.webclient.post(url, body, self._headers, postprocess)
+
+        request_id = tracing.new_id(128)
+        result = self.webclient.post(url, body, dict(self._headers, **{'X-Request-ID': request_id}), postprocess)
+
+        record = dict(endpoint=resource, request_id=request_id, request_hash=hashlib.sha1(body).hexdigest(),
+                      time=time.time(), result=result)
+        for sink in self.sinks:
+            sink.write(record)
+
+        return result
+
+    def attach_sink(self, sink):
+        """
+        write every analysis response to the given sink (see the sinks
+        module) as soon as it is decoded, as a record with keys endpoint,
+        request_id (the X-Request-ID of the http request), request_hash
+        (sha1 of the request body, the same for identical requests), time
+        and result
+        """
+
+        self.sinks.append(sink)
+
+    def detach_sink(self, sink):
+        self.sinks.remove(sink)
+
     def _encode(self, data):
+        # the PreEncoded values at the top level are serialized already
+        values = [x for x in data.itervalues() if isinstance(x, PreEncoded)] if isinstance(data, dict) else []
+        if any(x.format != self.request_format for x in values):
+            data = {key: value.data if isinstance(value, PreEncoded) else value for key, value in data.iteritems()}
+            values = []
+
         if self.request_format == "json":
             data = json.dumps(data)
+            for value in values:
+                data = data.replace(json.dumps(str(value)), value.body, 1)
         elif self.request_format == "msgpack":
             data = msgpack.packb(data)
+            for value in values:
+                data = data.replace(msgpack.packb(str(value)), value.body, 1)
         else:
             raise RiskapiClientError("Invalid format: %s" % self.request_format)
 
@@ -413,6 +1673,7 @@ class RiskapiClient(object):
 
         return data
 
+    @_traced
     def products(self, search=None, limit=None):
         """
         Available Products
@@ -430,58 +1691,147 @@ class RiskapiClient(object):
         if search is not None:
             params['query'] = search
 
-        url = self._url("statics/products")
-
         if limit is not None:
             params['limit'] = limit
 
-            return self.webclient.get(url, params, self._headers)['data']
+            return self._get("statics/products", params)['data']
+        elif not params:
+            return self._prefetched_or('products', lambda: self._fetch_products(params))
         else:
-            return self.webclient.fetch_paginated(self._url("statics/products"), 20000, params, self._headers)
+            return self._fetch_products(params)
+
+    # initial, minimum and maximum page size of the product catalog downloads
+    PRODUCTS_PAGE_SIZE = 20000, 2000, 100000
 
+    def _fetch_products(self, params):
+        page_size, min_page_size, max_page_size = self.PRODUCTS_PAGE_SIZE
+        return self.webclient.fetch_paginated(self._url("statics/products"), page_size, params, self._headers,
+                                              min_page_size, max_page_size)
+
+    @_traced
     def product(self, code):
         """
         Product Details
         Return the product statics data and historical simulation scenarios
         """
 
-        return self.webclient.get(self._url("statics/products/%s" % code), headers=self._headers)
+        return self._get("statics/products/%s" % code)
+
+    # products details kept in memory, and seconds between the checks of
+    # the dataset version invalidating them
+    PRODUCTS_CACHE_SIZE = 1000
+    PRODUCTS_CACHE_TTL = 300.0
+
+    @_traced
+    def products_detail(self, codes, max_workers=None, cache=True):
+        """
+        Products Details
+        Return a code -> product details mapping for the given product codes,
+        fetching them concurrently with up to max_workers requests (by
+        default the client max_connections). Codes not found are omitted.
+
+        The details of the last PRODUCTS_CACHE_SIZE products are cached
+        until a new dataset is loaded on the server, which is checked at
+        most every PRODUCTS_CACHE_TTL seconds, the details returned are
+        copies of the cached ones. With cache False the cache is neither used
+        nor filled, e.g. to download many products once.
+        """
+
+        codes = list(codes)
+        if cache:
+            cache = self._check_products_cache()
+            with self._products_cache_lock:
+                found = {}
+                for code in set(codes):
+                    if code in cache:
+                        # most recently used last
+                        found[code] = cache[code] = cache.pop(code)
+        else:
+            cache = None
+            found = {}
 
+        missing = sorted({code for code in codes if code not in found})
+
+        def fetch(code):
+            try:
+                return self.product(code)
+            except HTTPError as e:
+                if e.code == 404:
+                    return None
+                raise
+
+        if missing:
+            LOG.debug("Fetching %s products details (%s cached)", len(missing), len(set(codes)) - len(missing))
+
+            records = map_concurrently(fetch, missing, max_workers or self.webclient.max_connections)
+            found.update(zip(missing, records))
+
+            if cache is not None:
+                with self._products_cache_lock:
+                    cache.update(zip(missing, records))
+                    while len(cache) > self.PRODUCTS_CACHE_SIZE:
+                        cache.popitem(last=False)
+
+        result = {code: found[code] for code in codes if found.get(code) is not None}
+        if cache is not None:
+            # the cached details are shared with the other callers
+            result = copy.deepcopy(result)
+        return result
+
+    def _check_products_cache(self):
+        # return the products cache, emptied if the dataset changed
+        now = time.time()
+        with self._products_cache_lock:
+            checked = self._products_cache_checked
+            if checked is not None and now - checked < self.PRODUCTS_CACHE_TTL:
+                return self._products_cache
+
+        version = self.data_info()['max_date']
+
+        with self._products_cache_lock:
+            if version != self._products_cache_version:
+                self._products_cache = OrderedDict()
+                self._products_cache_version = version
+            self._products_cache_checked = now
+            return self._products_cache
+
+    @_traced
     def available_stress_test_scenarios(self):
         """
         Available Stress Test Scenarios
         Return the list of the available stress test scenarios
         """
 
-        return self.webclient.get(self._url("statics/stress-test"), headers=self._headers)
+        return self._prefetched_or('stress_test_scenarios', lambda: self._get("statics/stress-test"))
 
+    @_traced
     def available_liquidity_risk_scenarios(self):
         """
         Available Liquidity Risk Scenarios
         Return the list of the available liquidity risk scenarios
         """
 
-        return self.webclient.get(self._url("statics/liquidity-risk"), headers=self._headers)
+        return self._prefetched_or('liquidity_risk_scenarios', lambda: self._get("statics/liquidity-risk"))
 
+    @_traced
     def portfolio_info(self, portfolio, fields=None):
         """
         Portfolio static infos
         Return a number of static informations about the given portfolio
         """
 
-        data = self.webclient.post(
-            self._url("statics/portfolio-info"),
-            self._encode(dict(portfolio=portfolio.encode(), fields=fields)),
-            self._headers)
+        data = self._post("statics/portfolio-info", dict(portfolio=portfolio.encode(), fields=fields))
         return data
 
+    @_traced
     def data_info(self):
         """
         Dataset static infos
         Return a number of static informations about the latest loaded dataset
         """
-        return self.webclient.get(self._url("statics/data-info"), headers=self._headers)
+        return self._prefetched_or('data_info', lambda: self._get("statics/data-info"))
 
+    @_traced
     def risk(self, portfolio, percentiles, functions=None,
              lookback_days=None, horizons=None, frequencies=None,
              exponential_decay=None):
@@ -508,10 +1858,10 @@ class RiskapiClient(object):
                       portfolio=portfolio.encode(), functions=functions,
                       exponential_decay=exponential_decay)
 
-        data = self.webclient.post(
-            self._url("risk"), self._encode(params), self._headers)
+        data = self._post("risk", params)
         return data
 
+    @_traced
     def stress_test(self, portfolio, codes=None):
         """
         Portfolio stress test analysis
@@ -519,11 +1869,10 @@ class RiskapiClient(object):
         stress test scenario on the given portfolio
         """
 
-        data = self.webclient.post(
-            self._url("stress-test"), self._encode(dict(portfolio=portfolio.encode(), stress_test_codes=codes)),
-            self._headers)
+        data = self._post("stress-test", dict(portfolio=portfolio.encode(), stress_test_codes=codes))
         return data
 
+    @_traced
     def liquidity_risk(self, portfolio):
         """
         Portfolio liquidity risk analysis
@@ -531,11 +1880,10 @@ class RiskapiClient(object):
         liquidity risk scenario on the given portfolio
         """
 
-        data = self.webclient.post(
-            self._url("liquidity-risk"), self._encode(dict(portfolio=portfolio.encode())),
-            self._headers)
+        data = self._post("liquidity-risk", dict(portfolio=portfolio.encode()))
         return data
 
+    @_traced
     def risk_decomposition(self, portfolio, percentile, functions=None,
                            lookback_days=730, horizon=1, frequency=1, fields=None):
         """
@@ -551,10 +1899,10 @@ class RiskapiClient(object):
                       horizon=horizon, frequency=frequency,
                       portfolio=portfolio.encode(), functions=functions, fields=fields)
 
-        data = self.webclient.post(
-            self._url("risk/decomposition"), self._encode(params), self._headers)
+        data = self._risk_decomposition("risk/decomposition", params)
         return data
 
+    @_traced
     def relative_risk_decomposition(self, portfolio, benchmark, percentile, functions=None,
                                     lookback_days=730, horizon=1, frequency=1, fields=None):
         """
@@ -571,17 +1919,19 @@ class RiskapiClient(object):
                       portfolio=portfolio.encode(), benchmark=benchmark.encode(),
                       functions=functions, fields=fields)
 
-        data = self.webclient.post(
-            self._url("risk/decomposition/relative"), self._encode(params), self._headers)
+        data = self._risk_decomposition("risk/decomposition/relative", params, relative=True)
         return data
 
+    @_traced
     def multi_level_risk_decomposition(self, portfolio, percentile, functions=None,
-                                       lookback_days=730, horizon=1, frequency=1, fields=None):
+                                       lookback_days=730, horizon=1, frequency=1, fields=None,
+                                       postprocess=None):
         """
         Portfolio multi-level risk decomposition
         Compute the multi-level risk decomposition of the given risk functions
         on the given portfolio, using the attributes lists from the portfolio
-        holdings. It returns a hierarchy of risk figures according to the assets attributes
+        holdings. It returns a hierarchy of risk figures according to the assets attributes,
+        or the result of postprocess applied to it (see decode_pool)
         """
 
         if functions is None:
@@ -591,18 +1941,20 @@ class RiskapiClient(object):
                       horizon=horizon, frequency=frequency,
                       portfolio=portfolio.encode(), functions=functions, fields=fields)
 
-        data = self.webclient.post(
-            self._url("risk/multi-level-decomposition"), self._encode(params), self._headers)
+        data = self._risk_decomposition("risk/multi-level-decomposition", params, postprocess=postprocess)
         return data
 
+    @_traced
     def relative_multi_level_risk_decomposition(self, portfolio, benchmark, percentile, functions=None,
-                                                lookback_days=730, horizon=1, frequency=1, fields=None):
+                                                lookback_days=730, horizon=1, frequency=1, fields=None,
+                                                postprocess=None):
         """
         Portfolio relative multi-level risk decomposition
         Compute the multi-level risk decomposition of the given risk functions
         on the given portfolio relative to the given benchmark using the attributes
         lists from the portfolio holdings. It returns a hierarchy of risk figures
-        according to the assets attributes
+        according to the assets attributes, or the result of postprocess applied
+        to it (see decode_pool)
         """
 
         if functions is None:
@@ -613,10 +1965,53 @@ class RiskapiClient(object):
                       portfolio=portfolio.encode(), benchmark=benchmark.encode(),
                       functions=functions, fields=fields)
 
-        data = self.webclient.post(
-            self._url("risk/multi-level-decomposition/relative"), self._encode(params), self._headers)
+        data = self._risk_decomposition("risk/multi-level-decomposition/relative", params, relative=True,
+                                        postprocess=postprocess)
         return data
 
+    def _risk_decomposition(self, resource, params, relative=False, postprocess=None):
+        # post a risk decomposition, or project a cached one
+        cache = self.decomposition_cache
+        if postprocess is not None:
+            # only complete responses are cached
+            return self._post(resource, params, postprocess)
+        functions = params['functions']
+        fields = params['fields'] if params['fields'] is not None else RISK_DECOMPOSITION_FIELDS
+
+        # the relative decompositions have no exposure
+        all_functions = DECOMPOSABLE_RISK_FUNCTIONS if relative else DECOMPOSABLE_RISK_FUNCTIONS + ['exposure']
+
+        # invalid requests are left to the server
+        if cache is None or set(functions) - set(all_functions) or set(fields) - set(RISK_DECOMPOSITION_FIELDS):
+            return self._post(resource, params)
+
+        # the portfolios are encoded once, for the key and the request: the
+        # key is the same whether they are encoded in advance or not
+        params = dict(params)
+        for name in ('portfolio', 'benchmark'):
+            if name in params:
+                value = params[name]
+                if not isinstance(value, PreEncoded) or value.format != self.request_format:
+                    value = PreEncoded(getattr(value, 'data', value), self.request_format)
+                params[name] = value
+
+        request = dict(params)
+        del request['functions'], request['fields']
+        key = (self._url(resource), hashlib.sha1(json.dumps(request, sort_keys=True)).hexdigest())
+
+        data = cache.get(key, functions, fields)
+        if data is not None:
+            LOG.debug("%s answered by the decomposition cache", resource)
+            return data
+
+        if cache.upgrade:
+            params = dict(params, functions=all_functions, fields=RISK_DECOMPOSITION_FIELDS)
+
+        data = self._post(resource, params)
+        cache.put(key, params['functions'], params['fields'] or RISK_DECOMPOSITION_FIELDS, data)
+        return cache.project(data, functions, fields)
+
+    @_traced
     def stress_test_decomposition(self, portfolio, codes=None):
         """
         Portfolio stress test decomposition
@@ -624,12 +2019,11 @@ class RiskapiClient(object):
         on the given portfolio using the attributes lists from the portfolio holdings
         """
 
-        data = self.webclient.post(
-            self._url("stress-test/decomposition"),
-            self._encode(dict(portfolio=portfolio.encode(), stress_test_codes=codes)),
-            self._headers)
+        data = self._post(
+            "stress-test/decomposition", dict(portfolio=portfolio.encode(), stress_test_codes=codes))
         return data
 
+    @_traced
     def relative_stress_test_decomposition(self, portfolio, benchmark, codes=None):
         """
         Portfolio relative stress test decomposition
@@ -638,44 +2032,44 @@ class RiskapiClient(object):
         lists from the portfolio holdings
         """
 
-        data = self.webclient.post(
-            self._url("stress-test/decomposition/relative"),
-            self._encode(dict(portfolio=portfolio.encode(),
-                              benchmark=benchmark.encode(),
-                              stress_test_codes=codes)),
-            self._headers)
+        data = self._post(
+            "stress-test/decomposition/relative",
+            dict(portfolio=portfolio.encode(), benchmark=benchmark.encode(),
+                 stress_test_codes=codes))
         return data
 
-    def multi_level_stress_test_decomposition(self, portfolio, codes=None):
+    @_traced
+    def multi_level_stress_test_decomposition(self, portfolio, codes=None, postprocess=None):
         """
         Portfolio multi-level stress test decomposition
         Measure the multi-level risk decomposition for the requested
         stress test scenarios on the given portfolio using the
-        attributes lists from the portfolio holdings
+        attributes lists from the portfolio holdings, or the result of
+        postprocess applied to it (see decode_pool)
         """
 
-        data = self.webclient.post(
-            self._url("stress-test/multi-level-decomposition"),
-            self._encode(dict(portfolio=portfolio.encode(), stress_test_codes=codes)),
-            self._headers)
+        data = self._post(
+            "stress-test/multi-level-decomposition", dict(portfolio=portfolio.encode(), stress_test_codes=codes),
+            postprocess)
         return data
 
-    def relative_multi_level_stress_test_decomposition(self, portfolio, benchmark, codes=None):
+    @_traced
+    def relative_multi_level_stress_test_decomposition(self, portfolio, benchmark, codes=None, postprocess=None):
         """
         Portfolio relative multi-level stress test decomposition
         Measure the multi-level risk decomposition for the requested
         stress test scenarios on the given portfolio relative to the
-        given benchmark using the attributes lists from the portfolio holdings
+        given benchmark using the attributes lists from the portfolio holdings,
+        or the result of postprocess applied to it (see decode_pool)
         """
 
-        data = self.webclient.post(
-            self._url("stress-test/multi-level-decomposition/relative"),
-            self._encode(dict(portfolio=portfolio.encode(),
-                              benchmark=benchmark.encode(),
-                              stress_test_codes=codes)),
-            self._headers)
+        data = self._post(
+            "stress-test/multi-level-decomposition/relative",
+            dict(portfolio=portfolio.encode(), benchmark=benchmark.encode(),
+                 stress_test_codes=codes), postprocess)
         return data
 
+    @_traced
     def liquidity_risk_decomposition(self, portfolio):
         """
         Portfolio liquidity risk decomposition
@@ -684,38 +2078,139 @@ class RiskapiClient(object):
         from the portfolio holdings
         """
 
-        data = self.webclient.post(
-            self._url("liquidity-risk/decomposition"), self._encode(dict(portfolio=portfolio.encode())),
-            self._headers)
+        data = self._post("liquidity-risk/decomposition", dict(portfolio=portfolio.encode()))
         return data
 
-    def multi_level_liquidity_risk_decomposition(self, portfolio):
+    @_traced
+    def multi_level_liquidity_risk_decomposition(self, portfolio, postprocess=None):
         """
         Portfolio multi-level liquidity risk decomposition
         Measure the multi-level risk decomposition for all the available liquidity
-        scenarios on the given portfolio using the attributes lists from the portfolio holdings
+        scenarios on the given portfolio using the attributes lists from the portfolio holdings,
+        or the result of postprocess applied to it (see decode_pool)
         """
 
-        data = self.webclient.post(
-            self._url("liquidity-risk/multi-level-decomposition"), self._encode(dict(portfolio=portfolio.encode())),
-            self._headers)
+        data = self._post(
+            "liquidity-risk/multi-level-decomposition", dict(portfolio=portfolio.encode()), postprocess)
         return data
 
+    @_traced
+    def local_multi_level_stress_test_decomposition(self, portfolio, codes=None):
+        """
+        Portfolio multi-level stress test decomposition, computed locally
+        Same result of multi_level_stress_test_decomposition, but the coarser
+        levels are summed up on the client from a single stress test
+        decomposition at the full attributes depth
+        """
+
+        data = self.stress_test_decomposition(portfolio, codes)
+        # the response may be shared with other callers (coalescing, caches)
+        return dict(data, results=rollup_stress_test_decomposition(data['results']))
+
+    @_traced
+    def local_multi_level_risk_decomposition(self, portfolio, percentile, functions=None,
+                                             lookback_days=730, horizon=1, frequency=1, fields=None):
+        """
+        Portfolio multi-level risk decomposition, computed locally
+        Same result of multi_level_risk_decomposition, but the coarser levels
+        are summed up on the client from a single risk decomposition at the
+        full attributes depth. Only the additive fields "contribution_risk"
+        and "contribution_pct" are supported.
+        """
+
+        if fields is None:
+            fields = ADDITIVE_RISK_FIELDS
+
+        if set(fields) - set(ADDITIVE_RISK_FIELDS):
+            raise RiskapiClientError("Only additive fields can be rolled up: %s" % ADDITIVE_RISK_FIELDS)
+
+        # the totals are the sum of the contributions, always ask for them
+        request_fields = sorted(set(fields) | {'contribution_risk'})
+
+        data = self.risk_decomposition(portfolio, percentile, functions, lookback_days,
+                                       horizon, frequency, request_fields)
+        levels = rollup_risk_decomposition(data['results'])
+
+        # the rolled up rows are new, unlike the response
+        if 'contribution_risk' not in fields:
+            for level in levels[1:]:
+                for name, rows in level.iteritems():
+                    if name != "exposure":
+                        for row in rows:
+                            row.pop('contribution_risk', None)
+
+        return dict(data, results=levels)
+
+    @_traced
     def aussie_bond_futures_NPV(self, code, price):
         """
         Aussie bond futures NPV
         Compute the NPV for an Aussie bond futures
         """
 
-        data = self.webclient.post(
-            self._url("aussie-bond-futures-npv"),
-            self._encode(dict(code=code, price=price)),
-            self._headers)
+        data = self._post("aussie-bond-futures-npv", dict(code=code, price=price))
         return data
 
+    @_traced
     def system_info(self):
-        return self.webclient.get(self._url("system/dashboard"), headers=self._headers)
+        return self._get("system/dashboard")
+
+    @_traced
+    def report(self, portfolio, benchmark=None, spec=None, max_workers=None):
+        """
+        Composite report
+        Run several analyses of the same portfolio concurrently, encoding and
+        serializing the portfolio (and the benchmark) once. spec maps the section names to
+        dicts with the "analysis" to run (a method name, by default the
+        section name) and its "params"; by default REPORT_SPEC, plus
+        RELATIVE_REPORT_SPEC when a benchmark is given. The benchmark is
+        passed to the analyses taking one.
+        Up to max_workers (by default max_connections) requests are sent
+        together. Return a dict with keys:
+            sections
+                section name -> analysis result
+            errors
+                section name -> error message, for the failed sections
+            timings
+                section name -> seconds, plus "encode" and "total"
+        """
+
+        start = time.time()
 
+        if spec is None:
+            spec = dict(self.REPORT_SPEC)
+            if benchmark is not None:
+                spec.update(self.RELATIVE_REPORT_SPEC)
+
+        portfolio = EncodedPortfolio(portfolio, self.request_format)
+        if benchmark is not None:
+            benchmark = EncodedPortfolio(benchmark, self.request_format)
+
+        report = dict(sections={}, errors={}, timings=dict(encode=time.time() - start))
+
+        def run(name):
+            section = spec[name]
+            section_start = time.time()
+            try:
+                method = getattr(self, section.get('analysis', name))
+                kwargs = dict(section.get('params') or {})
+                if 'benchmark' in inspect.getargspec(getattr(method, '__wrapped__', method)).args:
+                    if benchmark is None:
+                        raise RiskapiClientError("A benchmark is required")
+                    kwargs['benchmark'] = benchmark
+
+                report['sections'][name] = method(portfolio, **kwargs)
+            except Exception as e:
+                LOG.debug("Report section %s failed: %s", name, e)
+                report['errors'][name] = "%s: %s" % (e.__class__.__name__, e)
+            report['timings'][name] = time.time() - section_start
+
+        map_concurrently(run, sorted(spec), max_workers or self.webclient.max_connections)
+
+        report['timings']['total'] = time.time() - start
+        return report
+
+    @_traced
     def risk_attribution(self, portfolio, benchmark, percentile, function, selection_method,
                          lookback_days=730, horizon=1, frequency=1, outstanding=None):
         """
@@ -728,10 +2223,10 @@ class RiskapiClient(object):
                       function=function, outstanding=outstanding,
                       selection_method=selection_method)
 
-        data = self.webclient.post(
-            self._url("risk/attribution"), self._encode(params), self._headers)
+        data = self._post("risk/attribution", params)
         return data
 
+    @_traced
     def risk_attribution_decomposition(self, portfolio, benchmark, percentile, function,
                                        selection_method, lookback_days=730, horizon=1,
                                        frequency=1, outstanding=None):
@@ -745,8 +2240,7 @@ class RiskapiClient(object):
                       function=function, outstanding=outstanding,
                       selection_method=selection_method)
 
-        data = self.webclient.post(
-            self._url("risk/attribution/decomposition"), self._encode(params), self._headers)
+        data = self._post("risk/attribution/decomposition", params)
         return data
 
 
@@ -797,3 +2291,17 @@ def connect(host=None, customer=None, username=None,
 def connect_local(host="localhost:8000", customer="", username="", password="", secure=False, **kwargs):
     return connect(host, customer, username, password, secure, **kwargs)
 
+
+from riskapi_client.cube import ScenarioCube
+from riskapi_client.rollup import (
+    ADDITIVE_RISK_FIELDS, rollup_stress_test_decomposition, rollup_risk_decomposition)
+from riskapi_client.whatif import StressTestWhatIf
+from riskapi_client.index import ProductIndex
+from riskapi_client.formats import open_portfolio, write_portfolio
+from riskapi_client.throttle import TokenBucket, AIMDLimiter
+from riskapi_client.sinks import JSONLSink, MsgpackSink, ColumnarSink, read_columnar
+from riskapi_client.balancer import BalancedHTTPClient
+from riskapi_client.catalog import CatalogStore, sync_catalog
+from riskapi_client.projection import DecompositionCache
+from riskapi_client import tracing
+from riskapi_client.tracing import Tracer, MemoryExporter, LogExporter, FileExporter
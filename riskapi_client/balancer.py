@@ -0,0 +1,198 @@
+"""
+Client-side load balancing across several RiskAPI hosts
+
+BalancedHTTPClient has the interface of HTTPClient and dispatches the
+requests to a set of HTTPClients, one per host, each one with its own
+connection pool. Every request goes to the host with the lowest score: its
+recent latency (a moving average of the request times) times its requests
+in flight plus one, so that slow or busy hosts get less traffic. Hosts
+without a latency yet are scored with the mean latency of the others.
+
+A host failing max_failures consecutive requests (connection errors,
+overloaded statuses) is ejected for ejection_time seconds, doubled at every
+consecutive ejection up to max_ejection_time, and the request is retried on
+another host. When all the hosts are ejected the one coming back first is
+used anyway.
+"""
+
+import time
+import random
+import socket
+import httplib
+import logging
+import threading
+
+from riskapi_client import HTTPClient, HTTPError, HostUnavailable, PaginatedMixin, RiskapiClientError, tracing
+
+
+LOG = logging.getLogger('riskapi.balancer')
+
+
+class HostState(object):
+    """routing state of a host"""
+
+    def __init__(self, client):
+        self.client = client
+        self.name = "%s:%s" % (client.host, client.port) if client.port else client.host
+        self.latency = None
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.stats = dict(requests=0, errors=0, ejections=0)
+
+    def score(self, default_latency):
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (self.outstanding + 1)
+
+
+class BalancedHTTPClient(PaginatedMixin):
+    """an http client dispatching the requests to several HTTPClients"""
+
+    # weight of the last request time in the latency moving average
+    LATENCY_WEIGHT = 0.2
+
+    def __init__(self, clients, retry=6, max_failures=1, ejection_time=5.0, max_ejection_time=60.0):
+        """
+        clients are HTTPClients, one per host, best created with a small
+        retry and lazy so that a host down does not delay the others.
+
+        A request is tried up to retry times, on a different host every
+        time until all of them have been tried, then again after a backoff.
+        """
+
+        if not clients:
+            raise RiskapiClientError("No hosts to balance")
+
+        self.clients = clients
+        self.hosts = [HostState(client) for client in clients]
+        self.retry = retry
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+
+        self.scheme = clients[0].scheme
+        self.max_connections = sum(client.max_connections for client in clients)
+        self.last_request = None
+        self.lock = threading.Lock()
+
+    def close(self):
+        """close all the idle connections of all the hosts"""
+
+        for client in self.clients:
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def prewarm(self, count):
+        """open count idle connections to every available host"""
+
+        for host in self.hosts:
+            try:
+                host.client.prewarm(count)
+            except (socket.error, httplib.HTTPException) as e:
+                LOG.debug("Cannot open connections to %s: %s", host.name, e)
+
+    @property
+    def host_stats(self):
+        """return the routing state and the request counts of every host"""
+
+        now = time.time()
+        with self.lock:
+            return [dict(host.stats, host=host.name, latency=host.latency, outstanding=host.outstanding,
+                         ejected=host.ejected_until > now) for host in self.hosts]
+
+    def post(self, path, data, headers=None, postprocess=None):
+        return self._dispatch('post', path, data, headers, postprocess)
+
+    def get(self, path, params=None, headers=None, postprocess=None):
+        return self._dispatch('get', path, params, headers, postprocess)
+
+    def _dispatch(self, method, *args):
+        tried = set()
+        rounds = 0
+        error = None
+
+        for attempt in xrange(self.retry):
+            host = self._choose(tried)
+            tried.add(host)
+
+            start = time.time()
+            failed = False
+            try:
+                with tracing.span("host", host=host.name):
+                    result = getattr(host.client, method)(*args)
+                self.last_request = host.client.last_request
+                return result
+            except HTTPError as e:
+                if e.code not in HTTPClient.OVERLOADED_STATUSES:
+                    raise
+                failed = True
+                error = e
+            except (HostUnavailable, socket.error, httplib.HTTPException) as e:
+                failed = True
+                error = e
+            finally:
+                self._done(host, time.time() - start, failed)
+
+            LOG.debug("%s failed on %s: %s", method.upper(), host.name, error)
+
+            if attempt == self.retry - 1:
+                break
+
+            if len(tried) == len(self.hosts):
+                # every host failed once, wait before the next round
+                delay = (2**rounds)/10.0
+                rounds += 1
+                tried.clear()
+                with tracing.span("backoff", delay=delay):
+                    time.sleep(delay)
+
+        raise error
+
+    def _choose(self, tried):
+        # the best available host not tried yet by this request
+        now = time.time()
+        with self.lock:
+            candidates = [host for host in self.hosts if host not in tried] or self.hosts
+            available = [host for host in candidates if host.ejected_until <= now]
+            if available:
+                latencies = [x.latency for x in self.hosts if x.latency is not None]
+                mean = sum(latencies) / len(latencies) if latencies else 0.0
+                host = min(available, key=lambda x: (x.score(mean), x.outstanding, random.random()))
+            else:
+                host = min(candidates, key=lambda x: x.ejected_until)
+
+            host.outstanding += 1
+            host.stats['requests'] += 1
+            return host
+
+    def _done(self, host, elapsed, failed):
+        with self.lock:
+            host.outstanding -= 1
+
+            if not failed:
+                host.failures = 0
+                host.ejections = 0
+                if host.latency is None:
+                    host.latency = elapsed
+                else:
+                    host.latency += self.LATENCY_WEIGHT * (elapsed - host.latency)
+                return
+
+            host.stats['errors'] += 1
+            host.failures += 1
+            if host.failures < self.max_failures:
+                return
+
+            duration = min(self.max_ejection_time, self.ejection_time * 2**host.ejections)
+            host.ejected_until = time.time() + duration
+            host.failures = 0
+            host.ejections += 1
+            host.stats['ejections'] += 1
+
+        LOG.warning("Host %s ejected for %.1f seconds", host.name, duration)
@@ -0,0 +1,189 @@
+"""
+Non-interactive batch runner
+
+A batch is described by a json manifest listing the analyses to run:
+
+    {
+        "jobs": [
+            {"id": "fund-a-risk", "portfolio": "fund_a.json",
+             "analysis": "risk", "params": {"percentiles": [0.99]}},
+            {"id": "fund-a-attribution", "portfolio": "fund_a.json",
+             "benchmark": "index.json", "analysis": "risk_attribution",
+             "params": {"percentile": 0.99, "function": "var",
+                        "selection_method": "zero_interaction"}}
+        ]
+    }
+
+"analysis" is the name of a RiskapiClient method taking a portfolio (see
+ANALYSES), "params" its keyword arguments. Portfolio files are the ones
+written by Portfolio.dump, "format" selects a format other than json and
+relative paths are relative to the manifest.
+
+Jobs are executed concurrently and each result is appended to a JSONL
+output file as soon as it is available, one object per line with keys id,
+analysis, status ("ok" or "error"), elapsed (seconds) and result or error.
+The output file is also the checkpoint: when the batch is run again, the
+jobs with an "ok" line are skipped.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from riskapi_client import Portfolio, RiskapiClientError, map_concurrently
+from riskapi_client.sinks import JSONLSink
+
+
+LOG = logging.getLogger('riskapi.batch')
+
+ANALYSES = [
+    'portfolio_info', 'risk', 'stress_test', 'liquidity_risk',
+    'risk_decomposition', 'relative_risk_decomposition',
+    'multi_level_risk_decomposition', 'relative_multi_level_risk_decomposition',
+    'stress_test_decomposition', 'relative_stress_test_decomposition',
+    'multi_level_stress_test_decomposition', 'relative_multi_level_stress_test_decomposition',
+    'liquidity_risk_decomposition', 'multi_level_liquidity_risk_decomposition',
+    'risk_attribution', 'risk_attribution_decomposition',
+]
+
+
+def load_manifest(file_name):
+    """return the list of jobs of the given manifest, with absolute portfolio paths"""
+
+    with open(file_name, "rb") as ff:
+        manifest = json.load(ff)
+
+    base = os.path.dirname(os.path.abspath(file_name))
+
+    jobs = []
+    ids = set()
+    for job in manifest['jobs']:
+        if job.get('analysis') not in ANALYSES:
+            raise RiskapiClientError("Invalid analysis for job %s: %s" % (job.get('id'), job.get('analysis')))
+
+        if 'id' not in job or job['id'] in ids:
+            raise RiskapiClientError("Missing or duplicated job id: %s" % job.get('id'))
+        ids.add(job['id'])
+
+        job = dict(job)
+        for name in ('portfolio', 'benchmark'):
+            if job.get(name) is not None:
+                job[name] = os.path.join(base, job[name])
+        jobs.append(job)
+
+    return jobs
+
+
+def completed_jobs(file_name):
+    """
+    return the ids of the jobs successfully completed in the given output
+    file, truncating an incomplete last line left by a crashed run
+    """
+
+    done = set()
+    if not os.path.exists(file_name):
+        return done
+
+    with open(file_name, "r+b") as ff:
+        valid = 0
+        for line in ff:
+            if not line.endswith("\n"):
+                break
+            valid += len(line)
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if item.get('status') == "ok":
+                done.add(item['id'])
+
+        ff.truncate(valid)
+
+    return done
+
+
+class BatchRunner(object):
+    """run the jobs of a manifest with a client, appending the results to a JSONL file"""
+
+    def __init__(self, client, jobs, output_file, workers=4):
+        self.client = client
+        self.jobs = jobs
+        self.output_file = output_file
+        self.workers = workers
+
+        self.stats = dict(total=len(jobs), skipped=0, ok=0, error=0)
+
+        self._portfolios = {}
+        self._lock = threading.Lock()
+        self._sink = None
+
+    def portfolio(self, file_name, format):
+        # portfolios shared by several jobs are loaded only once
+        key = (file_name, format)
+        with self._lock:
+            if key not in self._portfolios:
+                self._portfolios[key] = threading.Event(), []
+                owner = True
+            else:
+                owner = False
+            loaded, holder = self._portfolios[key]
+
+        if owner:
+            try:
+                holder.append(Portfolio.load(file_name, format))
+            finally:
+                loaded.set()
+        else:
+            loaded.wait()
+
+        if not holder:
+            raise RiskapiClientError("Cannot load portfolio %s" % file_name)
+        return holder[0]
+
+    def execute(self, job):
+        start = time.time()
+        try:
+            format = job.get('format', "json")
+            kwargs = dict(job.get('params') or {})
+            if job.get('benchmark') is not None:
+                kwargs['benchmark'] = self.portfolio(job['benchmark'], format)
+
+            portfolio = self.portfolio(job['portfolio'], format)
+            result = getattr(self.client, job['analysis'])(portfolio, **kwargs)
+        except Exception as e:
+            LOG.warning("Job %s failed: %s", job['id'], e)
+            item = dict(id=job['id'], analysis=job['analysis'], status="error",
+                        elapsed=time.time() - start, error="%s: %s" % (e.__class__.__name__, e))
+        else:
+            item = dict(id=job['id'], analysis=job['analysis'], status="ok",
+                        elapsed=time.time() - start, result=result)
+
+        self.write(item)
+
+    def write(self, item):
+        self._sink.write(item)
+        with self._lock:
+            self.stats[item['status']] += 1
+
+    def run(self):
+        """run the jobs not completed yet and return the stats"""
+
+        done = completed_jobs(self.output_file)
+        pending = [job for job in self.jobs if job['id'] not in done]
+        self.stats['skipped'] = len(self.jobs) - len(pending)
+
+        LOG.info("Running %s jobs, %s already completed", len(pending), self.stats['skipped'])
+
+        # every line is on disk before the next one is written: it's the checkpoint
+        with JSONLSink(self.output_file, buffer_size=1, fsync="flush") as self._sink:
+            map_concurrently(self.execute, pending, self.workers)
+
+        return self.stats
+
+
+def run_batch(client, manifest_file, output_file, workers=4):
+    """run the jobs of the given manifest file, see BatchRunner"""
+
+    return BatchRunner(client, load_manifest(manifest_file), output_file, workers).run()
@@ -0,0 +1,221 @@
+"""
+Load generation and latency measurement
+
+LoadGenerator drives a server with the analyses of synthetic portfolios,
+either at fixed concurrency (each worker sends a new request as soon as the
+previous one completes) or at a fixed request rate (requests are scheduled at
+regular times and their latency is measured from the scheduled time, so the
+time spent waiting for a free worker is included).
+
+Statistics (throughput, error rate, latency percentiles) are reported every
+interval and for the whole run. The latencies are counted in histograms
+(see LatencyHistogram), so the memory used does not grow with the duration.
+"""
+
+import math
+import time
+import random
+import logging
+import threading
+import Queue
+
+from riskapi_client import Holding, Portfolio, RiskapiClientError
+
+
+LOG = logging.getLogger('riskapi.bench')
+
+CURRENCIES = ["EUR", "USD", "JPY", "GBP", "AUD"]
+ATTRIBUTES = ["X", "Y", "Z"]
+
+# stress test scenarios used by the stress test analyses
+STRESS_TEST_CODES = 10
+
+# name -> function(client, portfolio, stress test codes) sending one request
+ANALYSES = dict(
+    data_info=lambda client, portfolio, codes: client.data_info(),
+    product=lambda client, portfolio, codes: client.product(random.choice(portfolio.holdings).code),
+    portfolio_info=lambda client, portfolio, codes: client.portfolio_info(portfolio),
+    risk=lambda client, portfolio, codes: client.risk(portfolio, [0.99]),
+    stress_test=lambda client, portfolio, codes: client.stress_test(portfolio, codes),
+    liquidity_risk=lambda client, portfolio, codes: client.liquidity_risk(portfolio),
+    risk_decomposition=lambda client, portfolio, codes: client.risk_decomposition(portfolio, 0.99),
+    stress_test_decomposition=lambda client, portfolio, codes: client.stress_test_decomposition(portfolio, codes),
+)
+
+
+def synthetic_portfolios(products, count, size, type="weights", outstanding=1000**2):
+    """
+    return count random portfolios of size holdings of the given products
+    (as returned by RiskapiClient.products), with random attributes
+    """
+
+    portfolios = []
+    for _ in xrange(count):
+        holdings = [Holding(x['code'], None, 100.0 / size, None, random.sample(ATTRIBUTES, 3))
+                    for x in random.sample(products, min(size, len(products)))]
+        portfolios.append(Portfolio(random.choice(CURRENCIES), holdings, type, outstanding))
+    return portfolios
+
+
+class LatencyHistogram(object):
+    """
+    request latencies and outcomes counted in logarithmic buckets: each
+    bucket is "precision" times wider than the previous one, so the
+    percentiles are within precision of the exact ones (nearest rank) with
+    a bounded number of buckets. Latencies below "minimum" seconds are
+    counted as minimum.
+    """
+
+    def __init__(self, precision=0.01, minimum=1e-6):
+        self.precision = precision
+        self.minimum = minimum
+        self.log_base = math.log(1.0 + precision)
+
+        # bucket index -> count
+        self.buckets = {}
+        self.count = 0
+        self.errors = 0
+        self.max = None
+
+    def add(self, latency, ok=True):
+        index = int(math.log(max(latency, self.minimum) / self.minimum) / self.log_base)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    def percentile(self, p):
+        """return the p percentile (0 to 100) of the latencies, or None if there are none"""
+
+        if not self.count:
+            return None
+
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        # the upper bound of the bucket, the exact value is less than precision below
+        return min(self.max, self.minimum * (1.0 + self.precision) ** (index + 1))
+
+
+def summarize(histogram, elapsed):
+    """return the stats of the requests counted in the given LatencyHistogram over elapsed seconds"""
+
+    count = histogram.count
+    return dict(requests=count, errors=histogram.errors,
+                error_rate=float(histogram.errors) / count if count else 0.0,
+                throughput=count / elapsed if elapsed > 0 else 0.0,
+                p50=histogram.percentile(50), p90=histogram.percentile(90),
+                p99=histogram.percentile(99), max=histogram.max)
+
+
+class LoadGenerator(object):
+    """send the given analyses of the given portfolios to a client for duration seconds"""
+
+    def __init__(self, client, analyses, portfolios, concurrency=4, rate=None, duration=10.0, interval=1.0):
+        for name in analyses:
+            if name not in ANALYSES:
+                raise RiskapiClientError("Invalid analysis: should be one of %s" % sorted(ANALYSES))
+
+        self.client = client
+        self.analyses = analyses
+        self.portfolios = portfolios
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.interval = interval
+
+        self.codes = None
+        if any(name.startswith('stress_test') for name in analyses):
+            scenarios = client.available_stress_test_scenarios()['data']
+            self.codes = [x['code'] for x in scenarios][:STRESS_TEST_CODES]
+
+        # the whole run and the current interval
+        self.total = LatencyHistogram()
+        self.current = LatencyHistogram()
+        self.lock = threading.Lock()
+
+    def execute(self, analysis, scheduled):
+        try:
+            ANALYSES[analysis](self.client, random.choice(self.portfolios), self.codes)
+            ok = True
+        except Exception as e:
+            LOG.debug("%s failed: %s", analysis, e)
+            ok = False
+
+        latency = time.time() - scheduled
+        with self.lock:
+            self.total.add(latency, ok)
+            self.current.add(latency, ok)
+
+    def closed_loop(self, deadline):
+        while time.time() < deadline:
+            self.execute(random.choice(self.analyses), time.time())
+
+    def open_loop(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            self.execute(*job)
+
+    def schedule(self, jobs, start, deadline):
+        # send the requests at regular times, whether the previous ones completed or not
+        sent = 0
+        while True:
+            scheduled = start + sent / float(self.rate)
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            jobs.put((random.choice(self.analyses), scheduled))
+            sent += 1
+
+        for _ in xrange(self.concurrency):
+            jobs.put(None)
+
+    def run(self, on_interval=None):
+        """
+        run the load and return the stats of the whole run, on_interval is
+        called with the stats of every interval
+        """
+
+        start = time.time()
+        deadline = start + self.duration
+
+        if self.rate is None:
+            threads = [threading.Thread(target=self.closed_loop, args=(deadline,))
+                       for _ in xrange(self.concurrency)]
+        else:
+            jobs = Queue.Queue()
+            threads = [threading.Thread(target=self.open_loop, args=(jobs,)) for _ in xrange(self.concurrency)]
+            threads.append(threading.Thread(target=self.schedule, args=(jobs, start, deadline)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        last = start
+        while True:
+            done = not any(thread.is_alive() for thread in threads)
+            now = time.time()
+
+            if done or now >= last + self.interval:
+                with self.lock:
+                    histogram, self.current = self.current, LatencyHistogram()
+                if on_interval is not None and histogram.count:
+                    stats = summarize(histogram, now - last)
+                    stats['time'] = now - start
+                    on_interval(stats)
+                last = now
+
+            if done:
+                break
+            time.sleep(min(0.1, max(0.0, last + self.interval - now)))
+
+        return summarize(self.total, time.time() - start)
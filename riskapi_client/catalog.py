@@ -0,0 +1,270 @@
+"""
+Local product catalog store, synchronized incrementally
+
+The catalog is kept in a sqlite database, by default one per host and
+customer in ~/.riskapi, which can be shared by all the processes of the host:
+the pages are downloaded without locking the database, the writes of the
+syncs are serialized by the database lock and readers always see the last
+complete sync.
+
+A full sync downloads the catalog in pages of fixed size and compares the
+checksum of every raw page with the one of the previous sync: unchanged
+pages are neither decoded nor written, the products of changed pages are
+updated and the ones which disappeared are deleted. Pages are offsets in the
+catalog, so a new or deleted product changes all the following pages.
+
+When the server can filter the catalog by update date, pass the name of the
+query parameter as since_param: only the products with a last_update after
+the newest one in the store are downloaded. Deleted products are detected
+only by full syncs.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+
+from riskapi_client import HTTPClient, BalancedHTTPClient, decode_body
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (code TEXT PRIMARY KEY, last_update TEXT, page INTEGER, data TEXT);
+CREATE INDEX IF NOT EXISTS products_page ON products (page);
+CREATE TABLE IF NOT EXISTS pages (page INTEGER PRIMARY KEY, checksum TEXT, count INTEGER);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+PAGE_SIZE = 20000
+
+# page of the products updated by a filtered sync and not yet seen by a full sync
+NO_PAGE = -1
+
+
+def default_catalog_path(client):
+    """return the default store file of the client host (or hosts) and customer"""
+
+    name = re.sub(r"[^\w.-]+", "_", "%s-%s" % (client.host, client.customer or ""))
+    if len(name) > 64:
+        # many balanced hosts
+        name = "%s-%s" % (name[:40], hashlib.sha1(name).hexdigest()[:16])
+    return os.path.join(os.path.expanduser("~/.riskapi"), "catalog-%s.sqlite" % name)
+
+
+def raw_client(web):
+    """return a client like web returning the raw response bodies"""
+
+    if isinstance(web, BalancedHTTPClient):
+        return BalancedHTTPClient([raw_client(client) for client in web.clients], web.retry, web.max_failures,
+                                  web.ejection_time, web.max_ejection_time)
+
+    return HTTPClient(web.scheme, web.host, web.port, auto_decode=False, retry=web.retry,
+                      ssl_context=web.ssl_context, lazy=True)
+
+
+class CatalogStore(object):
+    """sqlite store of the product catalog"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        self.path = path
+        self.last_stats = None
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        # readers are not blocked by a sync in progress
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def __contains__(self, code):
+        return self.db.execute("SELECT 1 FROM products WHERE code = ?", (code,)).fetchone() is not None
+
+    def get(self, code, default=None):
+        """return the catalog record of the given product code"""
+
+        row = self.db.execute("SELECT data FROM products WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def products(self):
+        """return the whole catalog, like RiskapiClient.products()"""
+
+        return [json.loads(data) for data, in self.db.execute("SELECT data FROM products ORDER BY code")]
+
+    def meta(self, name, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def _set_meta(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+    def _upsert(self, products, page):
+        # write the changed products, page None keeps the current page
+        if page is not None:
+            # most products are still on the same page
+            existing = {code: (data, row_page) for code, data, row_page in self.db.execute(
+                "SELECT code, data, page FROM products WHERE page = ?", (page,))}
+        else:
+            existing = {}
+
+        missing = [product['code'] for product in products if product['code'] not in existing]
+        for pos in xrange(0, len(missing), 500):
+            codes = missing[pos:pos + 500]
+            existing.update((code, (data, row_page)) for code, data, row_page in self.db.execute(
+                "SELECT code, data, page FROM products WHERE code IN (%s)" % ",".join("?" * len(codes)), codes))
+
+        rows = []
+        moved = []
+        for product in products:
+            data = json.dumps(product)
+            row = existing.get(product['code'])
+            if row is None:
+                rows.append((product['code'], product.get('last_update'), NO_PAGE if page is None else page, data))
+            elif row[0] != data:
+                rows.append((product['code'], product.get('last_update'), row[1] if page is None else page, data))
+            elif page is not None and row[1] != page:
+                moved.append((page, product['code']))
+
+        self.db.executemany("INSERT OR REPLACE INTO products (code, last_update, page, data) VALUES (?, ?, ?, ?)",
+                            rows)
+        self.db.executemany("UPDATE products SET page = ? WHERE code = ?", moved)
+        return len(rows)
+
+    def sync(self, client, since_param=None, page_size=PAGE_SIZE):
+        """
+        update the store from the server and return the sync stats (also
+        kept in last_stats): pages downloaded, pages changed, products
+        updated and deleted
+        """
+
+        stats = dict(pages=0, changed_pages=0, updated=0, deleted=0)
+        start = time.time()
+
+        # the download does not hold the write lock, only the writes do
+        since = self.meta('max_last_update')
+        if since_param is not None and since is not None:
+            products = self._download_since(client, since_param, since, stats)
+        else:
+            products = None
+            changed, end = self._download_pages(client, page_size, stats)
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if products is not None:
+                stats['updated'] = self._upsert(products, None)
+            else:
+                self._write_pages(changed, end, page_size, stats)
+
+            max_last_update = self.db.execute("SELECT MAX(last_update) FROM products").fetchone()[0]
+            self._set_meta('max_last_update', max_last_update)
+            self._set_meta('last_sync', start)
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+        self.last_stats = stats
+        return stats
+
+    def _download_since(self, client, since_param, since, stats):
+        products = client.webclient.fetch_paginated(client._url("statics/products"), PAGE_SIZE,
+                                                    {since_param: since}, client._headers)
+        stats['pages'] = 1
+        return products
+
+    def _download_pages(self, client, page_size, stats):
+        # return the changed pages, as (page, checksum, data) tuples, and the
+        # number of pages of the catalog
+        if self.meta('page_size') == page_size:
+            known = {page: (checksum, count)
+                     for page, checksum, count in self.db.execute("SELECT page, checksum, count FROM pages")}
+        else:
+            # the pages of a different size can't be compared
+            known = {}
+
+        # the raw bodies are needed for the checksums, gzip is not stable
+        headers = dict(client._headers)
+        headers.pop('Accept-Encoding', None)
+        url = client._url("statics/products")
+
+        changed = []
+        with raw_client(client.webclient) as raw:
+            page = 0
+            count = None
+            while count is None or page * page_size < count:
+                body = raw.get(url, dict(start=page * page_size, limit=page_size), headers)
+                checksum = hashlib.sha1(body).hexdigest()
+                stats['pages'] += 1
+
+                if page in known and known[page][0] == checksum:
+                    count = known[page][1]
+                else:
+                    data = decode_body(body, client.response_format)
+                    count = data['count']
+                    changed.append((page, checksum, data))
+
+                    if not data['data']:
+                        break
+
+                page += 1
+
+        return changed, page
+
+    def _write_pages(self, changed, end, page_size, stats):
+        if self.meta('page_size') != page_size:
+            self.db.execute("DELETE FROM pages")
+            self.db.execute("UPDATE products SET page = ?", (NO_PAGE,))
+            self._set_meta('page_size', page_size)
+
+        for page, checksum, data in changed:
+            stats['changed_pages'] += 1
+            stats['updated'] += self._upsert(data['data'], page)
+
+            codes = set(product['code'] for product in data['data'])
+            for code, in self.db.execute("SELECT code FROM products WHERE page = ?", (page,)).fetchall():
+                if code not in codes:
+                    self.db.execute("DELETE FROM products WHERE code = ?", (code,))
+                    stats['deleted'] += 1
+
+            self.db.execute("INSERT OR REPLACE INTO pages (page, checksum, count) VALUES (?, ?, ?)",
+                            (page, checksum, data['count']))
+
+        # products on pages beyond the end, or never seen by a full sync
+        stats['deleted'] += self.db.execute("DELETE FROM products WHERE page >= ? OR page = ?",
+                                            (end, NO_PAGE)).rowcount
+        self.db.execute("DELETE FROM pages WHERE page >= ?", (end,))
+
+
+def sync_catalog(client, path=None, since_param=None):
+    """
+    sync the local catalog store of the client (see default_catalog_path)
+    and return it
+    """
+
+    store = CatalogStore(path or default_catalog_path(client))
+    try:
+        store.sync(client, since_param)
+    except:
+        store.close()
+        raise
+
+    return store
@@ -0,0 +1,269 @@
+"""
+Memory-mapped store of product historical simulation scenarios
+
+A scenario cube is a single binary file holding a products x dates matrix of
+float64 scenario values plus a json header with the code -> row index, the
+dates axis and the "last_update" of every stored product. Files are versioned
+by the dataset "max_date" (see RiskapiClient.data_info), so several versions
+can live side by side in the same directory.
+
+The matrix is accessed through mmap, hence any number of worker processes
+opening the same file share the same physical pages instead of each holding
+its own copy of the scenarios as python lists.
+
+File layout:
+
+    MAGIC (8 bytes) | header length (uint64, little endian) | json header |
+    padding to 8 bytes | float64 matrix, row major, little endian
+
+Missing values (a date not available for a product) are stored as NaN.
+"""
+
+import os
+import re
+import json
+import mmap
+import struct
+import logging
+import tempfile
+
+from riskapi_client import RiskapiClientError
+
+
+LOG = logging.getLogger('riskapi.cube')
+
+MAGIC = "RAPISCN1"
+NAN = float('nan')
+
+
+class ScenarioCube(object):
+    """read-only view of a memory-mapped scenario cube file"""
+
+    FILE_PREFIX = "scenarios"
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+        with open(file_name, "rb") as ff:
+            if ff.read(len(MAGIC)) != MAGIC:
+                raise RiskapiClientError("Not a scenario cube file: %s" % file_name)
+
+            header_size, = struct.unpack("<Q", ff.read(8))
+            header = json.loads(ff.read(header_size))
+
+            self.mm = mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.version = header['version']
+        self.codes = header['codes']
+        self.dates = header['dates']
+        self.last_update = header['last_update']
+        self.index = {code: row for row, code in enumerate(self.codes)}
+
+        self.offset = _align(len(MAGIC) + 8 + header_size)
+        self.row_size = len(self.dates)
+        self._row_format = "<%dd" % self.row_size
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def __getitem__(self, code):
+        return self.row(code)
+
+    def row(self, code):
+        """return the scenario values of the given product, as a tuple aligned to self.dates"""
+
+        try:
+            row = self.index[code]
+        except KeyError:
+            raise KeyError(code)
+
+        return struct.unpack_from(self._row_format, self.mm, self.offset + row * self.row_size * 8)
+
+    def scenarios(self, code):
+        """return the scenarios of the given product as [date, value] pairs, like the server does"""
+
+        return [[date, value] for date, value in zip(self.dates, self.row(code))
+                if value == value]
+
+    @classmethod
+    def file_name_for(cls, directory, version):
+        return os.path.join(directory, "%s.%s.bin" % (cls.FILE_PREFIX, version))
+
+    @classmethod
+    def versions(cls, directory):
+        """return the versions available in the given directory, oldest first"""
+
+        pattern = re.compile(r"^%s\.(\d+)\.bin$" % re.escape(cls.FILE_PREFIX))
+        found = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    @classmethod
+    def open(cls, directory, version=None):
+        """open the given version of the cube stored in directory, by default the latest one"""
+
+        if version is None:
+            versions = cls.versions(directory)
+            if not versions:
+                raise RiskapiClientError("No scenario cube found in %s" % directory)
+            version = versions[-1]
+
+        return cls(cls.file_name_for(directory, version))
+
+    @classmethod
+    def build(cls, client, directory, codes, catalog=None, scenarios_key="scenarios"):
+        """
+        download the scenarios of the given product codes and store them in
+        the cube for the current dataset version, returning the opened cube.
+
+        If a cube for the same or a previous version already exists in
+        directory, only the products whose "last_update" differs from the
+        stored one (or which are not stored at all) are downloaded, the rows
+        of the other products are copied from the existing file. Products
+        are downloaded concurrently with RiskapiClient.products_detail,
+        bypassing its cache.
+
+        catalog is an optional mapping code -> last_update used to detect
+        the changed products without downloading them, by default it is
+        obtained from client.products().
+        """
+
+        version = client.data_info()['max_date']
+
+        previous = None
+        versions = [x for x in cls.versions(directory) if x <= version] if os.path.isdir(directory) else []
+        if versions:
+            previous = cls.open(directory, versions[-1])
+
+        try:
+            if catalog is None:
+                catalog = {x['code']: x['last_update'] for x in client.products()}
+
+            codes = sorted(set(codes))
+
+            stale = [code for code in codes
+                     if previous is None or code not in previous
+                     or previous.last_update.get(code) != catalog.get(code)]
+
+            LOG.debug("Scenario cube %s: %s products, %s to download",
+                      version, len(codes), len(stale))
+
+            if previous is not None and not stale and previous.version == version \
+                    and set(previous.codes) == set(codes):
+                cube, previous = previous, None
+                return cube
+
+            fetched = {}
+            last_update = {}
+            for code, record in client.products_detail(stale, cache=False).iteritems():
+                fetched[code] = dict((date, value) for date, value in record[scenarios_key])
+                last_update[code] = record.get('last_update', catalog.get(code))
+
+            dates = set()
+            for values in fetched.itervalues():
+                dates.update(values)
+            if previous is not None:
+                dates.update(previous.dates)
+            dates = sorted(dates)
+
+            stored = [code for code in codes if code in fetched or
+                      (previous is not None and code in previous)]
+
+            if previous is not None:
+                for code in stored:
+                    last_update.setdefault(code, previous.last_update.get(code))
+
+            header = dict(version=version, codes=stored, dates=dates, last_update=last_update)
+
+            file_name = cls.file_name_for(directory, version)
+            _write(file_name, header, cls._rows(stored, dates, fetched, previous))
+        finally:
+            if previous is not None:
+                previous.close()
+
+        return cls(file_name)
+
+    def refresh(self, client, directory=None, codes=None, catalog=None, scenarios_key="scenarios"):
+        """
+        bring the cube up to date with the server, downloading only the
+        changed products, and return the refreshed cube. The current cube is
+        closed.
+        """
+
+        if directory is None:
+            directory = os.path.dirname(self.file_name)
+
+        if codes is None:
+            codes = self.codes
+
+        cube = self.build(client, directory, codes, catalog, scenarios_key)
+        self.close()
+        return cube
+
+    @staticmethod
+    def _rows(codes, dates, fetched, previous):
+        # yield the packed rows of the new matrix, in the order of codes
+        row_format = "<%dd" % len(dates)
+
+        if previous is not None and previous.dates != dates:
+            positions = {date: i for i, date in enumerate(dates)}
+            remap = [positions[date] for date in previous.dates]
+        else:
+            remap = None
+
+        for code in codes:
+            if code in fetched:
+                values = fetched[code]
+                row = [values.get(date, NAN) for date in dates]
+            elif remap is None:
+                row = previous.row(code)
+            else:
+                row = [NAN] * len(dates)
+                for pos, value in zip(remap, previous.row(code)):
+                    row[pos] = value
+
+            yield struct.pack(row_format, *row)
+
+
+def _align(size, alignment=8):
+    return (size + alignment - 1) // alignment * alignment
+
+
+def _write(file_name, header, rows):
+    # write to a temporary file in the same directory, then atomically rename
+    # it: processes which have the previous file mapped keep reading it
+    directory = os.path.dirname(file_name) or "."
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    header = json.dumps(header)
+    prefix_size = len(MAGIC) + 8 + len(header)
+
+    fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as ff:
+            ff.write(MAGIC)
+            ff.write(struct.pack("<Q", len(header)))
+            ff.write(header)
+            ff.write("\0" * (_align(prefix_size) - prefix_size))
+            for row in rows:
+                ff.write(row)
+        os.rename(tmp_name, file_name)
+    except:
+        os.unlink(tmp_name)
+        raise
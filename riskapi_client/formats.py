@@ -0,0 +1,407 @@
+"""
+Streaming portfolio file formats
+
+Besides the json documents written by Portfolio.dump, portfolios can be
+stored in formats which can be written and read incrementally, in chunks of
+holdings, without building the whole document in memory:
+
+    csv
+        a "# {json header}" line with the portfolio properties, a header
+        row, then one row per holding: code, price, quantity,
+        currency_exchange_value, currency, price_factor followed by the
+        attributes. Empty cells are None.
+
+    msgpack
+        a stream of msgpack objects: the portfolio properties followed by
+        one encoded holding (see Holding.encode) per object. Requires the
+        msgpack module.
+
+    columnar
+        a compact binary file with one contiguous column per holding field,
+        read through mmap: only the requested rows are decoded. Layout:
+
+            MAGIC (8 bytes) | header length (uint64) | json header |
+            padding to 8 bytes | columns
+
+        Numeric columns are float64 (NaN for None), string columns are an
+        array of uint64 end offsets followed by the utf-8 data, attributes
+        are an array of uint64 end indexes in the "attribute" string column.
+        All the numbers are little endian.
+
+The portfolio properties are the dict returned as first item by
+Portfolio.encode (currency, type, outstanding, coverage_priority).
+"""
+
+import abc
+import csv
+import json
+import mmap
+import struct
+import tempfile
+
+from riskapi_client import Holding, Portfolio, RiskapiClientError, msgpack
+
+
+CSV_COLUMNS = ['code', 'price', 'quantity', 'currency_exchange_value', 'currency', 'price_factor']
+
+COLUMNAR_MAGIC = "RAPIPF01"
+FLOAT_COLUMNS = ['price', 'quantity', 'currency_exchange_value', 'price_factor']
+STRING_COLUMNS = ['code', 'currency', 'attribute']
+
+NAN = float('nan')
+
+
+def _float(value):
+    return float(value) if value != "" else None
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class PortfolioReader(object):
+    """
+    base class of the streaming readers: iterate to get the holdings, built
+    by holding_class
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, file_name, holding_class=Holding):
+        self.file_name = file_name
+        self.holding_class = holding_class
+        self.properties = None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @abc.abstractmethod
+    def __iter__(self):
+        """yield the holdings"""
+
+    def chunks(self, chunk_size=10000):
+        """yield lists of up to chunk_size holdings"""
+
+        chunk = []
+        for holding in self:
+            chunk.append(holding)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def portfolio(self, cls=Portfolio):
+        """read the whole portfolio"""
+
+        holdings = list(self)
+        return cls(self.properties['currency'], holdings, self.properties['type'],
+                   self.properties['outstanding'], self.properties['coverage_priority'])
+
+
+class JSONReader(PortfolioReader):
+    """reader of the json files written by Portfolio.dump, not really streaming"""
+
+    def __init__(self, file_name, holding_class=Holding):
+        super(JSONReader, self).__init__(file_name, holding_class)
+
+        with open(file_name, "rb") as ff:
+            data = json.load(ff)
+
+        self.properties = data[0]
+        self._holdings = data[1]
+
+    def __iter__(self):
+        for row in self._holdings:
+            yield self.holding_class(*row)
+
+
+class CSVReader(PortfolioReader):
+    def __init__(self, file_name, holding_class=Holding):
+        super(CSVReader, self).__init__(file_name, holding_class)
+
+        self.file = open(file_name, "rb")
+        line = self.file.readline()
+        if not line.startswith("#"):
+            raise RiskapiClientError("Missing portfolio properties in %s" % file_name)
+        self.properties = json.loads(line[1:])
+        self.reader = csv.reader(self.file)
+        next(self.reader)
+
+    def close(self):
+        self.file.close()
+
+    def __iter__(self):
+        for row in self.reader:
+            yield self.holding_class(row[0].decode('utf-8'), _float(row[1]), _float(row[2]), _float(row[3]),
+                                     [x.decode('utf-8') for x in row[6:]], row[4].decode('utf-8') or None,
+                                     _float(row[5]))
+
+
+class MsgpackReader(PortfolioReader):
+    def __init__(self, file_name, holding_class=Holding):
+        super(MsgpackReader, self).__init__(file_name, holding_class)
+
+        if msgpack is None:
+            raise RiskapiClientError("msgpack module not installed")
+
+        self.file = open(file_name, "rb")
+        self.unpacker = msgpack.Unpacker(self.file, encoding='utf-8')
+        self.properties = next(self.unpacker)
+
+    def close(self):
+        self.file.close()
+
+    def __iter__(self):
+        for row in self.unpacker:
+            yield self.holding_class(*row)
+
+
+class ColumnarReader(PortfolioReader):
+    DECODED_CACHE_SIZE = 100000
+
+    def __init__(self, file_name, holding_class=Holding):
+        super(ColumnarReader, self).__init__(file_name, holding_class)
+
+        self._decoded = {}
+
+        with open(file_name, "rb") as ff:
+            if ff.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+                raise RiskapiClientError("Not a columnar portfolio file: %s" % file_name)
+
+            header_size, = struct.unpack("<Q", ff.read(8))
+            header = json.loads(ff.read(header_size))
+
+            self.mm = mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.properties = header['properties']
+        self.size = header['size']
+        self.columns = header['columns']
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.size
+
+    def _floats(self, name, start, stop):
+        values = struct.unpack_from("<%dd" % (stop - start), self.mm, self.columns[name] + start * 8)
+        return [value if value == value else None for value in values]
+
+    def _ends(self, offset, start, stop):
+        # return the end offsets of items start..stop, preceded by the end of item start-1
+        if start == 0:
+            return (0,) + struct.unpack_from("<%dQ" % stop, self.mm, offset)
+        return struct.unpack_from("<%dQ" % (stop - start + 1), self.mm, offset + (start - 1) * 8)
+
+    def _strings(self, name, start, stop):
+        offset, data = self.columns[name]
+        ends = self._ends(offset, start, stop)
+
+        # codes, currencies and attributes are highly repeated: decode each one once
+        decoded = self._decoded
+        if len(decoded) > self.DECODED_CACHE_SIZE:
+            decoded.clear()
+
+        mm = self.mm
+        values = []
+        for i in xrange(len(ends) - 1):
+            raw = mm[data + ends[i]:data + ends[i + 1]]
+            value = decoded.get(raw)
+            if value is None:
+                value = decoded[raw] = raw.decode('utf-8')
+            values.append(value)
+        return values
+
+    def rows(self, start, stop):
+        """return the holdings from start to stop, decoding only the needed data"""
+
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+
+        codes = self._strings('code', start, stop)
+        currencies = self._strings('currency', start, stop)
+        prices = self._floats('price', start, stop)
+        quantities = self._floats('quantity', start, stop)
+        cevs = self._floats('currency_exchange_value', start, stop)
+        factors = self._floats('price_factor', start, stop)
+
+        counts = self._ends(self.columns['attributes'], start, stop)
+        attributes = self._strings('attribute', counts[0], counts[-1])
+        base = counts[0]
+
+        holding_class = self.holding_class
+        return [holding_class(codes[i], prices[i], quantities[i], cevs[i],
+                              attributes[counts[i] - base:counts[i + 1] - base],
+                              currencies[i] or None, factors[i])
+                for i in xrange(stop - start)]
+
+    def chunks(self, chunk_size=10000):
+        for start in xrange(0, self.size, chunk_size):
+            yield self.rows(start, start + chunk_size)
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for holding in chunk:
+                yield holding
+
+
+def write_json(file_name, properties, holdings):
+    with open(file_name, "wb") as ff:
+        json.dump([properties, [x.encode() for x in holdings]], ff)
+
+
+def write_csv(file_name, properties, holdings):
+    with open(file_name, "wb") as ff:
+        ff.write("#%s\n" % json.dumps(properties))
+        writer = csv.writer(ff)
+        writer.writerow(CSV_COLUMNS + ['attributes'])
+        for holding in holdings:
+            writer.writerow([_text(holding.code), _text(holding.price), _text(holding.quantity),
+                             _text(holding.currency_exchange_value), _text(holding.currency),
+                             _text(holding.price_factor)] +
+                            [_text(x) for x in holding.attributes])
+
+
+def write_msgpack(file_name, properties, holdings):
+    if msgpack is None:
+        raise RiskapiClientError("msgpack module not installed")
+
+    packer = msgpack.Packer(encoding='utf-8')
+    with open(file_name, "wb") as ff:
+        ff.write(packer.pack(properties))
+        for holding in holdings:
+            ff.write(packer.pack(holding.encode()))
+
+
+def write_columnar(file_name, properties, holdings):
+    # every column is spooled to its own temporary file, then they are
+    # concatenated: memory usage does not depend on the number of holdings
+    spools = {}
+    for name in FLOAT_COLUMNS + ['attributes']:
+        spools[name] = tempfile.TemporaryFile()
+    for name in STRING_COLUMNS:
+        spools[name] = (tempfile.TemporaryFile(), tempfile.TemporaryFile())
+    ends = dict.fromkeys(STRING_COLUMNS + ['attributes'], 0)
+
+    def add_string(name, value):
+        value = _text(value)
+        offsets, data = spools[name]
+        data.write(value)
+        ends[name] += len(value)
+        offsets.write(struct.pack("<Q", ends[name]))
+
+    size = 0
+    try:
+        for holding in holdings:
+            size += 1
+            add_string('code', holding.code)
+            add_string('currency', holding.currency)
+            for name in FLOAT_COLUMNS:
+                value = getattr(holding, name)
+                spools[name].write(struct.pack("<d", NAN if value is None else value))
+            for attribute in holding.attributes:
+                add_string('attribute', attribute)
+            ends['attributes'] += len(holding.attributes)
+            spools['attributes'].write(struct.pack("<Q", ends['attributes']))
+
+        # compute the column offsets, the header size must be known first
+        blocks = []
+        for name in FLOAT_COLUMNS + ['attributes']:
+            blocks.append((name, None, spools[name]))
+        for name in STRING_COLUMNS:
+            blocks.append((name, 0, spools[name][0]))
+            blocks.append((name, 1, spools[name][1]))
+
+        def header_for(start):
+            columns = {}
+            position = start
+            for name, part, spool in blocks:
+                if part is None:
+                    columns[name] = position
+                else:
+                    columns.setdefault(name, [None, None])[part] = position
+                position = _align(position + spool.tell())
+            return json.dumps(dict(properties=properties, size=size, columns=columns))
+
+        # the offsets are written as fixed size numbers, so the header length
+        # converges in a couple of iterations
+        header = header_for(0)
+        while True:
+            start = _align(len(COLUMNAR_MAGIC) + 8 + len(header))
+            new_header = header_for(start)
+            if len(new_header) == len(header):
+                header = new_header
+                break
+            header = new_header
+
+        with open(file_name, "wb") as ff:
+            ff.write(COLUMNAR_MAGIC)
+            ff.write(struct.pack("<Q", len(header)))
+            ff.write(header)
+            ff.write("\0" * (start - len(COLUMNAR_MAGIC) - 8 - len(header)))
+            for name, part, spool in blocks:
+                length = spool.tell()
+                spool.seek(0)
+                while True:
+                    block = spool.read(1024 * 1024)
+                    if not block:
+                        break
+                    ff.write(block)
+                ff.write("\0" * (_align(length) - length))
+    finally:
+        for spool in spools.itervalues():
+            if isinstance(spool, tuple):
+                for item in spool:
+                    item.close()
+            else:
+                spool.close()
+
+
+def _align(size, alignment=8):
+    return (size + alignment - 1) // alignment * alignment
+
+
+READERS = dict(json=JSONReader, csv=CSVReader, msgpack=MsgpackReader, columnar=ColumnarReader)
+WRITERS = dict(json=write_json, csv=write_csv, msgpack=write_msgpack, columnar=write_columnar)
+
+
+def open_portfolio(file_name, format="json", holding_class=Holding):
+    """
+    return a streaming reader for the given portfolio file, yielding
+    holding_class instances
+    """
+
+    try:
+        reader = READERS[format]
+    except KeyError:
+        raise RiskapiClientError("Invalid portfolio format: should be one of %s" % READERS.keys())
+
+    return reader(file_name, holding_class)
+
+
+def write_portfolio(file_name, properties, holdings, format="json"):
+    """
+    write a portfolio file with the given properties (see Portfolio.encode)
+    from an iterable of holdings, which is consumed only once
+    """
+
+    try:
+        writer = WRITERS[format]
+    except KeyError:
+        raise RiskapiClientError("Invalid portfolio format: should be one of %s" % WRITERS.keys())
+
+    writer(file_name, properties, holdings)
@@ -0,0 +1,108 @@
+"""
+Local index of the products catalog
+
+The index is built from RiskapiClient.products() and allows to check the
+coverage of a portfolio before sending it to the server, and to answer
+product searches without a server round trip.
+"""
+
+import bisect
+
+from riskapi_client import Portfolio, RiskapiClientError
+
+
+class ProductIndex(object):
+    """hash and sorted prefix index of the products catalog"""
+
+    def __init__(self, products):
+        self.products = list(products)
+        self.codes = {product['code']: pos for pos, product in enumerate(self.products)}
+
+        # sorted (lowercase key, position) pairs, for prefix searches on codes and descriptions
+        self.prefixes = sorted(
+            [(product['code'].lower(), pos) for pos, product in enumerate(self.products)] +
+            [((product.get('description') or u"").lower(), pos)
+             for pos, product in enumerate(self.products)])
+        self._keys = [key for key, _ in self.prefixes]
+
+    @classmethod
+    def from_client(cls, client):
+        """build the index by downloading the whole catalog"""
+
+        return cls(client.products())
+
+    def __len__(self):
+        return len(self.products)
+
+    def __contains__(self, code):
+        return code in self.codes
+
+    def get(self, code, default=None):
+        """return the catalog record of the given product code"""
+
+        pos = self.codes.get(code)
+        if pos is None:
+            return default
+        return self.products[pos]
+
+    def search(self, search, limit=None):
+        """
+        return the products whose code or description starts with search
+        (case insensitive), like RiskapiClient.products(search, limit)
+        """
+
+        search = search.lower()
+        start = bisect.bisect_left(self._keys, search)
+
+        found = set()
+        for key, pos in self.prefixes[start:]:
+            if not key.startswith(search):
+                break
+            found.add(pos)
+
+        found = sorted(found)
+        if limit is not None:
+            found = found[:limit]
+
+        return [self.products[pos] for pos in found]
+
+    def uncovered(self, portfolio):
+        """return the holdings of the portfolio whose product is not in the catalog"""
+
+        return [holding for holding in portfolio.holdings if holding.code not in self.codes]
+
+    def errors(self, portfolio):
+        """return the errors the server would report for the uncovered holdings of the portfolio"""
+
+        return [[2, u"uncovered", u"Client code not found: %r" % holding.code, [holding.code, None]]
+                for holding in self.uncovered(portfolio)]
+
+    def check(self, portfolio, uncovered="drop"):
+        """
+        validate the portfolio before sending it, returning a (portfolio,
+        errors) pair where errors are in the same format reported by the
+        server. Depending on "uncovered":
+
+            drop
+                the returned portfolio does not contain the uncovered holdings
+            report
+                the returned portfolio is the given one
+            raise
+                raise a RiskapiClientError if any holding is uncovered
+        """
+
+        if uncovered not in ("drop", "report", "raise"):
+            raise RiskapiClientError("Invalid uncovered policy: %s" % uncovered)
+
+        errors = self.errors(portfolio)
+
+        if errors and uncovered == "raise":
+            raise RiskapiClientError("Uncovered products: %s" % ", ".join(x[3][0] for x in errors))
+
+        if errors and uncovered == "drop":
+            portfolio = Portfolio(
+                portfolio.currency,
+                [holding for holding in portfolio.holdings if holding.code in self.codes],
+                portfolio.type, portfolio.outstanding, portfolio.coverage_priority)
+
+        return portfolio, errors
@@ -0,0 +1,132 @@
+"""
+Risk decomposition cache serving subsets of the cached results
+
+A risk decomposition computed for some functions and fields contains the
+decomposition of any subset of them: DecompositionCache keeps the
+decompositions received and answers the requests for a subset of the
+functions and fields of a cached one, with the same portfolio and
+parameters, by projecting it locally instead of asking the server again.
+
+With upgrade, the first request for a portfolio and parameters asks for all
+the functions and fields, so that all the following ones are answered from
+the cache whatever subset they ask for.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+def project_risk_decomposition(results, functions, fields):
+    """
+    return the results of a (multi-level) risk decomposition restricted to
+    the given functions and fields
+    """
+
+    if isinstance(results, list):
+        # multi-level: the portfolio totals, then one decomposition per level
+        return [_project(item, functions, fields) for item in results]
+    return _project(results, functions, fields)
+
+
+def _project(item, functions, fields):
+    projected = {}
+    for name in functions:
+        if name not in item:
+            continue
+
+        value = item[name]
+        if isinstance(value, list):
+            if name == "exposure":
+                value = [dict(row, attributes=list(row['attributes'])) for row in value]
+            else:
+                value = [_project_row(row, fields) for row in value]
+        projected[name] = value
+    return projected
+
+
+def _project_row(row, fields):
+    projected = {field: row[field] for field in fields if field in row}
+    projected['attributes'] = list(row['attributes'])
+    return projected
+
+
+class DecompositionCache(object):
+    """
+    cache of risk decompositions, keyed by the request without its
+    functions and fields: at most max_entries of them are kept, for at most
+    max_age seconds, as the results change when a new dataset is loaded on
+    the server. Thread safe, it can be shared by several clients.
+    """
+
+    def __init__(self, max_entries=128, max_age=300.0, upgrade=True):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.upgrade = upgrade
+
+        # key -> [(functions, fields, time, data)]
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = dict(hits=0, misses=0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get(self, key, functions, fields):
+        """
+        return the projection of a cached response with a superset of the
+        given functions and fields, or None
+        """
+
+        functions = frozenset(functions)
+        fields = frozenset(fields)
+        now = time.time()
+
+        with self.lock:
+            entries = self.entries.pop(key, [])
+            if self.max_age is not None:
+                entries = [entry for entry in entries if now - entry[2] <= self.max_age]
+
+            data = None
+            for cached_functions, cached_fields, _, cached in entries:
+                if functions <= cached_functions and fields <= cached_fields:
+                    data = cached
+                    break
+
+            if entries:
+                # most recently used last
+                self.entries[key] = entries
+            self.stats['hits' if data is not None else 'misses'] += 1
+
+        if data is None:
+            return None
+        return self.project(data, functions, fields)
+
+    @staticmethod
+    def project(data, functions, fields):
+        """
+        return a copy of a risk decomposition response restricted to the
+        given functions and fields, the cached responses are never returned
+        """
+
+        result = dict(data)
+        result['errors'] = list(data.get('errors') or [])
+        result['results'] = project_risk_decomposition(data['results'], functions, fields)
+        return result
+
+    def put(self, key, functions, fields, data):
+        """cache the response of a request for the given functions and fields"""
+
+        functions = frozenset(functions)
+        fields = frozenset(fields)
+
+        with self.lock:
+            # the entries answered by the new one are not needed anymore
+            entries = [entry for entry in self.entries.pop(key, [])
+                       if not (entry[0] <= functions and entry[1] <= fields)]
+            entries.append((functions, fields, time.time(), data))
+            self.entries[key] = entries
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,95 @@
+"""
+Client-side multi-level rollup of additive decompositions
+
+The multi-level decomposition endpoints return one decomposition for every
+prefix of the holdings attributes lists, plus the portfolio total. For
+additive measures (stress test P&L, exposure, risk contributions) every
+coarser level is just the sum of the finest one, so it can be derived
+locally from a single finest-level decomposition.
+"""
+
+from collections import OrderedDict
+
+from riskapi_client import RiskapiClientError
+
+
+ADDITIVE_RISK_FIELDS = ['contribution_risk', 'contribution_pct']
+
+
+def _depth(items):
+    return max([len(attributes) for attributes in items] or [0])
+
+
+def _group(pairs, level):
+    # sum (attributes, value) pairs by attributes prefix, keeping the order of appearance
+    sums = OrderedDict()
+    for attributes, value in pairs:
+        key = tuple(attributes[:level])
+        sums[key] = sums.get(key, 0.0) + value
+    return sums
+
+
+def rollup_stress_test_decomposition(results, depth=None):
+    """
+    given the "results" of a stress test decomposition, return the list of
+    per-level decompositions in the same shape returned by the
+    multi-level stress test decomposition: the total first, followed by
+    one decomposition for each attributes level.
+    """
+
+    if depth is None:
+        depth = _depth(attributes for rows in results.itervalues() for attributes, _ in rows)
+
+    levels = []
+    for level in xrange(depth + 1):
+        levels.append({code: [[list(attributes), value]
+                              for attributes, value in _group(rows, level).iteritems()]
+                       for code, rows in results.iteritems()})
+    return levels
+
+
+def rollup_risk_decomposition(results, depth=None):
+    """
+    given the "results" of a risk decomposition containing only additive
+    fields (see ADDITIVE_RISK_FIELDS), return the list of per-level
+    decompositions in the same shape returned by the multi-level risk
+    decomposition: the totals first, followed by one decomposition for each
+    attributes level.
+    """
+
+    for name, rows in results.iteritems():
+        if name == "exposure":
+            continue
+        for row in rows:
+            extra = set(row) - set(ADDITIVE_RISK_FIELDS) - {'attributes'}
+            if extra:
+                raise RiskapiClientError("Fields %s of %s are not additive" % (sorted(extra), name))
+
+    if depth is None:
+        depth = _depth(row['attributes'] for rows in results.itervalues() for row in rows)
+
+    total = {}
+    for name, rows in results.iteritems():
+        field = "exposure" if name == "exposure" else "contribution_risk"
+        total[name] = sum(row[field] for row in rows if row.get(field) is not None)
+
+    levels = [total]
+    for level in xrange(1, depth + 1):
+        decomposition = {}
+        for name, rows in results.iteritems():
+            fields = ["exposure"] if name == "exposure" else ADDITIVE_RISK_FIELDS
+            grouped = OrderedDict()
+            for row in rows:
+                key = tuple(row['attributes'][:level])
+                item = grouped.setdefault(key, dict(attributes=list(key)))
+                for field in fields:
+                    if field in row:
+                        value = row[field]
+                        if value is None or item.get(field, 0.0) is None:
+                            item[field] = None
+                        else:
+                            item[field] = item.get(field, 0.0) + value
+            decomposition[name] = grouped.values()
+        levels.append(decomposition)
+
+    return levels
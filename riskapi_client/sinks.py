@@ -0,0 +1,189 @@
+"""
+Streaming result sinks
+
+A sink writes records (json-serializable dicts) to a file as they are
+produced, buffering at most buffer_size records in memory. Sinks are thread
+safe, so they can be shared by concurrent callers, and can be attached to a
+RiskapiClient (see RiskapiClient.attach_sink) to record every analysis
+response as soon as it is decoded.
+
+The fsync policy controls durability:
+
+    never
+        rely on the operating system
+    flush
+        fsync every time the buffer is written
+    close
+        fsync only when the sink is closed
+
+Available sinks: JSONLSink (one json object per line), MsgpackSink (a
+stream of msgpack objects, requires msgpack) and ColumnarSink (blocks of
+separately stored columns, requires msgpack, read back with read_columnar).
+"""
+
+import abc
+import os
+import json
+import struct
+import threading
+
+from riskapi_client import RiskapiClientError, msgpack
+
+
+FSYNC_POLICIES = ("never", "flush", "close")
+
+COLUMNAR_MAGIC = "RAPIRS02"
+
+
+class ResultSink(object):
+    """base class of the sinks, subclasses implement _dump"""
+
+    __metaclass__ = abc.ABCMeta
+
+    mode = "ab"
+
+    def __init__(self, file_name, buffer_size=100, fsync="close"):
+        if fsync not in FSYNC_POLICIES:
+            raise RiskapiClientError("Invalid fsync policy: should be one of %s" % (FSYNC_POLICIES,))
+
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+
+        self.buffer = []
+        self.count = 0
+        self.lock = threading.Lock()
+        self.file = open(file_name, self.mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, record):
+        """add a record, writing the buffer to the file when full"""
+
+        with self.lock:
+            self.buffer.append(record)
+            self.count += 1
+            if len(self.buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self._flush()
+            if self.fsync == "close":
+                os.fsync(self.file.fileno())
+            self.file.close()
+
+    def _flush(self):
+        if self.buffer:
+            self._dump(self.buffer)
+            self.buffer = []
+
+        self.file.flush()
+        if self.fsync == "flush":
+            os.fsync(self.file.fileno())
+
+    @abc.abstractmethod
+    def _dump(self, records):
+        """write the records to self.file"""
+
+
+class JSONLSink(ResultSink):
+    def _dump(self, records):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+class MsgpackSink(ResultSink):
+    def __init__(self, file_name, buffer_size=100, fsync="close"):
+        if msgpack is None:
+            raise RiskapiClientError("msgpack module not installed")
+
+        self.packer = msgpack.Packer()
+
+        super(MsgpackSink, self).__init__(file_name, buffer_size, fsync)
+
+    def _dump(self, records):
+        self.file.write("".join(self.packer.pack(record) for record in records))
+
+
+class ColumnarSink(ResultSink):
+    """
+    every flush writes a block holding one list of values per record key,
+    each one packed separately so that it can be read without the others
+    (the records of a block without a key read it back as None).
+    The file starts with COLUMNAR_MAGIC, then each block is made of:
+
+        header size     uint64, little endian
+        header          msgpack [record count, [[column name, size], ...]]
+        columns         one msgpack list per column, in header order
+    """
+
+    def __init__(self, file_name, buffer_size=1000, fsync="close"):
+        if msgpack is None:
+            raise RiskapiClientError("msgpack module not installed")
+
+        self.packer = msgpack.Packer(encoding='utf-8')
+
+        super(ColumnarSink, self).__init__(file_name, buffer_size, fsync)
+
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.write(COLUMNAR_MAGIC)
+
+    def _dump(self, records):
+        names = []
+        for record in records:
+            for name in record:
+                if name not in names:
+                    names.append(name)
+
+        packed = [self.packer.pack([record.get(name) for record in records]) for name in names]
+        header = self.packer.pack([len(records), [[name, len(column)] for name, column in zip(names, packed)]])
+        self.file.write(struct.pack("<Q", len(header)) + header + "".join(packed))
+
+
+def read_columnar(file_name, columns=None):
+    """
+    yield the records stored by a ColumnarSink, optionally only the given
+    columns: the other ones are skipped without being read
+    """
+
+    if msgpack is None:
+        raise RiskapiClientError("msgpack module not installed")
+
+    with open(file_name, "rb") as ff:
+        if ff.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise RiskapiClientError("Not a columnar results file: %s" % file_name)
+
+        file_size = os.fstat(ff.fileno()).st_size
+        while True:
+            size = ff.read(8)
+            if len(size) < 8:
+                break
+            size, = struct.unpack("<Q", size)
+            header = ff.read(size)
+            if len(header) < size:
+                # incomplete block left by a crash
+                break
+
+            count, sizes = msgpack.unpackb(header, encoding='utf-8')
+            if ff.tell() + sum(column_size for _, column_size in sizes) > file_size:
+                break
+
+            values = {}
+            for name, column_size in sizes:
+                if columns is None or name in columns:
+                    values[name] = msgpack.unpackb(ff.read(column_size), encoding='utf-8')
+                else:
+                    ff.seek(column_size, os.SEEK_CUR)
+
+            for pos in xrange(count):
+                yield {name: column[pos] for name, column in values.iteritems()}
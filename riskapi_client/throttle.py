@@ -0,0 +1,160 @@
+"""
+Client-side rate limiting and adaptive concurrency control
+
+Both limiters are thread safe and can be shared by several clients to
+coordinate all the threads talking to the same server.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+
+LOG = logging.getLogger('riskapi.throttle')
+
+
+class TokenBucket(object):
+    """
+    token bucket rate limiter: allows "rate" requests per second on
+    average, with bursts of up to "burst" requests
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = dict(acquired=0, waited=0.0, pauses=0)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """wait until a request can be sent"""
+
+        while True:
+            with self.lock:
+                now = time.time()
+                self._refill(now)
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats['acquired'] += 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+                self.stats['waited'] += wait
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """stop all the requests for the given time, e.g. after a Retry-After"""
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.tokens = 0
+            self.stats['pauses'] += 1
+
+
+class AIMDLimiter(object):
+    """
+    adaptive limit on the number of concurrent requests: the limit grows
+    by "increase" every "limit" successful requests and is multiplied by
+    "decrease" when the server is overloaded (errors, 429/503 responses) or
+    when the average latency of an endpoint grows over latency_tolerance
+    times the lowest one observed for it. Decreases are applied at most once
+    per observed latency, so a burst of failures of requests sent together
+    counts once.
+
+    The latencies are kept per endpoint, as a fast endpoint must not be
+    compared with the baseline of a slow one, for at most max_endpoints of
+    them.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0, decrease=0.5,
+                 latency_tolerance=3.0, max_endpoints=256):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.max_endpoints = max_endpoints
+
+        self.in_flight = 0
+        # endpoint -> [average latency, baseline], least recently used first
+        self.endpoints = OrderedDict()
+        self.last_decrease = 0.0
+
+        self.condition = threading.Condition()
+        self.stats = dict(requests=0, overloaded=0, decreases=0)
+
+    def acquire(self):
+        """wait for a free slot"""
+
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded=False, endpoint=None):
+        """
+        release a slot, reporting the latency of the request to endpoint
+        (time to first byte, so that the size of the response does not
+        count) and whether the server was overloaded
+        """
+
+        with self.condition:
+            self.in_flight -= 1
+            self.stats['requests'] += 1
+
+            state = self.endpoints.pop(endpoint, None)
+            if overloaded:
+                self.stats['overloaded'] += 1
+                self._decrease(latency, state)
+            elif state is None:
+                state = [latency, latency]
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            else:
+                state[0] = 0.8 * state[0] + 0.2 * latency
+                # the baseline slowly drifts up so that an old minimum expires
+                if state[0] < state[1]:
+                    state[1] = state[0]
+                else:
+                    state[1] *= 1.001
+
+                if self.latency_tolerance and state[0] > state[1] * self.latency_tolerance:
+                    self._decrease(latency, state)
+                else:
+                    self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+            if state is not None:
+                self.endpoints[endpoint] = state
+                while len(self.endpoints) > self.max_endpoints:
+                    self.endpoints.popitem(last=False)
+
+            self.condition.notify_all()
+
+    def latency(self, endpoint=None):
+        """return the average latency of endpoint, or None"""
+
+        with self.condition:
+            state = self.endpoints.get(endpoint)
+            return state[0] if state is not None else None
+
+    def _decrease(self, latency, state):
+        now = time.time()
+        if now - self.last_decrease < max(latency, state[0] if state else 0.0, 0.1):
+            return
+
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self.stats['decreases'] += 1
+        LOG.debug("Concurrency limit decreased to %s", self.limit)
@@ -0,0 +1,223 @@
+"""
+Request tracing
+
+A Tracer records spans, timed and nested operations, and hands the finished
+ones to an exporter. When a RiskapiClient has a tracer, every call of its
+methods is a span, with children for each step of the requests:
+
+    <method name>
+        encode              serialization of the request body
+        host                one try on a host, parent of its request span,
+                            when there are several hosts
+        request             one http request, with its X-Request-ID
+            attempt         one per try, a retried request has several
+                send        sending the request
+                wait        waiting for the response headers
+                download    reading the response body
+                decode      decoding the response body
+            backoff         sleep before the next attempt
+
+Spans started in a thread while another span is active are its children,
+also the ones started by code which does not know the tracer (see span).
+The active span is per thread: work handed to other threads is kept in the
+same trace by activating the span there (see activate).
+
+Exporters: MemoryExporter keeps the spans in a list, LogExporter logs them
+and FileExporter appends them to a JSONL file. Any object with an export
+method taking a Span can be used.
+"""
+
+import time
+import random
+import logging
+import threading
+
+from riskapi_client.sinks import JSONLSink
+
+
+LOG = logging.getLogger('riskapi.tracing')
+
+_local = threading.local()
+
+
+def new_id(bits=64):
+    """return a random hex identifier"""
+
+    return "%0*x" % (bits // 4, random.getrandbits(bits))
+
+
+def current_span():
+    """return the span active in this thread, if any"""
+
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def span(name, **attributes):
+    """
+    return a child span of the active span of this thread, or a span which
+    records nothing if there is none
+    """
+
+    parent = current_span()
+    if parent is None:
+        return NULL_SPAN
+    return Span(parent.tracer, name, parent.trace_id, parent.span_id, attributes)
+
+
+class activate(object):
+    """
+    make a span started in another thread the active span of this thread,
+    use it as a context manager: the span is neither timed nor exported
+    """
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        if self.span is not None:
+            stack = getattr(_local, 'stack', None)
+            if stack is None:
+                stack = _local.stack = []
+            stack.append(self.span)
+        return self.span
+
+    def __exit__(self, *args):
+        if self.span is not None:
+            _local.stack.pop()
+
+
+class Span(object):
+    """a timed operation, use it as a context manager"""
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.end = time.time()
+        if exc_type is not None:
+            self.attributes['error'] = "%s: %s" % (exc_type.__name__, exc_value)
+
+        _local.stack.pop()
+        self.tracer.export(self)
+
+    def to_dict(self):
+        return dict(name=self.name, trace_id=self.trace_id, span_id=self.span_id, parent_id=self.parent_id,
+                    start=self.start, end=self.end, duration=self.duration, attributes=self.attributes)
+
+    def __repr__(self):
+        return "Span(%r, %s, %.6fs)" % (self.name, self.span_id, self.duration or 0.0)
+
+
+class NullSpan(object):
+    """a span which records nothing"""
+
+    trace_id = span_id = parent_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """start spans and export them when they finish"""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter if exporter is not None else MemoryExporter()
+
+    def span(self, name, **attributes):
+        """return a new span, child of the active span of this thread if any"""
+
+        parent = current_span()
+        if parent is None:
+            return Span(self, name, new_id(128), None, attributes)
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def export(self, span):
+        try:
+            self.exporter.export(span)
+        except Exception as e:
+            LOG.warning("Cannot export span %s: %s", span.name, e)
+
+
+class MemoryExporter(object):
+    """keep the finished spans in memory, at most max_spans of them"""
+
+    def __init__(self, max_spans=100000):
+        self.max_spans = max_spans
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        with self.lock:
+            self.spans.append(span)
+            if self.max_spans is not None and len(self.spans) > self.max_spans:
+                del self.spans[:len(self.spans) - self.max_spans]
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def trace(self, trace_id):
+        """return the spans of the given trace"""
+
+        with self.lock:
+            return [span for span in self.spans if span.trace_id == trace_id]
+
+
+class LogExporter(object):
+    """log the finished spans"""
+
+    def __init__(self, logger=LOG, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def export(self, span):
+        self.logger.log(self.level, "span %s %.6fs trace=%s id=%s parent=%s %s", span.name, span.duration,
+                        span.trace_id, span.span_id, span.parent_id, span.attributes)
+
+
+class FileExporter(object):
+    """append the finished spans to a JSONL file, see sinks.JSONLSink"""
+
+    def __init__(self, file_name, buffer_size=100, fsync="never"):
+        self.sink = JSONLSink(file_name, buffer_size, fsync)
+
+    def export(self, span):
+        self.sink.write(span.to_dict())
+
+    def close(self):
+        self.sink.close()
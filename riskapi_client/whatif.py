@@ -0,0 +1,150 @@
+"""
+Local stress test what-if analysis
+
+The stress test P&L of a portfolio is linear in the holdings quantities, so
+once the P&L of one unit of every product is known for each scenario, the
+stress test of any re-sized variant of the portfolio is a dot product
+between the quantities and the per-unit P&L matrix, evaluated without
+calling the server. Only portfolios of quantities are supported: the
+holdings of a portfolio of weights are not independent of each other (the
+server may normalize the weights), so their P&L is not linear.
+
+The per-unit P&L is obtained with a single stress test decomposition of a
+portfolio holding one unit of every distinct product, each one tagged with
+its own attribute. The server is called again only for products which are
+not in the matrix yet.
+
+numpy is used for the dot product when installed.
+"""
+
+import logging
+
+from riskapi_client import Portfolio, Holding, RiskapiClientError
+
+numpy = None
+try:
+    import numpy
+except ImportError:
+    pass
+
+
+LOG = logging.getLogger('riskapi.whatif')
+
+
+class StressTestWhatIf(object):
+    """stress test engine evaluating portfolio variants from cached per-unit P&L"""
+
+    def __init__(self, client, portfolio, codes=None):
+        """
+        build the engine for the given base portfolio and stress test
+        scenario codes (all the available ones by default). The variants
+        must share currency, type, outstanding and coverage priority of the
+        base portfolio, otherwise they are sent to the server. The base
+        portfolio must be of type "quantities".
+        """
+
+        if portfolio.type != "quantities":
+            raise RiskapiClientError("What-if analysis requires a portfolio of quantities, not %s"
+                                     % portfolio.type)
+
+        self.client = client
+        self.codes = codes
+        self.base = (portfolio.currency, portfolio.type,
+                     portfolio.outstanding, portfolio.coverage_priority)
+
+        self.scenarios = None
+        self.index = {}
+        self.rows = []
+        self.errors = {}
+        self.server_calls = 0
+        self._matrix = None
+
+        self.add(portfolio.holdings)
+
+    @staticmethod
+    def key(holding):
+        """return what identifies the product of an holding, regardless of quantity and attributes"""
+
+        return (holding.code, holding.price, holding.currency_exchange_value,
+                holding.currency, holding.price_factor)
+
+    def add(self, holdings):
+        """fetch the per-unit P&L of the products of the given holdings which are not known yet"""
+
+        keys = []
+        for holding in holdings:
+            key = self.key(holding)
+            if key not in self.index and key not in keys:
+                keys.append(key)
+
+        if not keys:
+            return
+
+        currency, type_, outstanding, coverage_priority = self.base
+        units = Portfolio(
+            currency,
+            [Holding(code, price, 1, cev, [str(pos)], holding_currency, price_factor)
+             for pos, (code, price, cev, holding_currency, price_factor) in enumerate(keys)],
+            type_, outstanding, coverage_priority)
+
+        LOG.debug("Fetching per-unit stress test P&L for %s products", len(keys))
+
+        data = self.client.stress_test_decomposition(units, self.codes)
+        self.server_calls += 1
+
+        if self.scenarios is None:
+            if self.codes is not None:
+                self.scenarios = list(self.codes)
+            else:
+                self.scenarios = sorted(data['results'])
+
+        positions = {code: pos for pos, code in enumerate(self.scenarios)}
+        rows = [[0.0] * len(self.scenarios) for _ in keys]
+        for scenario, items in data['results'].iteritems():
+            column = positions[scenario]
+            for attributes, value in items:
+                rows[int(attributes[0])][column] = value
+
+        for error in data.get('errors', []):
+            self.errors.setdefault(error[3][0] if error[3] else None, error)
+
+        for key, row in zip(keys, rows):
+            self.index[key] = len(self.rows)
+            self.rows.append(row)
+
+        self._matrix = None
+
+    def stress_test(self, portfolio):
+        """
+        return the stress test of the given portfolio, in the same format
+        returned by RiskapiClient.stress_test
+        """
+
+        base = (portfolio.currency, portfolio.type,
+                portfolio.outstanding, portfolio.coverage_priority)
+        if base != self.base:
+            LOG.debug("Portfolio %s differs from base %s, using the server", base, self.base)
+            self.server_calls += 1
+            return self.client.stress_test(portfolio, self.codes)
+
+        self.add(portfolio.holdings)
+
+        quantities = [0.0] * len(self.rows)
+        errors = []
+        for holding in portfolio.holdings:
+            quantities[self.index[self.key(holding)]] += holding.quantity
+            if holding.code in self.errors:
+                errors.append(self.errors[holding.code])
+
+        if numpy is not None:
+            if self._matrix is None:
+                self._matrix = numpy.array(self.rows, dtype=float).reshape(len(self.rows), len(self.scenarios))
+            totals = numpy.dot(numpy.array(quantities, dtype=float), self._matrix).tolist()
+        else:
+            totals = [0.0] * len(self.scenarios)
+            for quantity, row in zip(quantities, self.rows):
+                if quantity:
+                    for column, value in enumerate(row):
+                        totals[column] += quantity * value
+
+        return dict(errors=errors, results=[[code, total] for code, total in zip(self.scenarios, totals)])
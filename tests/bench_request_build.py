@@ -0,0 +1,56 @@
+"""
+Microbenchmark of the per-call client overhead
+
+Measures the time spent building the url and the headers of a request, with
+the precomputed tables and rebuilding them at every call, then the rate of
+small product(code) requests. Connects like the integration tests, with
+~/.riskapi.conf:
+
+    python tests/bench_request_build.py [calls]
+"""
+
+import sys
+import time
+
+import riskapi_client
+
+
+def timed(func, calls):
+    start = time.time()
+    for _ in xrange(calls):
+        func()
+    return (time.time() - start) / calls
+
+
+def main(calls=100000):
+    client = riskapi_client.connect()
+    try:
+        code = client.products(limit=1)[0]['code']
+        resource = "statics/products/%s" % code
+
+        def cached():
+            client._url(resource)
+            client._headers
+
+        def rebuilt():
+            # any configuration change drops the precomputed tables
+            client.keep_alive = client.keep_alive
+            client._url(resource)
+            client._headers
+
+        cached_time = timed(cached, calls)
+        rebuilt_time = timed(rebuilt, calls)
+
+        print "request build, precomputed: %.2f us/call" % (cached_time * 1e6)
+        print "request build, rebuilt:     %.2f us/call" % (rebuilt_time * 1e6)
+        print "saved per call:             %.2f us" % ((rebuilt_time - cached_time) * 1e6)
+
+        requests = max(1, calls // 100)
+        request_time = timed(lambda: client.product(code), requests)
+        print "product(code):              %.1f calls/s" % (1.0 / request_time)
+    finally:
+        client.webclient.close()
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,59 @@
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.balancer import BalancedHTTPClient, HostState
+
+
+class FakeClient(object):
+    """answer the product catalog pages, counting the requests"""
+
+    scheme = "http"
+    port = None
+    max_connections = 2
+    last_request = None
+
+    def __init__(self, host, products=()):
+        self.host = host
+        self.products = list(products)
+        self.requests = 0
+
+    def get(self, path, params=None, headers=None, postprocess=None):
+        self.requests += 1
+        start, limit = params['start'], params['limit']
+        return dict(count=len(self.products), data=self.products[start:start + limit])
+
+    def close(self):
+        pass
+
+
+def test_score():
+    host = HostState(FakeClient("a"))
+    nt.assert_equal(host.score(0.5), 0.5)
+
+    host.latency = 0.1
+    host.outstanding = 2
+    nt.assert_almost_equal(host.score(0.5), 0.3)
+
+
+def test_new_host_scored_with_mean_latency():
+    clients = [FakeClient(name) for name in "abc"]
+    balancer = BalancedHTTPClient(clients)
+    slow, fast, new = balancer.hosts
+    slow.latency = 1.0
+    fast.latency = 0.1
+
+    # the new host is scored 0.55, the fast one 0.1 per request in flight plus one
+    chosen = [balancer._choose(set()) for _ in range(6)]
+    nt.assert_equal(chosen, [fast] * 5 + [new])
+    nt.assert_equal(slow.outstanding, 0)
+
+
+def test_fetch_paginated():
+    products = [dict(code="P%s" % i) for i in range(25)]
+    clients = [FakeClient(name, products) for name in "ab"]
+    balancer = BalancedHTTPClient(clients)
+
+    nt.assert_equal(balancer.fetch_paginated("/products", 10, None), products)
+    nt.assert_equal(sum(client.requests for client in clients), 3)
+    nt.assert_equal(balancer.PAGE_TIME, riskapi_client.HTTPClient.PAGE_TIME)
+    nt.assert_equal(sum(x['requests'] for x in balancer.host_stats), 3)
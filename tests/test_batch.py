@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+import tempfile
+
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.batch import completed_jobs, load_manifest, run_batch
+
+
+class Crash(BaseException):
+    """a process crash, not handled by the runner"""
+
+
+class FakeClient(object):
+    """answer risk() locally, crashing after crash_after calls and failing the given portfolios"""
+
+    def __init__(self, crash_after=None, failing=()):
+        self.crash_after = crash_after
+        self.failing = failing
+        self.calls = []
+
+    def risk(self, portfolio, percentiles):
+        if self.crash_after is not None and len(self.calls) >= self.crash_after:
+            raise Crash()
+
+        code = portfolio.holdings[0].code
+        self.calls.append(code)
+        if code in self.failing:
+            raise riskapi_client.HTTPError(422, "invalid portfolio")
+        return dict(errors=[], results=[dict(percentile=percentiles[0], var=len(code))])
+
+
+class TestBatch(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "results.jsonl")
+
+        jobs = []
+        for pos in xrange(6):
+            name = "pf%s.json" % pos
+            portfolio = riskapi_client.Portfolio("EUR")
+            portfolio.add("CODE%s" % pos, quantity=pos + 1)
+            portfolio.dump(os.path.join(self.directory, name))
+            jobs.append(dict(id="job%s" % pos, portfolio=name, analysis="risk",
+                             params=dict(percentiles=[0.99])))
+
+        self.manifest = os.path.join(self.directory, "manifest.json")
+        with open(self.manifest, "wb") as ff:
+            json.dump(dict(jobs=jobs), ff)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def lines(self):
+        with open(self.output, "rb") as ff:
+            return [json.loads(line) for line in ff]
+
+    def test_resume_after_crash(self):
+        client = FakeClient(crash_after=3, failing=["CODE1"])
+        with nt.assert_raises(Crash):
+            run_batch(client, self.manifest, self.output, workers=1)
+
+        lines = self.lines()
+        nt.assert_equal([x['id'] for x in lines], ["job0", "job1", "job2"])
+        nt.assert_equal([x['status'] for x in lines], ["ok", "error", "ok"])
+        nt.assert_equal(completed_jobs(self.output), {"job0", "job2"})
+
+        # the failed job and the ones never run are executed again
+        client = FakeClient()
+        stats = run_batch(client, self.manifest, self.output, workers=1)
+
+        nt.assert_equal(client.calls, ["CODE1", "CODE3", "CODE4", "CODE5"])
+        nt.assert_equal(stats, dict(total=6, skipped=2, ok=4, error=0))
+        nt.assert_equal(completed_jobs(self.output), {"job%s" % pos for pos in xrange(6)})
+
+        # nothing left to do
+        client = FakeClient()
+        stats = run_batch(client, self.manifest, self.output, workers=4)
+        nt.assert_equal(client.calls, [])
+        nt.assert_equal(stats['skipped'], 6)
+
+    def test_truncate_partial_line(self):
+        with nt.assert_raises(Crash):
+            run_batch(FakeClient(crash_after=2), self.manifest, self.output, workers=1)
+
+        # a line cut by a crash in the middle of a write
+        with open(self.output, "ab") as ff:
+            ff.write('{"id": "job2", "status": "ok", "res')
+
+        nt.assert_equal(completed_jobs(self.output), {"job0", "job1"})
+        with open(self.output, "rb") as ff:
+            nt.assert_true(ff.read().endswith("\n"))
+
+        stats = run_batch(FakeClient(), self.manifest, self.output, workers=2)
+        nt.assert_equal(stats, dict(total=6, skipped=2, ok=4, error=0))
+
+        lines = self.lines()
+        nt.assert_equal(sorted(x['id'] for x in lines), ["job%s" % pos for pos in xrange(6)])
+        for line in lines:
+            nt.assert_equal(line['result']['results'][0]['var'], 5)
+
+    def test_invalid_manifest(self):
+        with open(self.manifest, "wb") as ff:
+            json.dump(dict(jobs=[dict(id="a", portfolio="pf0.json", analysis="system_info")]), ff)
+
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            load_manifest(self.manifest)
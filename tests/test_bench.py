@@ -0,0 +1,108 @@
+import math
+import random
+import time
+
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.bench import LatencyHistogram, LoadGenerator, summarize
+
+
+def exact_percentile(values, p):
+    values = sorted(values)
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+def test_percentile_empty():
+    histogram = LatencyHistogram()
+    nt.assert_is_none(histogram.percentile(50))
+    nt.assert_is_none(histogram.max)
+
+
+def test_percentile_single():
+    histogram = LatencyHistogram()
+    histogram.add(0.25)
+    for p in (0, 50, 99, 100):
+        nt.assert_equal(histogram.percentile(p), 0.25)
+
+
+def test_percentile_precision():
+    random.seed(1)
+    values = [random.lognormvariate(-3, 1.5) for _ in range(10000)] + [0.0, 1e-9]
+    histogram = LatencyHistogram(precision=0.01)
+    for value in values:
+        histogram.add(value)
+
+    for p in (1, 10, 50, 90, 99, 99.9, 100):
+        exact = max(exact_percentile(values, p), histogram.minimum)
+        nt.assert_true(exact <= histogram.percentile(p) <= exact * 1.01 + 1e-12, p)
+    nt.assert_equal(histogram.percentile(100), max(values))
+
+
+def test_histogram_bounded():
+    histogram = LatencyHistogram()
+    for pos in xrange(100000):
+        histogram.add(pos * 1e-4)
+    nt.assert_equal(histogram.count, 100000)
+    nt.assert_less(len(histogram.buckets), 1500)
+
+
+def test_summarize():
+    histogram = LatencyHistogram()
+    for pos in xrange(1, 101):
+        histogram.add(pos / 1000.0, ok=pos % 10 != 0)
+
+    stats = summarize(histogram, 2.0)
+    nt.assert_equal(stats['requests'], 100)
+    nt.assert_equal(stats['errors'], 10)
+    nt.assert_almost_equal(stats['error_rate'], 0.1)
+    nt.assert_almost_equal(stats['throughput'], 50.0)
+    nt.assert_almost_equal(stats['p50'], 0.05, delta=0.0005)
+    nt.assert_almost_equal(stats['p90'], 0.09, delta=0.001)
+    nt.assert_almost_equal(stats['p99'], 0.099, delta=0.001)
+    nt.assert_equal(stats['max'], 0.1)
+
+
+def test_summarize_empty():
+    stats = summarize(LatencyHistogram(), 0.0)
+    nt.assert_equal(stats, dict(requests=0, errors=0, error_rate=0.0, throughput=0.0,
+                                p50=None, p90=None, p99=None, max=None))
+
+
+class FakeClient(object):
+    """answer data_info after a short delay, failing one call in four"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def data_info(self):
+        self.calls += 1
+        time.sleep(0.002)
+        if self.calls % 4 == 0:
+            raise riskapi_client.RiskapiClientError("failed")
+        return {}
+
+
+def test_load_generator():
+    client = FakeClient()
+    generator = LoadGenerator(client, ["data_info"], [None], concurrency=2, duration=0.5, interval=0.1)
+    intervals = []
+    stats = generator.run(intervals.append)
+
+    nt.assert_greater(len(intervals), 2)
+    nt.assert_equal(sum(x['requests'] for x in intervals), stats['requests'])
+    nt.assert_equal(stats['requests'], client.calls)
+    nt.assert_greater(stats['errors'], 0)
+    nt.assert_greater_equal(stats['p50'], 0.002)
+
+
+def test_load_generator_rate():
+    generator = LoadGenerator(FakeClient(), ["data_info"], [None], concurrency=2, rate=100, duration=0.3)
+    stats = generator.run()
+    nt.assert_almost_equal(stats['requests'], 30, delta=2)
+
+
+def test_invalid_analysis():
+    with nt.assert_raises(riskapi_client.RiskapiClientError):
+        LoadGenerator(FakeClient(), ["nothing"], [None])
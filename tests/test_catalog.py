@@ -0,0 +1,27 @@
+import os
+
+import nose.tools as nt
+
+from riskapi_client.catalog import default_catalog_path
+
+
+class FakeClient(object):
+    def __init__(self, host, customer=None):
+        self.host = host
+        self.customer = customer
+
+
+def test_default_catalog_path():
+    path = default_catalog_path(FakeClient("localhost:8000"))
+    nt.assert_equal(os.path.dirname(path), os.path.expanduser("~/.riskapi"))
+    nt.assert_equal(os.path.basename(path), "catalog-localhost_8000-.sqlite")
+
+    nt.assert_equal(os.path.basename(default_catalog_path(FakeClient("a:1,b:2", "c/../d"))),
+                    "catalog-a_1_b_2-c_.._d.sqlite")
+
+
+def test_default_catalog_path_many_hosts():
+    hosts = ",".join("riskapi-%s.example.com:8443" % i for i in range(20))
+    name = os.path.basename(default_catalog_path(FakeClient(hosts, "customer")))
+    nt.assert_less(len(name), 100)
+    nt.assert_not_equal(name, os.path.basename(default_catalog_path(FakeClient(hosts[:-1], "customer"))))
@@ -0,0 +1,198 @@
+import os
+import ssl
+import json
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import nose.tools as nt
+
+import riskapi_client
+
+CERTIFICATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "localhost.pem")
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps(dict(path=self.path))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.path == "/close":
+            # the client is not told, as when an idle connection times out
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """local keep-alive server, over tls when given a certificate"""
+
+    daemon_threads = True
+
+    def __init__(self, certificate=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ("localhost", 0), Handler)
+        self.context = None
+        if certificate is not None:
+            self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            self.context.load_cert_chain(certificate)
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        if self.context is not None:
+            sock = self.context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+    def handle_error(self, request, address):
+        # clients closing their idle connections
+        pass
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def client(server, **kwargs):
+    if server.context is None:
+        return riskapi_client.HTTPClient("http", "localhost", server.server_port, **kwargs)
+
+    context = ssl.create_default_context(cafile=CERTIFICATE)
+    return riskapi_client.HTTPClient("https", "localhost", server.server_port, ssl_context=context, **kwargs)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestConnections(object):
+    certificate = None
+
+    def setup(self):
+        self.server = Server(self.certificate).__enter__()
+
+    def teardown(self):
+        self.server.__exit__()
+
+    def test_reuse(self):
+        with client(self.server, max_connections=2) as http:
+            for _ in range(5):
+                nt.assert_equal(http.get("/x"), dict(path="/x"))
+            nt.assert_equal(http.connect_stats['connections'], 1)
+            nt.assert_equal(http.connect_stats['reused'], 5)
+            nt.assert_equal(http.connect_stats['stale'], 0)
+
+    def test_prewarmed_reused(self):
+        with client(self.server, max_connections=4, lazy=True) as http:
+            http.prewarm(4)
+            # the server may have sent data without a request meanwhile (tls 1.3 session tickets)
+            time.sleep(0.1)
+
+            conns = [http._acquire() for _ in range(4)]
+            for conn in conns:
+                http._release(conn)
+            for _ in range(4):
+                http.get("/x")
+
+            stats = http.connect_stats
+            nt.assert_equal((stats['connections'], stats['reused'], stats['stale']), (4, 8, 0))
+
+    def test_stale(self):
+        with client(self.server) as http:
+            http.get("/close")
+            time.sleep(0.1)
+            nt.assert_equal(http.get("/x"), dict(path="/x"))
+
+            stats = http.connect_stats
+            nt.assert_equal((stats['connections'], stats['reused'], stats['stale']), (2, 1, 1))
+
+    def test_prewarm_max_connections(self):
+        with client(self.server, max_connections=3, lazy=True) as http:
+            threads = [threading.Thread(target=http.prewarm, args=(3,)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            nt.assert_equal(http.open_connections, 3)
+            nt.assert_equal(http.pool.qsize(), 3)
+            nt.assert_equal(http.connect_stats['connections'], 3)
+
+            http.prewarm(5)
+            nt.assert_equal(http.connect_stats['connections'], 3)
+
+    def test_spares_refilled(self):
+        with client(self.server, max_connections=4, spare_connections=2) as http:
+            nt.assert_true(wait_for(lambda: http.pool.qsize() == 2))
+
+            # a request takes a spare, another one is opened in background
+            conn = http._acquire()
+            try:
+                nt.assert_true(wait_for(lambda: http.pool.qsize() == 2))
+                nt.assert_equal(http.open_connections, 3)
+            finally:
+                http._release(conn)
+
+            for _ in range(10):
+                http.get("/x")
+            nt.assert_true(http.open_connections <= 4)
+
+    def test_requests_within_max_connections(self):
+        with client(self.server, max_connections=2, spare_connections=2) as http:
+            errors = []
+
+            def run():
+                try:
+                    for _ in range(10):
+                        http.get("/x")
+                        http.prewarm(2)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            nt.assert_equal(errors, [])
+            nt.assert_true(wait_for(lambda: not http._refilling))
+            nt.assert_true(http.open_connections <= 2)
+            nt.assert_true(http.pool.qsize() <= 2)
+
+
+class TestTLSConnections(TestConnections):
+    certificate = CERTIFICATE
+
+
+def test_warmup_failure():
+    # an error other than a connection error during the warmup
+    def prewarm(self, count):
+        raise ssl.CertificateError("hostname mismatch")
+
+    with Server() as server:
+        original = riskapi_client.HTTPClient.prewarm
+        riskapi_client.HTTPClient.prewarm = prewarm
+        try:
+            client = riskapi_client.RiskapiClient("localhost:%s" % server.server_port, scheme="http", warmup=True)
+        finally:
+            riskapi_client.HTTPClient.prewarm = original
+
+        with client:
+            client.wait_warmup(5.0)
+            nt.assert_false(client._warmup_thread.is_alive())
+            nt.assert_equal(client.data_info(), dict(path="/api/v1/statics/data-info"))
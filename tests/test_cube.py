@@ -0,0 +1,135 @@
+import os
+import math
+import shutil
+import struct
+import tempfile
+
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.cube import MAGIC, ScenarioCube
+
+
+class FakeClient(object):
+    """answer the dataset version and the products scenarios, recording the products downloaded"""
+
+    def __init__(self, version, products):
+        self.version = version
+        self.records = products
+        self.downloaded = []
+
+    def data_info(self):
+        return dict(max_date=self.version)
+
+    def products(self):
+        return [dict(code=code, last_update=record['last_update']) for code, record in self.records.iteritems()]
+
+    def products_detail(self, codes, max_workers=None, cache=True):
+        nt.assert_false(cache)
+        self.downloaded.extend(codes)
+        return {code: self.records[code] for code in codes if code in self.records}
+
+
+def product(last_update, scenarios):
+    return dict(last_update=last_update, scenarios=scenarios)
+
+
+PRODUCTS = {
+    u"A": product(u"2024-01-01", [[u"2024-01-01", 1.0], [u"2024-01-02", 2.0]]),
+    u"B": product(u"2024-01-01", [[u"2024-01-02", -0.5]]),
+    u"C": product(u"2024-01-01", [[u"2024-01-01", 3.0], [u"2024-01-02", 4.0]]),
+}
+
+
+class TestScenarioCube(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_file_format(self):
+        client = FakeClient(20240102, PRODUCTS)
+        with ScenarioCube.build(client, self.directory, [u"B", u"A", u"X"]) as cube:
+            nt.assert_equal(cube.file_name, os.path.join(self.directory, "scenarios.20240102.bin"))
+            nt.assert_equal(cube.codes, [u"A", u"B"])
+            nt.assert_equal(cube.dates, [u"2024-01-01", u"2024-01-02"])
+            nt.assert_equal(cube.last_update, {u"A": u"2024-01-01", u"B": u"2024-01-01"})
+            nt.assert_equal(cube.offset % 8, 0)
+
+            nt.assert_equal(cube[u"A"], (1.0, 2.0))
+            nt.assert_true(math.isnan(cube.row(u"B")[0]))
+            nt.assert_equal(cube.scenarios(u"B"), [[u"2024-01-02", -0.5]])
+            nt.assert_not_in(u"X", cube)
+            with nt.assert_raises(KeyError):
+                cube.row(u"X")
+
+        with open(cube.file_name, "rb") as ff:
+            data = ff.read()
+        nt.assert_equal(data[:len(MAGIC)], MAGIC)
+        nt.assert_equal(len(data), cube.offset + 2 * 2 * 8)
+
+        # the matrix is row major, the missing values are NaN
+        values = struct.unpack_from("<4d", data, cube.offset)
+        nt.assert_equal(values[:2], (1.0, 2.0))
+        nt.assert_true(math.isnan(values[2]))
+        nt.assert_equal(values[3], -0.5)
+
+    def test_invalid_file(self):
+        file_name = os.path.join(self.directory, "scenarios.1.bin")
+        with open(file_name, "wb") as ff:
+            ff.write("not a cube")
+
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            ScenarioCube(file_name)
+        empty = os.path.join(self.directory, "empty")
+        os.mkdir(empty)
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            ScenarioCube.open(empty)
+
+    def test_unchanged(self):
+        client = FakeClient(20240102, PRODUCTS)
+        ScenarioCube.build(client, self.directory, [u"A", u"B"]).close()
+
+        # the same version and products: the file is reused
+        client.downloaded = []
+        with ScenarioCube.build(client, self.directory, [u"A", u"B"]) as cube:
+            nt.assert_equal(cube[u"A"], (1.0, 2.0))
+        nt.assert_equal(client.downloaded, [])
+        nt.assert_equal(ScenarioCube.versions(self.directory), [20240102])
+
+    def test_refresh(self):
+        client = FakeClient(20240102, PRODUCTS)
+        cube = ScenarioCube.build(client, self.directory, [u"A", u"B"])
+
+        # a new dataset adds a date, A changes and C is new
+        products = dict(PRODUCTS)
+        products[u"A"] = product(u"2024-01-03", [[u"2024-01-02", 5.0], [u"2024-01-03", 6.0]])
+        client = FakeClient(20240103, products)
+
+        cube = cube.refresh(client, codes=[u"A", u"B", u"C"])
+        with cube:
+            nt.assert_equal(sorted(client.downloaded), [u"A", u"C"])
+            nt.assert_equal(cube.version, 20240103)
+            nt.assert_equal(cube.dates, [u"2024-01-01", u"2024-01-02", u"2024-01-03"])
+
+            # the rows copied from the previous cube are remapped to the new dates
+            nt.assert_equal(cube.scenarios(u"B"), [[u"2024-01-02", -0.5]])
+            nt.assert_true(math.isnan(cube.row(u"B")[2]))
+            nt.assert_equal(cube.scenarios(u"A"), [[u"2024-01-02", 5.0], [u"2024-01-03", 6.0]])
+            nt.assert_equal(cube.scenarios(u"C"), [[u"2024-01-01", 3.0], [u"2024-01-02", 4.0]])
+            nt.assert_equal(cube.last_update[u"A"], u"2024-01-03")
+
+        nt.assert_equal(ScenarioCube.versions(self.directory), [20240102, 20240103])
+        with ScenarioCube.open(self.directory) as cube:
+            nt.assert_equal(cube.version, 20240103)
+
+    def test_catalog(self):
+        client = FakeClient(20240102, PRODUCTS)
+        ScenarioCube.build(client, self.directory, [u"A", u"B"]).close()
+
+        # the catalog tells which products changed, without asking the server
+        client.downloaded = []
+        catalog = {u"A": u"2024-01-01", u"B": u"2024-01-05"}
+        ScenarioCube.build(client, self.directory, [u"A", u"B"], catalog).close()
+        nt.assert_equal(client.downloaded, [u"B"])
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client import formats
+
+
+PROPERTIES = dict(currency="EUR", type="quantities", outstanding=None, coverage_priority=None)
+
+HOLDINGS = [
+    riskapi_client.Holding(u"US0003041052", None, 13000.0, None, [u"Equity", u"US"]),
+    riskapi_client.Holding(u"US000324AA15", 115.25, 10000.0, 1.1, [], u"USD", 0.01),
+    riskapi_client.Holding(u"XS\xe9", 99.5, -2.5, None, [u"Bond", u"\xe9t\xe9", u"x"], u"EUR", None),
+]
+
+
+class TestFormats(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def roundtrip(self, format, holdings):
+        file_name = os.path.join(self.directory, "portfolio.%s" % format)
+        riskapi_client.write_portfolio(file_name, PROPERTIES, iter(holdings), format)
+
+        with riskapi_client.open_portfolio(file_name, format) as reader:
+            nt.assert_equal(reader.properties, PROPERTIES)
+            return reader.portfolio()
+
+    def check_roundtrip(self, format, holdings):
+        portfolio = self.roundtrip(format, holdings)
+
+        nt.assert_equal(portfolio.currency, "EUR")
+        nt.assert_equal(portfolio.type, "quantities")
+        nt.assert_equal([x.encode() for x in portfolio.holdings], [x.encode() for x in holdings])
+
+    def test_roundtrip(self):
+        for format in sorted(formats.READERS):
+            yield self.check_roundtrip, format, HOLDINGS
+
+    def test_empty_portfolio(self):
+        for format in sorted(formats.READERS):
+            yield self.check_roundtrip, format, []
+
+    def test_columnar_rows(self):
+        file_name = os.path.join(self.directory, "portfolio.columnar")
+        holdings = HOLDINGS * 100
+        riskapi_client.write_portfolio(file_name, PROPERTIES, holdings, "columnar")
+
+        with riskapi_client.open_portfolio(file_name, "columnar") as reader:
+            nt.assert_equal(len(reader), 300)
+            nt.assert_equal([x.encode() for x in reader.rows(149, 152)],
+                            [x.encode() for x in holdings[149:152]])
+            nt.assert_equal(reader.rows(299, 400)[0].encode(), holdings[299].encode())
+            nt.assert_equal(reader.rows(300, 400), [])
+            nt.assert_equal([len(x) for x in reader.chunks(128)], [128, 128, 44])
+
+    def test_invalid_format(self):
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            riskapi_client.open_portfolio(os.path.join(self.directory, "x"), "xml")
+
+    def test_abstract_reader(self):
+        with nt.assert_raises(TypeError):
+            formats.PortfolioReader("x")
+
+    def test_dump_normalized_portfolio(self):
+        portfolio = riskapi_client.Portfolio("EUR", HOLDINGS + HOLDINGS[:1], normalize=True)
+        for format in sorted(formats.READERS):
+            file_name = os.path.join(self.directory, "portfolio.%s" % format)
+            portfolio.dump(file_name, format)
+            loaded = riskapi_client.Portfolio.load(file_name, format)
+            nt.assert_equal([x.encode() for x in loaded.holdings], [x.encode() for x in portfolio.holdings])
+
+    def test_normalized_rounding(self):
+        portfolio = riskapi_client.Portfolio("EUR")
+        for quantity in [0.1, 0.2, -0.3]:
+            portfolio.add(u"XXX", quantity=quantity)
+        portfolio.add(u"YYY", quantity=1e-12)
+
+        normalized, rows = portfolio.normalized()
+        nt.assert_equal([x.code for x in normalized.holdings], [u"YYY"])
+        nt.assert_equal(rows, [[3]])
+
+    def test_load_holding_class(self):
+        class TaggedHolding(riskapi_client.Holding):
+            pass
+
+        class TaggedPortfolio(riskapi_client.Portfolio):
+            Holding = TaggedHolding
+
+        portfolio = riskapi_client.Portfolio("EUR", list(HOLDINGS))
+        for format in sorted(formats.READERS):
+            file_name = os.path.join(self.directory, "portfolio.%s" % format)
+            portfolio.dump(file_name, format)
+            loaded = TaggedPortfolio.load(file_name, format)
+            nt.assert_equal([type(x) for x in loaded.holdings], [TaggedHolding] * len(HOLDINGS))
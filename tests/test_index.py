@@ -0,0 +1,77 @@
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.index import ProductIndex
+
+PRODUCTS = [
+    dict(code=u"US0003041052", description=u"Amica Corp"),
+    dict(code=u"US000324AA15", description=u"Usco Bond 2030"),
+    dict(code=u"XS0001", description=None),
+    dict(code=u"AB0001", description=u"us Treasury"),
+]
+
+
+class FakeClient(object):
+    def products(self):
+        return list(PRODUCTS)
+
+
+def codes(products):
+    return [x['code'] for x in products]
+
+
+def test_lookup():
+    index = ProductIndex.from_client(FakeClient())
+
+    nt.assert_equal(len(index), 4)
+    nt.assert_in(u"XS0001", index)
+    nt.assert_not_in(u"xs0001", index)
+    nt.assert_equal(index.get(u"AB0001"), PRODUCTS[3])
+    nt.assert_is_none(index.get(u"XXX"))
+
+
+def test_search():
+    index = ProductIndex(PRODUCTS)
+
+    # codes and descriptions, case insensitive, in catalog order
+    nt.assert_equal(codes(index.search(u"us")), [u"US0003041052", u"US000324AA15", u"AB0001"])
+    nt.assert_equal(codes(index.search(u"US00032")), [u"US000324AA15"])
+    nt.assert_equal(codes(index.search(u"amica")), [u"US0003041052"])
+    nt.assert_equal(codes(index.search(u"us", 2)), [u"US0003041052", u"US000324AA15"])
+    nt.assert_equal(index.search(u"zz"), [])
+
+    # a product matching by code and description is returned once
+    nt.assert_equal(codes(index.search(u"")), codes(PRODUCTS))
+
+
+def test_check():
+    index = ProductIndex(PRODUCTS)
+    portfolio = riskapi_client.Portfolio("EUR")
+    portfolio.add(u"US0003041052", quantity=10)
+    portfolio.add(u"XXX", quantity=5)
+    portfolio.add(u"XS0001", quantity=1)
+
+    nt.assert_equal([x.code for x in index.uncovered(portfolio)], [u"XXX"])
+
+    checked, errors = index.check(portfolio)
+    nt.assert_equal([x.code for x in checked.holdings], [u"US0003041052", u"XS0001"])
+    nt.assert_equal(checked.currency, "EUR")
+    nt.assert_equal(errors, [[2, u"uncovered", u"Client code not found: u'XXX'", [u"XXX", None]]])
+    nt.assert_equal(len(portfolio.holdings), 3)
+
+    checked, errors = index.check(portfolio, "report")
+    nt.assert_is(checked, portfolio)
+    nt.assert_equal(len(errors), 1)
+
+    with nt.assert_raises(riskapi_client.RiskapiClientError):
+        index.check(portfolio, "raise")
+    with nt.assert_raises(riskapi_client.RiskapiClientError):
+        index.check(portfolio, "ignore")
+
+
+def test_check_covered():
+    index = ProductIndex(PRODUCTS)
+    portfolio = riskapi_client.Portfolio("EUR")
+    portfolio.add(u"AB0001")
+
+    nt.assert_equal(index.check(portfolio, "raise"), (portfolio, []))
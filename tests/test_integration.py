@@ -1,10 +1,20 @@
+import os
+import json
+import multiprocessing
+import multiprocessing.pool
 import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import threading
 
 import nose.tools as nt
 from voluptuous import (
     Schema, Optional, All, Range, Any, Match, Datetime, ExactSequence)
 
 import riskapi_client
+from riskapi_client import catalog
 
 SIZE = 100
 BM_SIZE = 200
@@ -208,6 +218,12 @@ RiskAttributionDecompositionSchema = Schema([
     }, required=True)])
 
 
+def level_functions(data):
+    """postprocess function reducing a multi-level decomposition to the functions of each level"""
+
+    return [sorted(level) for level in data['results']]
+
+
 class TestRisk(object):
     def setUp(self):
         self.client = riskapi_client.connect()
@@ -461,6 +477,31 @@ class TestRisk(object):
                 ("marginal_risk", "marginal_pct",
                  "contribution_risk", "contribution_pct"))
 
+    def test_decode_pool_postprocess(self):
+        expected = level_functions(self.client.multi_level_risk_decomposition(PORTFOLIO, 0.99))
+
+        with riskapi_client.connect(decode_pool=2, decode_threshold=0, coalesce=True) as client:
+            pool = client._decode_pool
+            nt.assert_equal(client.multi_level_risk_decomposition(PORTFOLIO, 0.99, postprocess=level_functions),
+                            expected)
+            # a different postprocess is a different request
+            nt.assert_equal(len(client.multi_level_risk_decomposition(PORTFOLIO, 0.99)['results']),
+                            len(expected))
+
+        # the pool started by the client is terminated with it
+        nt.assert_is_none(client._decode_pool)
+        nt.assert_not_equal(pool._state, multiprocessing.pool.RUN)
+
+        # a pool given by the caller is left alone
+        pool = multiprocessing.Pool(1)
+        try:
+            with riskapi_client.connect(decode_pool=pool, decode_threshold=0) as client:
+                nt.assert_equal(client.multi_level_risk_decomposition(PORTFOLIO, 0.99, postprocess=level_functions),
+                                expected)
+            nt.assert_equal(pool.apply(len, ([1, 2],)), 2)
+        finally:
+            pool.terminate()
+
     def test_multi_level_risk_decomposition_with_parameters(self):
         res = self.client.multi_level_risk_decomposition(
             PORTFOLIO, 0.95, ['var', 'volatility', 'exposure'],
@@ -684,3 +725,444 @@ class TestRisk(object):
         self.check_errors(res)
 
         RiskAttributionDecompositionSchema(res['results'])
+
+
+    def test_scenario_cube(self):
+        codes = [x.code for x in PORTFOLIO.holdings[:5]]
+        directory = tempfile.mkdtemp()
+        try:
+            cube = riskapi_client.ScenarioCube.build(self.client, directory, codes)
+            try:
+                nt.assert_items_equal(cube.codes, codes)
+                nt.assert_equal(cube.version, self.client.data_info()['max_date'])
+
+                for code in codes:
+                    expected = self.client.product(code)['scenarios']
+                    nt.assert_equal(cube.scenarios(code), [list(x) for x in expected])
+            finally:
+                cube.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_local_multi_level_stress_test_decomposition(self):
+        expected = self.client.multi_level_stress_test_decomposition(PORTFOLIO, STRESS_TEST_CODES[:10])
+        res = self.client.local_multi_level_stress_test_decomposition(PORTFOLIO, STRESS_TEST_CODES[:10])
+
+        self.check_errors(res)
+
+        MultiLevelStressTestDecompositionSchema(res['results'])
+
+        nt.assert_equal(len(res['results']), len(expected['results']))
+
+        for row, expected_row in zip(res['results'], expected['results']):
+            nt.assert_items_equal(row.keys(), expected_row.keys())
+            for code, item in row.iteritems():
+                expected_item = dict((tuple(x[0]), x[1]) for x in expected_row[code])
+                nt.assert_items_equal({tuple(x[0]) for x in item}, expected_item.keys())
+                for attributes, value in item:
+                    nt.assert_almost_equal(value, expected_item[tuple(attributes)], places=4)
+
+    def test_local_multi_level_risk_decomposition(self):
+        res = self.client.local_multi_level_risk_decomposition(PORTFOLIO, 0.99)
+
+        self.check_errors(res)
+
+        MultiLevelRiskDecompositionSchema(res['results'])
+
+        # one row per level plus the total
+        nt.assert_equal(len(res['results']), len(self.levels)+1)
+
+        for attrs, item in zip(self.levels, res['results'][1:]):
+            self.check_risk_decomposition_item(
+                item, attrs, riskapi_client.DECOMPOSABLE_RISK_FUNCTIONS,
+                ("contribution_risk", "contribution_pct"))
+
+    def test_stress_test_what_if(self):
+        base = riskapi_client.Portfolio(
+            PORTFOLIO.currency,
+            [riskapi_client.Holding(x.code, None, random.randint(1, 1000), None, x.attributes)
+             for x in PORTFOLIO.holdings])
+        engine = riskapi_client.StressTestWhatIf(self.client, base, STRESS_TEST_CODES[:10])
+
+        variant = riskapi_client.Portfolio(
+            base.currency,
+            [riskapi_client.Holding(x.code, x.price, x.quantity * random.choice([0, 0.5, 2]),
+                                    x.currency_exchange_value, x.attributes)
+             for x in base.holdings])
+
+        for pf in (base, variant):
+            res = engine.stress_test(pf)
+
+            self.check_errors(res)
+
+            StressTestSchema(res['results'])
+
+            expected = dict(self.client.stress_test(pf, STRESS_TEST_CODES[:10])['results'])
+            nt.assert_items_equal([x[0] for x in res['results']], expected.keys())
+            for code, value in res['results']:
+                nt.assert_almost_equal(value, expected[code], places=4)
+
+        nt.assert_equal(engine.server_calls, 1)
+
+        # the P&L of weights is not linear in the holdings
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            riskapi_client.StressTestWhatIf(self.client, PORTFOLIO, STRESS_TEST_CODES[:10])
+
+    def test_coalesced_requests(self):
+        client = riskapi_client.connect(coalesce=True)
+        expected = self.client.local_multi_level_stress_test_decomposition(PORTFOLIO, STRESS_TEST_CODES[:10])
+
+        # slow requests, so that the calls overlap
+        post = client.webclient.post
+
+        def slow_post(*args, **kwargs):
+            time.sleep(0.5)
+            return post(*args, **kwargs)
+
+        client.webclient.post = slow_post
+        try:
+            results = []
+            errors = []
+
+            def run():
+                try:
+                    # every caller gets its own copy of the shared response
+                    results.append(client.local_multi_level_stress_test_decomposition(
+                        PORTFOLIO, STRESS_TEST_CODES[:10]))
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            nt.assert_equal(errors, [])
+            nt.assert_equal(len(results), 8)
+            for res in results:
+                nt.assert_equal(res, expected)
+
+            stats = client.coalesce_stats
+            nt.assert_greater(stats['coalesced'], 0)
+            nt.assert_equal(stats['executed'] + stats['coalesced'], stats['requests'])
+        finally:
+            client.webclient.close()
+
+    def test_sink_coalesced(self):
+        directory = tempfile.mkdtemp()
+        client = riskapi_client.connect(coalesce=True)
+        try:
+            sink = riskapi_client.JSONLSink(os.path.join(directory, "results.jsonl"))
+            client.attach_sink(sink)
+            executed = client.coalesce_stats['executed']
+
+            post = client.webclient.post
+
+            def slow_post(*args, **kwargs):
+                time.sleep(0.5)
+                return post(*args, **kwargs)
+
+            client.webclient.post = slow_post
+
+            results = []
+            errors = []
+
+            def run():
+                try:
+                    results.append(client.risk(PORTFOLIO, [0.95]))
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            client.risk(PORTFOLIO, [0.99])
+            sink.close()
+
+            nt.assert_equal(errors, [])
+            nt.assert_equal(len(results), 4)
+
+            # one record per request sent
+            with open(sink.file_name) as ff:
+                records = [json.loads(line) for line in ff]
+            nt.assert_equal(len(records), client.coalesce_stats['executed'] - executed)
+            nt.assert_less(len(records), 5)
+            nt.assert_equal(len(set(x['request_id'] for x in records)), len(records))
+            nt.assert_equal(len(set(x['request_hash'] for x in records)), 2)
+            nt.assert_equal(set(x['endpoint'] for x in records), set(["risk"]))
+        finally:
+            client.close()
+            shutil.rmtree(directory)
+
+    def test_product_index(self):
+        index = riskapi_client.ProductIndex.from_client(self.client)
+
+        nt.assert_greater(len(index), 0)
+
+        for search in ("US", "us0", "a"):
+            expected = self.client.products(search=search, limit=10)
+            nt.assert_items_equal([x['code'] for x in index.search(search, 10)],
+                                  [x['code'] for x in expected])
+
+        portfolio = riskapi_client.Portfolio(PORTFOLIO.currency, list(PORTFOLIO.holdings),
+                                             PORTFOLIO.type, PORTFOLIO.outstanding)
+        portfolio.add("XXX-NOT-A-PRODUCT")
+
+        checked, errors = index.check(portfolio)
+        nt.assert_equal(len(checked.holdings), len(portfolio.holdings) - len(errors))
+
+        res = self.client.portfolio_info(portfolio)
+        nt.assert_items_equal([x[3][0] for x in errors], [x[3][0] for x in res['errors']])
+
+    def test_products_detail(self):
+        codes = [x.code for x in PORTFOLIO.holdings[:20]]
+
+        res = self.client.products_detail(codes + codes[:5] + ["XXX-NOT-A-PRODUCT"])
+
+        nt.assert_items_equal(res.keys(), set(codes))
+        for code in codes[:3]:
+            nt.assert_equal(res[code], self.client.product(code))
+
+        # served from the cache, as copies
+        expected = {code: self.client.product(code) for code in codes[:5]}
+        res[codes[0]].clear()
+        nt.assert_equal(self.client.products_detail(codes[:5]), expected)
+
+    def test_products_detail_cache(self):
+        codes = [x.code for x in PORTFOLIO.holdings[:20]]
+
+        client = riskapi_client.connect()
+        client.PRODUCTS_CACHE_SIZE = 10
+        try:
+            res = client.products_detail(codes, cache=False)
+            nt.assert_items_equal(res.keys(), codes)
+            nt.assert_equal(len(client._products_cache), 0)
+
+            client.products_detail(codes)
+            nt.assert_equal(client._products_cache.keys(), sorted(codes)[-10:])
+
+            # the dataset version is checked once per ttl
+            client.data_info = None
+            nt.assert_equal(client.products_detail(codes[:5]), {code: res[code] for code in codes[:5]})
+        finally:
+            client.webclient.close()
+
+    def test_portfolio_formats(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for format in ("json", "csv", "msgpack", "columnar"):
+                if format == "msgpack" and riskapi_client.msgpack is None:
+                    continue
+
+                file_name = os.path.join(directory, "portfolio.%s" % format)
+                PORTFOLIO.dump(file_name, format)
+
+                nt.assert_equal(riskapi_client.Portfolio.load(file_name, format).encode(),
+                                PORTFOLIO.encode())
+
+                with riskapi_client.open_portfolio(file_name, format) as reader:
+                    chunks = list(reader.chunks(7))
+                nt.assert_equal(sum(len(x) for x in chunks), len(PORTFOLIO.holdings))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_normalized_portfolio(self):
+        portfolio = riskapi_client.Portfolio(PORTFOLIO.currency, [], PORTFOLIO.type, PORTFOLIO.outstanding)
+        for holding in PORTFOLIO.holdings:
+            for quantity in (holding.quantity / 2, 0, holding.quantity / 2):
+                portfolio.add(holding.code, holding.price, quantity, holding.currency_exchange_value,
+                              holding.attributes, holding.currency, holding.price_factor)
+
+        normalized, rows = portfolio.normalized()
+
+        nt.assert_equal(len(normalized.holdings), len({(x.code, tuple(x.attributes)) for x in PORTFOLIO.holdings}))
+        nt.assert_equal(sorted(sum(rows, [])), range(len(portfolio.holdings)))
+
+        expected = dict(self.client.stress_test(PORTFOLIO, STRESS_TEST_CODES[:10])['results'])
+        res = self.client.stress_test(normalized, STRESS_TEST_CODES[:10])
+        for code, value in res['results']:
+            nt.assert_almost_equal(value, expected[code], places=4)
+
+    def test_catalog_sync(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "catalog.sqlite")
+            with riskapi_client.sync_catalog(self.client, path) as store:
+                products = self.client.products()
+                nt.assert_equal(len(store), len(products))
+                nt.assert_equal(store.get(products[0]['code']), products[0])
+
+                # nothing changed: no page is decoded again
+                stats = store.sync(self.client)
+                nt.assert_equal(stats['changed_pages'], 0)
+                nt.assert_equal(stats['updated'], 0)
+
+                store.db.execute("INSERT INTO products VALUES ('XXX-NOT-A-PRODUCT', NULL, 0, '{}')")
+                store.db.execute("UPDATE pages SET checksum = NULL WHERE page = 0")
+                stats = store.sync(self.client)
+                nt.assert_equal(stats['deleted'], 1)
+                nt.assert_not_in("XXX-NOT-A-PRODUCT", store)
+
+                # the store is not locked while the pages are downloaded
+                other = sqlite3.connect(path, timeout=0, isolation_level=None)
+                raw_client = catalog.raw_client
+
+                def unlocked_raw_client(web):
+                    raw = raw_client(web)
+                    get = raw.get
+
+                    def unlocked_get(*args):
+                        other.execute("BEGIN IMMEDIATE")
+                        other.execute("ROLLBACK")
+                        return get(*args)
+                    raw.get = unlocked_get
+                    return raw
+
+                catalog.raw_client = unlocked_raw_client
+                try:
+                    store.sync(self.client)
+                finally:
+                    catalog.raw_client = raw_client
+                    other.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_report(self):
+        res = self.client.report(PORTFOLIO, BENCHMARK)
+
+        nt.assert_equal(res['errors'], {})
+        nt.assert_items_equal(
+            res['sections'].keys(),
+            list(riskapi_client.RiskapiClient.REPORT_SPEC) + list(riskapi_client.RiskapiClient.RELATIVE_REPORT_SPEC))
+        for name in res['sections']:
+            nt.assert_greater_equal(res['timings']['total'], res['timings'][name])
+
+        nt.assert_equal(res['sections']['stress_test'], self.client.stress_test(PORTFOLIO))
+
+        res = self.client.report(PORTFOLIO, spec=dict(relative=dict(analysis="relative_stress_test_decomposition")))
+        nt.assert_equal(res['sections'], {})
+        nt.assert_in('relative', res['errors'])
+
+    def test_report_request_bodies(self):
+        # the portfolio serialized once gives the same request bodies
+        directory = tempfile.mkdtemp()
+        try:
+            for format in ("json", "msgpack"):
+                with riskapi_client.connect(request_format=format) as client:
+                    sink = riskapi_client.JSONLSink(os.path.join(directory, format + ".jsonl"))
+                    client.attach_sink(sink)
+
+                    spec = dict(risk=dict(params=dict(percentiles=[0.95])),
+                                risk_decomposition=dict(params=dict(percentile=0.99)))
+                    res = client.report(PORTFOLIO, BENCHMARK, spec=spec)
+                    nt.assert_equal(res['errors'], {})
+
+                    client.risk(PORTFOLIO, [0.95])
+                    client.risk_decomposition(PORTFOLIO, 0.99)
+                    sink.close()
+
+                with open(sink.file_name) as ff:
+                    hashes = [json.loads(line)['request_hash'] for line in ff]
+                nt.assert_items_equal(hashes[:2], hashes[2:])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_tracing(self):
+        exporter = riskapi_client.MemoryExporter()
+        client = riskapi_client.connect(tracer=riskapi_client.Tracer(exporter))
+        try:
+            exporter.clear()
+            client.stress_test(PORTFOLIO, STRESS_TEST_CODES[:5])
+
+            root, = [span for span in exporter.spans if span.parent_id is None]
+            nt.assert_equal(root.name, "stress_test")
+
+            names = [span.name for span in exporter.trace(root.trace_id)]
+            for name in ("encode", "request", "attempt", "send", "wait", "download", "decode"):
+                nt.assert_in(name, names)
+
+            request, = [span for span in exporter.spans if span.name == "request"]
+            nt.assert_equal(len(request.attributes['request_id']), 32)
+            for span in exporter.spans:
+                nt.assert_greater_equal(root.duration, span.duration)
+
+            # only the methods sending requests are traced
+            exporter.clear()
+            sink = object()
+            client.attach_sink(sink)
+            client.detach_sink(sink)
+            client.wait_warmup()
+            nt.assert_equal(exporter.spans, [])
+        finally:
+            client.webclient.close()
+
+    def test_report_tracing(self):
+        exporter = riskapi_client.MemoryExporter()
+        with riskapi_client.connect(tracer=riskapi_client.Tracer(exporter)) as client:
+            exporter.clear()
+            spec = dict(risk=dict(params=dict(percentiles=[0.95])),
+                        risk_decomposition=dict(params=dict(percentile=0.99)))
+            report = client.report(PORTFOLIO, spec=spec, max_workers=2)
+            nt.assert_equal(report['errors'], {})
+
+            # the sections run in other threads are part of the report trace
+            root, = [span for span in exporter.spans if span.parent_id is None]
+            nt.assert_equal(root.name, "report")
+            nt.assert_equal(len(exporter.trace(root.trace_id)), len(exporter.spans))
+
+            sections = [span for span in exporter.spans if span.parent_id == root.span_id]
+            nt.assert_items_equal([span.name for span in sections], spec)
+
+            # and so are the product requests sent concurrently by products_detail
+            exporter.clear()
+            client.products_detail([x.code for x in PORTFOLIO.holdings[:10]], max_workers=4, cache=False)
+
+            root, = [span for span in exporter.spans if span.parent_id is None]
+            nt.assert_equal(root.name, "products_detail")
+            products = [span for span in exporter.spans if span.name == "product"]
+            nt.assert_equal(len(products), 10)
+            for span in products:
+                nt.assert_equal(span.parent_id, root.span_id)
+
+    def test_balanced_hosts(self):
+        host = riskapi_client.get_params()[0]
+        # the same host twice and one which refuses the connections
+        client = riskapi_client.connect(host=[host, host, "localhost:1"])
+        try:
+            nt.assert_is_instance(client.webclient, riskapi_client.BalancedHTTPClient)
+            for _ in xrange(10):
+                DataInfoSchema(client.data_info())
+
+            stats = client.webclient.host_stats
+            nt.assert_true(stats[2]['ejected'])
+            nt.assert_equal(sum(x['requests'] - x['errors'] for x in stats), 11)
+        finally:
+            client.webclient.close()
+
+    def test_idle_connections(self):
+        client = riskapi_client.connect(max_idle=0.2)
+        try:
+            client.data_info()
+            client.data_info()
+            time.sleep(0.3)
+            DataInfoSchema(client.data_info())
+
+            stats = client.webclient.connect_stats
+            nt.assert_equal(stats['expired'], 1)
+            nt.assert_greater_equal(stats['reused'], 1)
+        finally:
+            client.webclient.close()
+
+    def test_decomposition_cache(self):
+        client = riskapi_client.connect(decomposition_cache=True)
+        try:
+            client.risk_decomposition(PORTFOLIO, 0.99, ['var', 'volatility'])
+            res = client.risk_decomposition(PORTFOLIO, 0.99, ['var', 'exposure'], fields=['marginal_risk'])
+
+            self.check_risk_decomposition(res, ("var", "exposure"), ("marginal_risk",))
+            nt.assert_equal(client.decomposition_cache.stats, dict(hits=1, misses=1))
+        finally:
+            client.webclient.close()
@@ -0,0 +1,138 @@
+import copy
+import json
+
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.projection import DecompositionCache, project_risk_decomposition
+
+RESULTS = dict(
+    var=[dict(attributes=[u"Equity"], contribution_pct=1.0, contribution_risk=0.5, marginal_risk=0.1),
+         dict(attributes=[u"Bond"], contribution_pct=2.0, contribution_risk=1.5, marginal_risk=0.2)],
+    expected_shortfall=[dict(attributes=[u"Equity"], contribution_pct=3.0, contribution_risk=2.5,
+                             marginal_risk=0.3)],
+    exposure=[dict(attributes=[u"Equity"], exposure=10.0)])
+
+RESPONSE = dict(errors=[], results=RESULTS)
+
+
+class FakeWebClient(object):
+    """answer every post with the canned response, recording the requests"""
+
+    max_connections = 1
+
+    def __init__(self, response=RESPONSE):
+        self.response = response
+        self.requests = []
+
+    def get(self, path, params=None, headers=None, postprocess=None):
+        return dict(data=[u"risk"])
+
+    def post(self, path, body, headers=None, postprocess=None):
+        self.requests.append((path, json.loads(body)))
+        return copy.deepcopy(self.response)
+
+    def close(self):
+        pass
+
+
+def fake_client(webclient, **kwargs):
+    # a RiskapiClient sending its requests to webclient
+    http_client = riskapi_client.HTTPClient
+    riskapi_client.HTTPClient = lambda *args, **kwargs: webclient
+    try:
+        return riskapi_client.RiskapiClient("localhost", **kwargs)
+    finally:
+        riskapi_client.HTTPClient = http_client
+
+
+def portfolio():
+    portfolio = riskapi_client.Portfolio("EUR")
+    portfolio.add(u"US0003041052", quantity=13000, attributes=[u"Equity"])
+    portfolio.add(u"US000324AA15", quantity=10000, attributes=[u"Bond"])
+    return portfolio
+
+
+def test_project():
+    projected = project_risk_decomposition(RESULTS, ["var", "exposure"], ["contribution_pct"])
+    nt.assert_equal(projected, dict(
+        var=[dict(attributes=[u"Equity"], contribution_pct=1.0),
+             dict(attributes=[u"Bond"], contribution_pct=2.0)],
+        exposure=RESULTS['exposure']))
+
+    # the rows are copies
+    projected['exposure'][0]['attributes'].append(u"US")
+    nt.assert_equal(RESULTS['exposure'][0]['attributes'], [u"Equity"])
+
+    multi_level = project_risk_decomposition([RESULTS, RESULTS], ["expected_shortfall"], ["contribution_risk"])
+    nt.assert_equal(multi_level,
+                    [dict(expected_shortfall=[dict(attributes=[u"Equity"], contribution_risk=2.5)])] * 2)
+
+
+def test_cache_superset():
+    cache = DecompositionCache(upgrade=False)
+    cache.put("key", ["var", "expected_shortfall"], ["contribution_pct", "contribution_risk"], RESPONSE)
+
+    nt.assert_equal(cache.get("key", ["var"], ["contribution_pct"])['results'],
+                    project_risk_decomposition(RESULTS, ["var"], ["contribution_pct"]))
+    nt.assert_is_none(cache.get("key", ["var", "exposure"], ["contribution_pct"]))
+    nt.assert_is_none(cache.get("key", ["var"], ["marginal_risk"]))
+    nt.assert_is_none(cache.get("other", ["var"], ["contribution_pct"]))
+    nt.assert_equal(cache.stats, dict(hits=1, misses=3))
+
+    # a superset replaces the entries it answers
+    cache.put("key", ["var", "expected_shortfall", "exposure"], ["contribution_pct", "contribution_risk"],
+              RESPONSE)
+    nt.assert_equal(len(cache.entries["key"]), 1)
+    nt.assert_is_not_none(cache.get("key", ["exposure"], []))
+
+
+def test_cache_eviction():
+    cache = DecompositionCache(max_entries=2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, ["var"], ["contribution_pct"], RESPONSE)
+    nt.assert_equal(list(cache.entries), ["b", "c"])
+
+    # least recently used first
+    cache.get("b", ["var"], ["contribution_pct"])
+    cache.put("d", ["var"], ["contribution_pct"], RESPONSE)
+    nt.assert_equal(list(cache.entries), ["b", "d"])
+
+
+def test_cache_max_age():
+    cache = DecompositionCache(max_age=0.0)
+    cache.put("key", ["var"], ["contribution_pct"], RESPONSE)
+    cache.entries["key"] = [entry[:2] + (entry[2] - 1,) + entry[3:] for entry in cache.entries["key"]]
+    nt.assert_is_none(cache.get("key", ["var"], ["contribution_pct"]))
+    nt.assert_not_in("key", cache.entries)
+
+
+def test_client_cache():
+    webclient = FakeWebClient()
+    client = fake_client(webclient, decomposition_cache=True)
+
+    res = client.risk_decomposition(portfolio(), 0.99, ["var"], fields=["contribution_pct"])
+    nt.assert_equal(res['results'], project_risk_decomposition(RESULTS, ["var"], ["contribution_pct"]))
+
+    # the first request is upgraded to all the functions and fields
+    nt.assert_equal(len(webclient.requests), 1)
+    nt.assert_equal(webclient.requests[0][1]['functions'],
+                    riskapi_client.DECOMPOSABLE_RISK_FUNCTIONS + ['exposure'])
+
+    # the same portfolio, encoded in advance or not, is answered by the cache
+    encoded = riskapi_client.EncodedPortfolio(portfolio())
+    res = client.risk_decomposition(encoded, 0.99, ["expected_shortfall", "exposure"])
+    nt.assert_equal(res['results'], project_risk_decomposition(
+        RESULTS, ["expected_shortfall", "exposure"], riskapi_client.RISK_DECOMPOSITION_FIELDS))
+    client.risk_decomposition(portfolio(), 0.99, ["var"])
+    nt.assert_equal(len(webclient.requests), 1)
+    nt.assert_equal(client.decomposition_cache.stats, dict(hits=2, misses=1))
+
+    # other parameters are requested again
+    client.risk_decomposition(portfolio(), 0.95, ["var"])
+    nt.assert_equal(len(webclient.requests), 2)
+
+    # the cached response is not modified by the callers
+    res['results']['expected_shortfall'][0]['contribution_pct'] = None
+    res = client.risk_decomposition(portfolio(), 0.99, ["expected_shortfall"])
+    nt.assert_equal(res['results']['expected_shortfall'][0]['contribution_pct'], 3.0)
@@ -0,0 +1,119 @@
+import json
+import threading
+
+import nose.tools as nt
+
+import riskapi_client
+
+# canned responses, by resource
+RESPONSES = {
+    "statics/portfolio-info": dict(errors=[], results=dict(count=2)),
+    "risk": dict(errors=[], results=[[0.95, 1.5], [0.99, 2.5]]),
+    "stress-test": dict(errors=[], results=[[u"ST1", -10.0]]),
+    "liquidity-risk": dict(errors=[], results=dict(days=3)),
+    "risk/decomposition": dict(errors=[], results=dict(var=[])),
+    "risk/decomposition/relative": dict(errors=[], results=dict(var=[])),
+    "stress-test/decomposition/relative": dict(errors=[], results={u"ST1": []}),
+}
+
+
+class FakeWebClient(object):
+    """answer the posts with the canned responses, recording the request bodies"""
+
+    max_connections = 4
+
+    def __init__(self):
+        self.bodies = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, params=None, headers=None, postprocess=None):
+        return dict(data=[u"risk"])
+
+    def post(self, path, body, headers=None, postprocess=None):
+        resource = path.split("/api/v1/", 1)[1]
+        with self.lock:
+            self.bodies[resource] = body
+        if resource not in RESPONSES:
+            raise riskapi_client.HTTPError(404)
+        return RESPONSES[resource]
+
+    def close(self):
+        pass
+
+
+def fake_client(webclient, **kwargs):
+    # a RiskapiClient sending its requests to webclient
+    http_client = riskapi_client.HTTPClient
+    riskapi_client.HTTPClient = lambda *args, **kwargs: webclient
+    try:
+        return riskapi_client.RiskapiClient("localhost", **kwargs)
+    finally:
+        riskapi_client.HTTPClient = http_client
+
+
+def portfolio(code):
+    portfolio = riskapi_client.Portfolio("EUR")
+    portfolio.add(code, quantity=13000, attributes=[u"Equity"])
+    return portfolio
+
+
+def test_report():
+    webclient = FakeWebClient()
+    client = fake_client(webclient)
+
+    res = client.report(portfolio(u"US0003041052"), portfolio(u"US000324AA15"))
+
+    nt.assert_equal(res['errors'], {})
+    nt.assert_equal(res['sections'], dict(
+        portfolio_info=RESPONSES["statics/portfolio-info"],
+        risk=RESPONSES["risk"],
+        stress_test=RESPONSES["stress-test"],
+        liquidity_risk=RESPONSES["liquidity-risk"],
+        risk_decomposition=RESPONSES["risk/decomposition"],
+        relative_risk_decomposition=RESPONSES["risk/decomposition/relative"],
+        relative_stress_test_decomposition=RESPONSES["stress-test/decomposition/relative"]))
+    nt.assert_items_equal(res['timings'], list(res['sections']) + ["encode", "total"])
+
+    for resource, body in webclient.bodies.iteritems():
+        request = json.loads(body)
+        nt.assert_equal(request['portfolio'], portfolio(u"US0003041052").encode())
+        if resource.endswith("/relative"):
+            nt.assert_equal(request['benchmark'], portfolio(u"US000324AA15").encode())
+
+    nt.assert_equal(json.loads(webclient.bodies["risk"])['percentiles'], [0.95, 0.99])
+
+
+def test_report_without_benchmark():
+    client = fake_client(FakeWebClient())
+
+    res = client.report(portfolio(u"US0003041052"))
+    nt.assert_items_equal(res['sections'], riskapi_client.RiskapiClient.REPORT_SPEC)
+    nt.assert_equal(res['errors'], {})
+
+
+def test_report_errors():
+    client = fake_client(FakeWebClient())
+
+    spec = dict(relative=dict(analysis="relative_stress_test_decomposition"),
+                incomplete=dict(analysis="risk"),
+                failing=dict(analysis="stress_test_decomposition"),
+                stress_test=dict(params=dict(codes=[u"ST1"])))
+    res = client.report(portfolio(u"US0003041052"), spec=spec)
+
+    nt.assert_equal(res['sections'], dict(stress_test=RESPONSES["stress-test"]))
+    nt.assert_equal(res['errors']['relative'], "RiskapiClientError: A benchmark is required")
+    nt.assert_equal(res['errors']['failing'], "HTTPError: Not Found")
+    nt.assert_true(res['errors']['incomplete'].startswith("TypeError"))
+
+
+def test_report_msgpack():
+    if riskapi_client.msgpack is None:
+        return
+
+    webclient = FakeWebClient()
+    client = fake_client(webclient, request_format="msgpack")
+    res = client.report(portfolio(u"US0003041052"), spec=dict(risk=dict(params=dict(percentiles=[0.99]))))
+    nt.assert_equal(res['errors'], {})
+
+    request = riskapi_client.msgpack.unpackb(webclient.bodies["risk"])
+    nt.assert_equal(request['portfolio'], portfolio(u"US0003041052").encode())
@@ -0,0 +1,68 @@
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client import rollup
+
+
+STRESS_TEST_RESULTS = {
+    u"ST1": [[[u"Equity", u"US"], 1.0], [[u"Equity", u"EU"], 2.0], [[u"Bond", u"US"], -0.5]],
+    u"ST2": [[[u"Equity", u"US"], 0.25], [[u"Bond"], 4.0]],
+}
+
+RISK_RESULTS = dict(
+    var=[dict(attributes=[u"Equity", u"US"], contribution_risk=1.0, contribution_pct=0.1),
+         dict(attributes=[u"Equity", u"EU"], contribution_risk=2.0, contribution_pct=0.2),
+         dict(attributes=[u"Bond", u"US"], contribution_risk=3.0, contribution_pct=None)],
+    exposure=[dict(attributes=[u"Equity", u"US"], exposure=100.0),
+              dict(attributes=[u"Equity", u"EU"], exposure=50.0),
+              dict(attributes=[u"Bond", u"US"], exposure=25.0)])
+
+
+def test_stress_test_rollup():
+    levels = rollup.rollup_stress_test_decomposition(STRESS_TEST_RESULTS)
+
+    nt.assert_equal(len(levels), 3)
+    nt.assert_equal(levels[0], {u"ST1": [[[], 2.5]], u"ST2": [[[], 4.25]]})
+    nt.assert_equal(levels[1], {u"ST1": [[[u"Equity"], 3.0], [[u"Bond"], -0.5]],
+                                u"ST2": [[[u"Equity"], 0.25], [[u"Bond"], 4.0]]})
+
+    # the finest level is the decomposition itself, shorter attributes lists included
+    nt.assert_equal(levels[2], STRESS_TEST_RESULTS)
+
+
+def test_stress_test_rollup_depth():
+    levels = rollup.rollup_stress_test_decomposition(STRESS_TEST_RESULTS, depth=1)
+    nt.assert_equal(len(levels), 2)
+
+    nt.assert_equal(rollup.rollup_stress_test_decomposition({}), [{}])
+
+
+def test_risk_rollup():
+    levels = rollup.rollup_risk_decomposition(RISK_RESULTS)
+
+    nt.assert_equal(len(levels), 3)
+    nt.assert_equal(levels[0], dict(var=6.0, exposure=175.0))
+    nt.assert_equal(levels[1], dict(
+        var=[dict(attributes=[u"Equity"], contribution_risk=3.0, contribution_pct=0.1 + 0.2),
+             dict(attributes=[u"Bond"], contribution_risk=3.0, contribution_pct=None)],
+        exposure=[dict(attributes=[u"Equity"], exposure=150.0), dict(attributes=[u"Bond"], exposure=25.0)]))
+    nt.assert_equal(levels[2], RISK_RESULTS)
+
+    # new rows, the results are not modified
+    levels[2]['var'][0]['contribution_risk'] = None
+    nt.assert_equal(RISK_RESULTS['var'][0]['contribution_risk'], 1.0)
+
+
+def test_risk_rollup_missing_values():
+    # a missing value makes the sums of its groups missing, the total skips it
+    results = dict(var=[dict(attributes=[u"A", u"B"], contribution_risk=None),
+                        dict(attributes=[u"A", u"C"], contribution_risk=1.5)])
+    levels = rollup.rollup_risk_decomposition(results)
+    nt.assert_equal(levels[0], dict(var=1.5))
+    nt.assert_equal(levels[1], dict(var=[dict(attributes=[u"A"], contribution_risk=None)]))
+
+
+def test_risk_rollup_not_additive():
+    results = dict(var=[dict(attributes=[u"A"], contribution_risk=1.0, marginal_risk=0.5)])
+    with nt.assert_raises(riskapi_client.RiskapiClientError):
+        rollup.rollup_risk_decomposition(results)
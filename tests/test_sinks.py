@@ -0,0 +1,94 @@
+import os
+import json
+import shutil
+import struct
+import tempfile
+
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client.sinks import JSONLSink, MsgpackSink, ColumnarSink, read_columnar
+
+RECORDS = [dict(endpoint="risk", request_id="%032x" % i, time=1.5 * i,
+                result=dict(results=[dict(value=float(i), name=u"caf\xe9")]))
+           for i in range(25)]
+
+
+class TestSinks(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_invalid_fsync(self):
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            JSONLSink(self.path("results.jsonl"), fsync="always")
+
+    def test_jsonl(self):
+        with JSONLSink(self.path("results.jsonl"), buffer_size=10, fsync="flush") as sink:
+            for record in RECORDS:
+                sink.write(record)
+            nt.assert_equal(sink.count, len(RECORDS))
+
+        with open(self.path("results.jsonl")) as ff:
+            nt.assert_equal([json.loads(line) for line in ff], RECORDS)
+
+    def test_msgpack(self):
+        import msgpack
+
+        with MsgpackSink(self.path("results.msgpack"), buffer_size=10) as sink:
+            for record in RECORDS:
+                sink.write(record)
+
+        with open(self.path("results.msgpack"), "rb") as ff:
+            nt.assert_equal(len(list(msgpack.Unpacker(ff))), len(RECORDS))
+
+    def test_columnar(self):
+        with ColumnarSink(self.path("results.col"), buffer_size=10) as sink:
+            for record in RECORDS:
+                sink.write(record)
+            sink.flush()
+            sink.write(dict(extra=True))
+
+        records = list(read_columnar(self.path("results.col")))
+        nt.assert_equal(records[:-1], RECORDS)
+        nt.assert_equal(records[-1], dict(extra=True))
+
+        # the sink appends new blocks to an existing file
+        with ColumnarSink(self.path("results.col")) as sink:
+            sink.write(RECORDS[0])
+        nt.assert_equal(list(read_columnar(self.path("results.col")))[-1], RECORDS[0])
+
+    def test_columnar_columns(self):
+        with ColumnarSink(self.path("results.col"), buffer_size=7) as sink:
+            for record in RECORDS:
+                sink.write(record)
+
+        nt.assert_equal(list(read_columnar(self.path("results.col"), columns=["time", "request_id"])),
+                        [dict(time=x['time'], request_id=x['request_id']) for x in RECORDS])
+
+    def test_columnar_truncated(self):
+        with ColumnarSink(self.path("results.col"), buffer_size=10) as sink:
+            for record in RECORDS[:20]:
+                sink.write(record)
+
+        # a block partly written by a crash is ignored
+        size = os.path.getsize(self.path("results.col"))
+        with open(self.path("results.col"), "ab") as ff:
+            ff.write(struct.pack("<Q", 5) + "abc")
+        nt.assert_equal(len(list(read_columnar(self.path("results.col")))), 20)
+
+        with open(self.path("results.col"), "r+b") as ff:
+            ff.truncate(size - 3)
+        nt.assert_equal(list(read_columnar(self.path("results.col"), columns=["time"])),
+                        [dict(time=x['time']) for x in RECORDS[:10]])
+
+    def test_not_columnar(self):
+        with open(self.path("results.jsonl"), "w") as ff:
+            ff.write("{}\n")
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            list(read_columnar(self.path("results.jsonl")))
@@ -0,0 +1,108 @@
+import gzip
+import json
+import tempfile
+from cStringIO import StringIO
+
+import msgpack
+import msgpack.fallback
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client import SpooledBody
+
+MAP = {"results": [1, 2, 3], "errors": [], "name": "portfolio"}
+ARRAY = [dict(code="X%s" % i, value=float(i)) for i in range(100)]
+
+
+def spooled(data, format, gzipped=False):
+    if format == "msgpack":
+        body = msgpack.packb(data, use_bin_type=False)
+    else:
+        body = json.dumps(data)
+
+    if gzipped:
+        writer = StringIO()
+        with gzip.GzipFile(fileobj=writer, mode="wb") as ff:
+            ff.write(body)
+        body = writer.getvalue()
+
+    file = tempfile.TemporaryFile()
+    file.write(body)
+    return SpooledBody(file, len(body), format, gzipped)
+
+
+def check_stream(format, gzipped=False):
+    with spooled(MAP, format, gzipped) as body:
+        nt.assert_equal(dict(body.stream()), MAP)
+        # the body can be read again
+        nt.assert_equal(body.decode(), MAP)
+
+    with spooled(ARRAY, format, gzipped) as body:
+        nt.assert_equal(list(body.stream()), ARRAY)
+
+    with spooled({}, format, gzipped) as body:
+        nt.assert_equal(list(body.stream()), [])
+
+    with spooled([], format, gzipped) as body:
+        nt.assert_equal(list(body.stream()), [])
+
+
+def test_stream():
+    for format in ("msgpack", "json"):
+        for gzipped in (False, True):
+            yield check_stream, format, gzipped
+
+
+def test_stream_large_headers():
+    # map16 and array32 headers
+    data = {"k%s" % i: i for i in range(100)}
+    with spooled(data, "msgpack") as body:
+        nt.assert_equal(dict(body.stream()), data)
+
+    data = range(70000)
+    with spooled(data, "msgpack") as body:
+        nt.assert_equal(list(body.stream()), data)
+
+
+def test_stream_pure_python_msgpack():
+    unpacker = riskapi_client.msgpack.Unpacker
+    riskapi_client.msgpack.Unpacker = msgpack.fallback.Unpacker
+    try:
+        check_stream("msgpack")
+    finally:
+        riskapi_client.msgpack.Unpacker = unpacker
+
+
+def test_stream_scalar():
+    with spooled(42, "msgpack") as body:
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            list(body.stream())
+
+
+class RecordingFile(object):
+    """a file recording the sizes of its reads"""
+
+    def __init__(self, body):
+        self.file = StringIO(body)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return self.file.read(size)
+
+    def seek(self, pos):
+        self.file.seek(pos)
+
+    def close(self):
+        pass
+
+
+def test_decode_msgpack_by_chunks():
+    data = [dict(code="X%s" % i, value=float(i)) for i in range(50000)]
+    body = msgpack.packb(data)
+    nt.assert_greater(len(body), 4 * SpooledBody.READ_SIZE)
+
+    file = RecordingFile(body)
+    with SpooledBody(file, len(body), "msgpack") as spooled_body:
+        nt.assert_equal(spooled_body.decode(), data)
+    nt.assert_true(all(0 < size <= SpooledBody.READ_SIZE for size in file.reads))
@@ -0,0 +1,114 @@
+import time
+
+import nose.tools as nt
+
+from riskapi_client import HTTPClient
+from riskapi_client.throttle import AIMDLimiter
+
+
+class FakeResponse(object):
+    def __init__(self, retry_after=None):
+        self.retry_after = retry_after
+
+    def getheader(self, name, default=None):
+        return self.retry_after if name == 'Retry-After' else default
+
+
+def release(limiter, latency, overloaded=False, endpoint=None):
+    limiter.acquire()
+    limiter.release(latency, overloaded, endpoint)
+
+
+def test_additive_increase():
+    limiter = AIMDLimiter(initial=4, maximum=6)
+    for _ in xrange(4):
+        release(limiter, 0.01)
+    nt.assert_true(4.8 < limiter.limit < 5.0)
+
+    for _ in xrange(100):
+        release(limiter, 0.01)
+    nt.assert_equal(limiter.limit, 6)
+    nt.assert_equal(limiter.in_flight, 0)
+
+
+def test_overloaded_decrease():
+    limiter = AIMDLimiter(initial=8, minimum=2)
+    release(limiter, 0.01, overloaded=True)
+    nt.assert_equal(limiter.limit, 4)
+    nt.assert_equal(limiter.stats['overloaded'], 1)
+
+    # failures of requests sent together count once
+    release(limiter, 0.01, overloaded=True)
+    nt.assert_equal(limiter.limit, 4)
+
+    limiter.last_decrease = 0.0
+    release(limiter, 0.01, overloaded=True)
+    limiter.last_decrease = 0.0
+    release(limiter, 0.01, overloaded=True)
+    nt.assert_equal(limiter.limit, 2)
+    nt.assert_equal(limiter.stats['decreases'], 3)
+
+
+def test_latency_decrease():
+    limiter = AIMDLimiter(initial=8)
+    for _ in xrange(10):
+        release(limiter, 0.01, endpoint="GET /fast")
+    limit = limiter.limit
+
+    for _ in xrange(20):
+        release(limiter, 1.0, endpoint="GET /fast")
+    nt.assert_true(limiter.limit < limit)
+    nt.assert_true(limiter.latency("GET /fast") > 0.5)
+
+
+def test_latency_per_endpoint():
+    # a slow endpoint is not compared with the baseline of a fast one
+    limiter = AIMDLimiter(initial=8)
+    for _ in xrange(10):
+        release(limiter, 0.01, endpoint="GET /fast")
+        release(limiter, 1.0, endpoint="POST /slow")
+    nt.assert_equal(limiter.stats['decreases'], 0)
+    nt.assert_true(limiter.limit > 8)
+    nt.assert_almost_equal(limiter.latency("POST /slow"), 1.0)
+    nt.assert_is_none(limiter.latency("GET /other"))
+
+
+def test_max_endpoints():
+    limiter = AIMDLimiter(max_endpoints=2)
+    for endpoint in ("a", "b", "a", "c"):
+        release(limiter, 0.01, endpoint=endpoint)
+    nt.assert_equal(list(limiter.endpoints), ["a", "c"])
+
+
+def test_acquire_waits_for_a_slot():
+    limiter = AIMDLimiter(initial=1)
+    limiter.acquire()
+    nt.assert_equal(limiter.in_flight, 1)
+    limiter.release(0.01)
+    limiter.acquire()
+    nt.assert_equal(limiter.in_flight, 1)
+
+
+def test_retry_after():
+    nt.assert_equal(HTTPClient._retry_after(FakeResponse(), 0), 0.1)
+    nt.assert_equal(HTTPClient._retry_after(FakeResponse("2"), 0), 2.0)
+    # never shorter than the backoff
+    nt.assert_equal(HTTPClient._retry_after(FakeResponse("0"), 3), 0.8)
+    nt.assert_equal(HTTPClient._retry_after(FakeResponse("garbage"), 1), 0.2)
+    # capped
+    nt.assert_equal(HTTPClient._retry_after(FakeResponse("86400"), 0), HTTPClient.MAX_RETRY_AFTER)
+
+    date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    nt.assert_true(25 < HTTPClient._retry_after(FakeResponse(date), 0) <= 30)
+    date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 86400 * 365))
+    nt.assert_equal(HTTPClient._retry_after(FakeResponse(date), 0), HTTPClient.MAX_RETRY_AFTER)
+
+
+def test_endpoint():
+    nt.assert_equal(HTTPClient._endpoint("GET", "/api/v1/statics/products/US0003041052"),
+                    "GET /api/v1/statics/products/{code}")
+    nt.assert_equal(HTTPClient._endpoint("GET", "/c/api/v1/statics/products/A%2FB?x=1"),
+                    "GET /c/api/v1/statics/products/{code}")
+    nt.assert_equal(HTTPClient._endpoint("GET", "/api/v1/statics/products?start=0&limit=10"),
+                    "GET /api/v1/statics/products")
+    nt.assert_equal(HTTPClient._endpoint("POST", "/api/v1/risk/decomposition"), "POST /api/v1/risk/decomposition")
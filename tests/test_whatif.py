@@ -0,0 +1,105 @@
+import nose.tools as nt
+
+import riskapi_client
+from riskapi_client import whatif
+
+# per-unit P&L of every product in every scenario
+PNL = {
+    u"ST1": {u"A": 1.0, u"B": -2.0, u"C": 0.5},
+    u"ST2": {u"A": 0.25, u"B": 3.0, u"C": -1.0},
+}
+
+
+def uncovered(code):
+    return [2, u"uncovered", u"Client code not found: %r" % code, [code, None]]
+
+
+class FakeClient(object):
+    """compute the stress tests from PNL, recording the portfolios of the decompositions"""
+
+    def __init__(self):
+        self.decomposed = []
+
+    def stress_test_decomposition(self, portfolio, codes=None):
+        self.decomposed.append([holding.code for holding in portfolio.holdings])
+
+        results = {}
+        for scenario in codes or sorted(PNL):
+            results[scenario] = [[holding.attributes, PNL[scenario][holding.code] * holding.quantity]
+                                 for holding in portfolio.holdings if holding.code in PNL[scenario]]
+        errors = [uncovered(holding.code) for holding in portfolio.holdings if holding.code not in PNL[u"ST1"]]
+        return dict(errors=errors, results=results)
+
+    def stress_test(self, portfolio, codes=None):
+        results = []
+        for scenario in codes or sorted(PNL):
+            results.append([scenario, sum(PNL[scenario].get(holding.code, 0.0) * holding.quantity
+                                          for holding in portfolio.holdings)])
+        errors = [uncovered(holding.code) for holding in portfolio.holdings if holding.code not in PNL[u"ST1"]]
+        return dict(errors=errors, results=results)
+
+
+def portfolio(*holdings):
+    portfolio = riskapi_client.Portfolio("EUR")
+    for code, quantity in holdings:
+        portfolio.add(code, quantity=quantity, attributes=[u"Equity"])
+    return portfolio
+
+
+class TestStressTestWhatIf(object):
+    def setup(self):
+        self.numpy = whatif.numpy
+
+    def teardown(self):
+        whatif.numpy = self.numpy
+
+    def check_variants(self, numpy):
+        whatif.numpy = numpy
+        client = FakeClient()
+        engine = whatif.StressTestWhatIf(client, portfolio((u"A", 10), (u"B", 5), (u"A", 2)))
+        nt.assert_equal(client.decomposed, [[u"A", u"B"]])
+        nt.assert_equal(engine.scenarios, [u"ST1", u"ST2"])
+
+        for variant in [portfolio((u"A", 10), (u"B", 5)), portfolio((u"B", -1.5)), portfolio()]:
+            res = engine.stress_test(variant)
+            nt.assert_equal(res, client.stress_test(variant))
+        nt.assert_equal(engine.server_calls, 1)
+
+        # only the new products are asked to the server
+        variant = portfolio((u"A", 1), (u"C", 4))
+        nt.assert_equal(engine.stress_test(variant), client.stress_test(variant))
+        nt.assert_equal(client.decomposed, [[u"A", u"B"], [u"C"]])
+        nt.assert_equal(engine.server_calls, 2)
+
+    def test_variants(self):
+        yield self.check_variants, None
+        if whatif.numpy is not None:
+            yield self.check_variants, whatif.numpy
+
+    def test_scenario_codes(self):
+        client = FakeClient()
+        engine = whatif.StressTestWhatIf(client, portfolio((u"A", 1)), [u"ST2"])
+        nt.assert_equal(engine.stress_test(portfolio((u"A", 4)))['results'], [[u"ST2", 1.0]])
+
+    def test_uncovered(self):
+        client = FakeClient()
+        engine = whatif.StressTestWhatIf(client, portfolio((u"A", 1), (u"X", 1)))
+
+        res = engine.stress_test(portfolio((u"X", 2), (u"A", 2)))
+        nt.assert_equal(res, client.stress_test(portfolio((u"X", 2), (u"A", 2))))
+        nt.assert_equal(engine.stress_test(portfolio((u"A", 2)))['errors'], [])
+
+    def test_different_base(self):
+        client = FakeClient()
+        engine = whatif.StressTestWhatIf(client, portfolio((u"A", 1)))
+
+        variant = riskapi_client.Portfolio("USD")
+        variant.add(u"B", quantity=3)
+        nt.assert_equal(engine.stress_test(variant), client.stress_test(variant))
+        nt.assert_equal(engine.server_calls, 2)
+        nt.assert_equal(client.decomposed, [[u"A"]])
+
+    def test_weights(self):
+        weights = riskapi_client.Portfolio("EUR", type_="weights")
+        with nt.assert_raises(riskapi_client.RiskapiClientError):
+            whatif.StressTestWhatIf(FakeClient(), weights)